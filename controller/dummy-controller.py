@@ -12,14 +12,103 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'../util
 
 import p4runtime_lib.bmv2
 import p4runtime_lib.helper
+from p4runtime_lib.acl import ALLOW, DENY, AclCompiler, AclPolicy
+from p4runtime_lib.counters import CounterCollector
+from p4runtime_lib.decode import EntityDecoder
 from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.fib import FibBuilder
+from p4runtime_lib.provision import SwitchProvisioner, bringupSteps
+from p4runtime_lib.reconcile import DesiredEntries, reconcile
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from p4runtime_lib.timeseries import TimeSeriesStore
+from topo_spec import TopoSpec, loadSpec
+
+# Memory budget of the counter time-series store
+COUNTER_STORE_MAX_BYTES = 64 * 1024 * 1024
 
 #port mac mapping
 port_mac_mapping_r1 = {1: "00:aa:bb:00:00:03", 2: "00:aa:bb:00:00:02", 3:"00:aa:bb:00:00:01"}
 port_mac_mapping_r2 = {1: "00:aa:dd:00:00:01", 2: "00:aa:dd:00:00:03", 3:"00:aa:dd:00:00:02"}
 port_mac_mapping_r3 = {1: "00:aa:cc:00:00:02", 2: "00:aa:cc:00:00:03", 3:"00:aa:cc:00:00:01"}
 
+# routes: (dstAddr, mask, nextHop, port, dstMac)
+# firewall: (srcAddr, mask, dstAddr, protocol, dstPorts, srcPorts), packets
+#           from srcAddr/mask to dstAddr are dropped unless their TCP
+#           destination port is in dstPorts or their source port in srcPorts
+# allowed_protocols: IPv4 protocols that are not dropped
+# icmp_interfaces: router addresses answering to ICMP echo requests
+ROUTERS = [
+    {
+        'name': 'r1',
+        'address': '127.0.0.1:50051',
+        'device_id': 1,
+        'port_mac': port_mac_mapping_r1,
+        'routes': [
+            ("10.0.1.10",  32, "10.0.1.10",  3, "00:04:00:00:00:20"),
+            ("10.0.1.20",  32, "10.0.1.20",  3, "00:04:00:00:00:30"),
+            ("10.0.1.100", 32, "10.0.1.100", 3, "00:04:00:00:00:01"),
+            ("10.0.2.0",   24, "10.0.2.251", 1, "00:aa:dd:00:00:01"),
+            ("10.0.3.0",   24, "10.0.3.254", 2, "00:aa:cc:00:00:02"),
+        ],
+        'firewall': [
+            ("10.0.2.0", 24, "10.0.1.10",  6, [],    [80]),
+            ("10.0.2.0", 24, "10.0.1.100", 6, [],    [80]),
+            ("10.0.3.0", 24, "10.0.1.20",  6, [],    [8080]),
+            ("10.0.3.0", 24, "10.0.1.100", 6, [],    [8080]),
+            ("10.0.2.0", 24, "10.0.1.20",  6, [25],  [80]),
+            ("10.0.3.0", 24, "10.0.1.10",  6, [443], [8080]),
+        ],
+        'allowed_protocols': [0, 1, 6],
+        'icmp_interfaces': ["10.0.1.254", "10.0.1.253", "10.0.1.252"],
+    },
+    {
+        'name': 'r2',
+        'address': '127.0.0.1:50052',
+        'device_id': 2,
+        'port_mac': port_mac_mapping_r2,
+        'routes': [
+            ("10.0.2.10",  32, "10.0.2.10",  3, "00:04:00:00:00:40"),
+            ("10.0.2.20",  32, "10.0.2.20",  3, "00:04:00:00:00:50"),
+            ("10.0.2.100", 32, "10.0.2.100", 3, "00:04:00:00:00:03"),
+            ("10.0.1.0",   24, "10.0.1.252", 1, "00:aa:bb:00:00:03"),
+            ("10.0.3.0",   24, "10.0.3.252", 2, "00:aa:cc:00:00:03"),
+        ],
+        'firewall': [
+            ("10.0.1.0", 24, "10.0.2.20",  6, [],    [25]),
+            ("10.0.1.0", 24, "10.0.2.100", 6, [],    [25]),
+            ("10.0.3.0", 24, "10.0.2.10",  6, [],    [443]),
+            ("10.0.3.0", 24, "10.0.2.100", 6, [],    [443]),
+            ("10.0.1.0", 24, "10.0.2.10",  6, [80],  [25]),
+            ("10.0.3.0", 24, "10.0.2.20",  6, [22],  [443]),
+        ],
+        'allowed_protocols': [0, 1, 6],
+        'icmp_interfaces': ["10.0.2.251", "10.0.2.252", "10.0.2.250"],
+    },
+    {
+        'name': 'r3',
+        'address': '127.0.0.1:50053',
+        'device_id': 3,
+        'port_mac': port_mac_mapping_r3,
+        'routes': [
+            ("10.0.3.10",  32, "10.0.3.10",  3, "00:04:00:00:00:60"),
+            ("10.0.3.20",  32, "10.0.3.20",  3, "00:04:00:00:00:70"),
+            ("10.0.3.100", 32, "10.0.3.100", 3, "00:04:00:00:00:02"),
+            ("10.0.1.0",   24, "10.0.1.253", 1, "00:aa:bb:00:00:02"),
+            ("10.0.2.0",   24, "10.0.2.252", 2, "00:aa:dd:00:00:03"),
+        ],
+        'firewall': [
+            ("10.0.1.0", 24, "10.0.3.20",  6, [],    [443]),
+            ("10.0.1.0", 24, "10.0.3.100", 6, [],    [443]),
+            ("10.0.2.0", 24, "10.0.3.10",  6, [],    [22]),
+            ("10.0.2.0", 24, "10.0.3.100", 6, [],    [22]),
+            ("10.0.1.0", 24, "10.0.3.10",  6, [8080], [443]),
+            ("10.0.2.0", 24, "10.0.3.20",  6, [443], [22]),
+        ],
+        'allowed_protocols': [0, 1, 6],
+        'icmp_interfaces': ["10.0.3.254", "10.0.3.253", "10.0.3.252"],
+    },
+]
+
 
 def printGrpcError(e):
     print("gRPC Error:", e.details(), end=' ')
@@ -33,31 +122,29 @@ def printGrpcError(e):
 
 def readTableRules(p4info_helper, sw):
     """
-    Reads the table entries from all tables on the switch.
+    Reads the table entries from all tables on the switch, or from the local
+    shadow tables of the connection when it has them.
 
     :param p4info_helper: the P4Info helper
     :param sw: the switch connection
     """
     print('\n----- Reading tables rules for %s -----' % sw.name)
-    for response in sw.ReadTableEntries():
-        for entity in response.entities:
-            entry = entity.table_entry
-            # you can use the p4info_helper to translate
-            # the IDs in the entry to names
-            table_name = p4info_helper.get_tables_name(entry.table_id)
-            print('%s: ' % table_name, end=' ')
-            for m in entry.match:
-                print(p4info_helper.get_match_field_name(table_name, m.field_id), end=' ')
-                print('%r' % (p4info_helper.get_match_field_value(m),), end=' ')
-            action = entry.action.action
-            action_name = p4info_helper.get_actions_name(action.action_id)
-            print('->', action_name, end=' ')
-            for p in action.params:
-                print(p4info_helper.get_action_param_name(action_name, p.param_id), end=' ')
-                print('%r' % p.value, end=' ')
-            print()
-
-def writeSrcMac(p4info_helper, sw, port_mac_mapping):
+    decoder = EntityDecoder(p4info_helper)
+    if sw.shadow is not None:
+        records = (decoder.decodeTableEntry(entry) for entry in sw.shadow.entries())
+    else:
+        records = decoder.decodeEntities(
+            sw.ReadEntities(p4info_helper.buildReadEntities(tables='*')))
+    for record in records:
+        print('%s: ' % record.table, end=' ')
+        for name, value in record.match.items():
+            print(name, '%r' % (value,), end=' ')
+        print('->', record.action, end=' ')
+        for name, value in record.params.items():
+            print(name, '%r' % value, end=' ')
+        print()
+
+def writeSrcMac(p4info_helper, batch, port_mac_mapping):
     for port, mac in port_mac_mapping.items():
         table_entry = p4info_helper.buildTableEntry(
             table_name="MyIngress.src_mac",
@@ -68,70 +155,49 @@ def writeSrcMac(p4info_helper, sw, port_mac_mapping):
             action_params={
                 "src_mac": mac
             })
-        sw.WriteTableEntry(table_entry)
-    print("Installed MAC SRC rules on %s" % sw.name)
-
-
-def writeFwdRules(p4info_helper, sw, dstAddr, mask, nextHop, port, dstMac):
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm",
-        match_fields={
-            "hdr.ipv4.dstAddr": (dstAddr, mask)
-        },
-        action_name="MyIngress.ipv4_fwd",
-        action_params={
-            "nxt_hop": nextHop,
-            "port": port
-        })
-    sw.WriteTableEntry(table_entry)
-
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.dst_mac",
-        match_fields={
-            "meta.next_hop_ipv4": nextHop
-        },
-        action_name="MyIngress.rewrite_dst_mac",
-        action_params={
-            "dst_mac": dstMac
-        })
-    sw.WriteTableEntry(table_entry)
-    print("Installed FWD rule on %s" % sw.name)
-
-
-
-def writeFirewallRules(p4info_helper, sw, srcAddr, mask, dstAddr, protocol, dstPorts, srcPorts):
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.firewall",
-        match_fields={
+        batch.write(table_entry)
+
+
+def writeFwdRules(p4info_helper, batch, routes):
+    # Routes sharing a next hop are aggregated into the fewest LPM entries,
+    # with a single dst_mac entry per next hop
+    fib = FibBuilder(p4info_helper)
+    for dstAddr, mask, nextHop, port, dstMac in routes:
+        fib.add(dstAddr, mask, nextHop, port, dstMac)
+    for table_entry in fib.entries():
+        batch.write(table_entry)
+
+
+def writeFirewallRules(p4info_helper, batch, firewall):
+    # Each firewall rule is an allow policy: the compiler turns all of them
+    # into a minimal set of prioritized range entries of MyIngress.firewall
+    policies = []
+    for srcAddr, mask, dstAddr, protocol, dstPorts, srcPorts in firewall:
+        rules = []
+        if dstPorts:
+            rules.append((ALLOW, {"hdr.tcp.dstPort": dstPorts}))
+        if srcPorts:
+            rules.append((ALLOW, {"hdr.tcp.srcPort": srcPorts}))
+        policies.append(AclPolicy({
             "hdr.ipv4.srcAddr": (srcAddr, mask),
             "hdr.ipv4.dstAddr": dstAddr,
-            "hdr.ipv4.protocol": protocol,
-            "hdr.tcp.dstPort": dstPorts,
-            "hdr.tcp.srcPort": srcPorts
-        },
-        action_name="MyIngress.drop",
-        action_params = {},
-        priority = 1
-        )
-    sw.WriteTableEntry(table_entry)
-    print("Installed firewall on %s" % sw.name)
+            "hdr.ipv4.protocol": protocol
+        }, rules, default=DENY))
+    compiler = AclCompiler(p4info_helper, "MyIngress.firewall",
+                           allow_action="NoAction", deny_action="MyIngress.drop")
+    for table_entry in compiler.compile(policies):
+        batch.write(table_entry)
 
 
-def writeProtocolRules(p4info_helper, sw, protocol):
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.allow_some_protocols",
-        match_fields={
-            "hdr.ipv4.protocol": protocol
-        },
-        action_name="MyIngress.drop",
-        action_params = {},
-        priority = 1
-    )
-    sw.WriteTableEntry(table_entry)
-    print("Installed protocol rules on %s" % sw.name)
+def writeProtocolRules(p4info_helper, batch, allowed_protocols):
+    policy = AclPolicy({}, [(ALLOW, {"hdr.ipv4.protocol": allowed_protocols})], default=DENY)
+    compiler = AclCompiler(p4info_helper, "MyIngress.allow_some_protocols",
+                           allow_action="NoAction", deny_action="MyIngress.drop")
+    for table_entry in compiler.compile([policy]):
+        batch.write(table_entry)
 
 
-def writeIcmpInterfaces(p4info_helper, sw, protocol, dstAddr):
+def writeIcmpInterfaces(p4info_helper, batch, protocol, dstAddr):
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.ICMP_to_Interface",
         match_fields={
@@ -141,192 +207,151 @@ def writeIcmpInterfaces(p4info_helper, sw, protocol, dstAddr):
         action_name="MyIngress.send_icmp_reply",
         action_params = {},
     )
-    sw.WriteTableEntry(table_entry)
-    print("Installed icmp rules on %s" % sw.name)
+    batch.write(table_entry)
 
 
+def writeRouterRules(p4info_helper, batch, router):
+    """
+    Adds all the table entries of a router to a write batch.
 
-def printCounter(p4info_helper, sw, counter_name, index):
-    for response in sw.ReadCounters(p4info_helper.get_counters_id(counter_name), index):
-        for entity in response.entities:
-            counter = entity.counter_entry
-            print("%s %s %d: %d packets (%d bytes)" % (
-                sw.name, counter_name, index,
-                counter.data.packet_count, counter.data.byte_count
-            ))
+    :param p4info_helper: the P4Info helper
+    :param batch: the WriteBatch of the router's switch connection
+    :param router: one of the ROUTERS description dicts
+    """
+    writeSrcMac(p4info_helper, batch, router['port_mac'])
+    writeFwdRules(p4info_helper, batch, router['routes'])
+    writeFirewallRules(p4info_helper, batch, router['firewall'])
+    writeProtocolRules(p4info_helper, batch, router['allowed_protocols'])
+    for dstAddr in router['icmp_interfaces']:
+        writeIcmpInterfaces(p4info_helper, batch, 1, dstAddr)
 
 
-def main(p4info_file_path, bmv2_file_path):
+def handlePacketIn(sw, packet):
+    metadata = ' '.join('%d=%s' % (m.metadata_id, m.value.hex()) for m in packet.metadata)
+    print("%s: packet-in of %d bytes %s" % (sw.name, len(packet.payload), metadata))
+
+
+def handleStreamError(sw, error):
+    print("%s: stream error %d: %s" % (sw.name, error.canonical_code, error.message))
+
+
+def printCounterSample(sample, max_indexes=8):
+    """
+    Prints the packet/byte rates of the counter indexes that were hit since
+    the previous sample (or the totals of the first sample).
+    """
+    active = sample.active()
+    if sample.packet_deltas is None:
+        print("%s %s: %d packets (%d bytes) in %d indexes" % (
+            sample.switch, sample.counter, sample.packets.sum(),
+            sample.bytes.sum(), len(active)))
+        return
+    packet_rates = sample.packet_rates
+    byte_rates = sample.byte_rates
+    print("%s %s: %.1f pps (%.1f Bps) in %d indexes" % (
+        sample.switch, sample.counter, packet_rates.sum(), byte_rates.sum(), len(active)))
+    for index in active[:max_indexes]:
+        print("  %d: %d packets (%.1f pps, %.1f Bps)" % (
+            index, sample.packets[index], packet_rates[index], byte_rates[index]))
+
+
+def main(p4info_file_path, bmv2_file_path, journal=False, sync=False, counter_interval=10.0,
+         counter_export=None, routers=ROUTERS):
     # Instantiate a P4Runtime helper from the p4info file
     p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    # Last counter samples of every router, within a fixed memory budget: the
+    # rings are shrunk so that the series of all the routers fit
+    counter_size = p4info_helper.get('counters', name="MyIngress.c").size
+    counter_store = TimeSeriesStore.fit(len(routers), counter_size, COUNTER_STORE_MAX_BYTES)
+    if counter_store is None:
+        print("Warning: the counters of %d routers do not fit in %d bytes, they are not stored" % (
+            len(routers), COUNTER_STORE_MAX_BYTES))
+    collector = None
 
     try:
         # this is backed by a P4Runtime gRPC connection.
-        # Also, dump all P4Runtime messages sent to switch to given txt files.
-        r1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='r1',
-            address='127.0.0.1:50051',
-            device_id=1,
-            proto_dump_file='logs/r1-p4runtime-request.txt')
-        r2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='r2',
-            address='127.0.0.1:50052',
-            device_id=2,
-            proto_dump_file='logs/r2-p4runtime-request.txt')
-        r3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='r3',
-            address='127.0.0.1:50053',
-            device_id=3,
-            proto_dump_file='logs/r3-p4runtime-request.txt')
+        # Also, dump all P4Runtime messages sent to switch to given txt files,
+        # or to binary journals that can be replayed with p4runtime_lib.journal.
+        switches = []
+        for router in routers:
+            if journal:
+                dump = dict(journal='logs/%s-p4runtime-requests.journal' % router['name'])
+            else:
+                dump = dict(proto_dump_file='logs/%s-p4runtime-request.txt' % router['name'],
+                            proto_dump_async=True)
+            switches.append(p4runtime_lib.bmv2.Bmv2SwitchConnection(
+                name=router['name'],
+                address=router['address'],
+                device_id=router['device_id'],
+                shadow=True,
+                **dump))
         print("connection successful")
 
-        # Send master arbitration update message to establish this controller as
-        # master (required by P4Runtime before performing any other write operation)
-        r1.MasterArbitrationUpdate()
-        r2.MasterArbitrationUpdate()
-        r3.MasterArbitrationUpdate()
-
-
-        # Install the P4 program on the switches
-        r1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on r1")
-        r2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on r2")
-        r3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on r3")
-
-        writeSrcMac(p4info_helper, r1, port_mac_mapping_r1)
-        writeSrcMac(p4info_helper, r2, port_mac_mapping_r2)
-        writeSrcMac(p4info_helper, r3, port_mac_mapping_r3)
-
-
-        #r1 fwd
-        writeFwdRules(p4info_helper, r1, "10.0.1.10",  32, "10.0.1.10",  3, "00:04:00:00:00:20")
-        writeFwdRules(p4info_helper, r1, "10.0.1.20",  32, "10.0.1.20",  3, "00:04:00:00:00:30")
-        writeFwdRules(p4info_helper, r1, "10.0.1.100", 32, "10.0.1.100", 3, "00:04:00:00:00:01")
-        writeFwdRules(p4info_helper, r1, "10.0.2.0",   24, "10.0.2.251", 1, "00:aa:dd:00:00:01")
-        writeFwdRules(p4info_helper, r1, "10.0.3.0",   24, "10.0.3.254", 2, "00:aa:cc:00:00:02")
-
-        #r2 fwd
-        writeFwdRules(p4info_helper, r2, "10.0.2.10",  32, "10.0.2.10",  3, "00:04:00:00:00:40")
-        writeFwdRules(p4info_helper, r2, "10.0.2.20",  32, "10.0.2.20",  3, "00:04:00:00:00:50")
-        writeFwdRules(p4info_helper, r2, "10.0.2.100", 32, "10.0.2.100", 3, "00:04:00:00:00:03")
-        writeFwdRules(p4info_helper, r2, "10.0.1.0",   24, "10.0.1.252", 1, "00:aa:bb:00:00:03")
-        writeFwdRules(p4info_helper, r2, "10.0.3.0",   24, "10.0.3.252", 2, "00:aa:cc:00:00:03") 
-
-
-        #r3 fwd
-        writeFwdRules(p4info_helper, r3, "10.0.3.10",  32, "10.0.3.10",  3, "00:04:00:00:00:60")
-        writeFwdRules(p4info_helper, r3, "10.0.3.20",  32, "10.0.3.20",  3, "00:04:00:00:00:70")
-        writeFwdRules(p4info_helper, r3, "10.0.3.100", 32, "10.0.3.100", 3, "00:04:00:00:00:02")
-        writeFwdRules(p4info_helper, r3, "10.0.1.0",   24, "10.0.1.253", 1, "00:aa:bb:00:00:02")
-        writeFwdRules(p4info_helper, r3, "10.0.2.0",   24, "10.0.2.252", 2, "00:aa:dd:00:00:03") 
-        
-        #r1 firewall
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.10", 6,  [1,65535], [1,79])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.10", 6,  [1,65535], [81,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.100", 6, [1,65535], [1,79])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.100", 6, [1,65535], [81,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.20", 6,  [1,65535], [1,8079])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.20", 6,  [1,65535], [8081,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.100", 6, [1,65535], [1,8079])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.100", 6, [1,65535], [8081,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.20", 6,  [1,24], [1,79])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.20", 6,  [1,24], [81,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.20", 6,  [26,65535], [1,79])
-        writeFirewallRules(p4info_helper, r1, "10.0.2.0", 24, "10.0.1.20", 6,  [26,65535], [81,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.10", 6,  [1,442], [1,8079])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.10", 6,  [1,442], [8081,65535])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.10", 6,  [444,65535], [1,8079])
-        writeFirewallRules(p4info_helper, r1, "10.0.3.0", 24, "10.0.1.10", 6,  [444,65535], [8081,65535])
-
-        #r2 firewall
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.20", 6,  [1,65535], [1,24])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.20", 6,  [1,65535], [26,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.100", 6, [1,65535], [1,24])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.100", 6, [1,65535], [26,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.10", 6,  [1,65535], [1,442])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.10", 6,  [1,65535], [444,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.100", 6, [1,65535], [1,442])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.100", 6, [1,65535], [444,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.10", 6,  [1,79], [1,24])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.10", 6,  [1,79], [26,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.10", 6,  [81,65535], [1,24])
-        writeFirewallRules(p4info_helper, r2, "10.0.1.0", 24, "10.0.2.10", 6,  [81,65535], [26,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.20", 6,  [1,21], [1,442])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.20", 6,  [1,21], [444,65535])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.20", 6,  [23,65535], [1,442])
-        writeFirewallRules(p4info_helper, r2, "10.0.3.0", 24, "10.0.2.20", 6,  [23,65535], [444,65535])
-
-        #r3 firewall
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.20", 6,  [1,65535], [1,442])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.20", 6,  [1,65535], [444,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.100", 6, [1,65535], [1,442])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.100", 6, [1,65535], [444,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.10", 6,  [1,65535], [1,21])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.10", 6,  [1,65535], [23,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.100", 6, [1,65535], [1,21])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.100", 6, [1,65535], [23,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.10", 6,  [1,8079], [1,442])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.10", 6,  [1,8079], [444,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.10", 6,  [8081,65535], [1,442])
-        writeFirewallRules(p4info_helper, r3, "10.0.1.0", 24, "10.0.3.10", 6,  [8081,65535], [444,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.20", 6,  [1,442], [1,21])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.20", 6,  [1,442], [23,65535])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.20", 6,  [444,65535], [1,21])
-        writeFirewallRules(p4info_helper, r3, "10.0.2.0", 24, "10.0.3.20", 6,  [444,65535], [23,65535])
-
-        #r1
-        writeProtocolRules(p4info_helper, r1, [2,5])
-        writeProtocolRules(p4info_helper, r1, [7,255])
-
-        #r2
-        writeProtocolRules(p4info_helper, r2, [2,5])
-        writeProtocolRules(p4info_helper, r2, [7,255])
-
-        #r3
-        writeProtocolRules(p4info_helper, r3, [2,5])
-        writeProtocolRules(p4info_helper, r3, [7,255])
-
-
-        #r1
-        writeIcmpInterfaces(p4info_helper,r1,1,"10.0.1.254")
-        writeIcmpInterfaces(p4info_helper,r1,1,"10.0.1.253")
-        writeIcmpInterfaces(p4info_helper,r1,1,"10.0.1.252")
-
-        #r2
-        writeIcmpInterfaces(p4info_helper,r2,1,"10.0.2.251")
-        writeIcmpInterfaces(p4info_helper,r2,1,"10.0.2.252")
-        writeIcmpInterfaces(p4info_helper,r2,1,"10.0.2.250")
-
-        #r3
-        writeIcmpInterfaces(p4info_helper,r3,1,"10.0.3.254")
-        writeIcmpInterfaces(p4info_helper,r3,1,"10.0.3.253")
-        writeIcmpInterfaces(p4info_helper,r3,1,"10.0.3.252")
-
-
-
-
-        readTableRules(p4info_helper, r1)
-        readTableRules(p4info_helper, r2)
-        readTableRules(p4info_helper, r3)
-
+        # Handle the messages sent by the routers on their stream channel
+        # (packet-ins punted to the CPU port, stream errors) in worker threads
+        for sw in switches:
+            sw.StartStreamDispatcher({
+                'packet': lambda packet, sw=sw: handlePacketIn(sw, packet),
+                'error': lambda error, sw=sw: handleStreamError(sw, error),
+            })
 
+        # Bring up all the routers concurrently: master arbitration (required
+        # by P4Runtime before performing any other write operation), then the
+        # P4 program and finally all the table entries in a single batch.
+        # With sync, the P4 program is assumed to be installed already and the
+        # tables are only reconciled with the desired entries.
+        provisioner = SwitchProvisioner()
+        for router, sw in zip(routers, switches):
+            if sync:
+                desired = DesiredEntries()
+                writeRouterRules(p4info_helper, desired, router)
+                steps = [('arbitration', lambda sw: sw.MasterArbitrationUpdate()),
+                         ('resync', lambda sw: sw.ResyncShadow()),
+                         ('entries', lambda sw, desired=desired: reconcile(sw, desired.entries))]
+            else:
+                batch = sw.WriteBatch()
+                writeRouterRules(p4info_helper, batch, router)
+                steps = bringupSteps(p4info_helper, bmv2_file_path)
+                steps.append(('entries', lambda sw, batch=batch: batch.commit()))
+            provisioner.add(sw, steps)
+
+        for report in provisioner.run():
+            print(report)
+            if not report.ok:
+                raise report.error
+            errors = report.results['entries']
+            if sync:
+                print("%s: %s" % (report.name, errors))
+                errors = errors.errors
+            for idx, p4_error in errors:
+                print("%s: update %d rejected: %s" % (report.name, idx, p4_error.message))
+
+        for sw in switches:
+            readTableRules(p4info_helper, sw)
+
+        # Read the whole counter array of all the routers on every poll
+        collector = CounterCollector(p4info_helper, switches, "MyIngress.c")
+        if counter_store is not None:
+            collector.add_listener(counter_store.record_counter_samples)
+        collector.poll()
         while True:
-            sleep(10)
+            sleep(counter_interval)
             print('\n----- Reading counters -----')
-            printCounter(p4info_helper, r1, "MyIngress.c", 1)
-            printCounter(p4info_helper, r2, "MyIngress.c", 1)
-            printCounter(p4info_helper, r3, "MyIngress.c", 1)
+            for sample in collector.poll():
+                printCounterSample(sample)
 
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
+    if collector is not None:
+        collector.stop()
+    if counter_export and counter_store is not None and counter_store.series:
+        for path in counter_store.export(counter_export):
+            print("Counter samples written to %s" % path)
+    ShutdownAllSwitchConnections()
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
     parser.add_argument('--p4info', help='p4info proto in text format from p4c',
@@ -335,6 +360,19 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='build/s-router.json')
+    parser.add_argument('--journal', help='dump P4Runtime requests to binary journals',
+                        action="store_true")
+    parser.add_argument('--sync', help='only reconcile the table entries of running switches '
+                        'instead of reinstalling the P4 program and all the entries',
+                        action="store_true")
+    parser.add_argument('--counter-interval', help='seconds between counter polls',
+                        type=float, action="store", default=10.0)
+    parser.add_argument('--counter-export', help='directory where the counter samples are '
+                        'written as .npz files on shutdown',
+                        type=str, action="store", default=None)
+    parser.add_argument('--topo-spec', help='topology spec file (JSON) the routers were '
+                        'started from with mininet/r-topo.py --spec, instead of ROUTERS',
+                        type=str, action="store", default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -345,4 +383,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found:")
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    routers = ROUTERS
+    if args.topo_spec:
+        routers = TopoSpec(loadSpec(args.topo_spec)).controllerRouters()
+    main(args.p4info, args.bmv2_json, args.journal, args.sync, args.counter_interval,
+         args.counter_export, routers)
\ No newline at end of file
@@ -0,0 +1,102 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from mininet.log import error, info
+
+
+class HostConfig(object):
+    """Post-start configuration of the hosts and OVS bridges of a network.
+    Commands are collected per host and rendered into one script per host;
+    apply() runs the scripts of all the hosts at once (one shell round trip
+    per host instead of one per command) and loads the OpenFlow flows of
+    each bridge from a flow file with a single ovs-ofctl add-flows. Without
+    script_dir, the files are written to a temporary directory removed at
+    the end of apply()."""
+
+    def __init__(self, script_dir=None):
+        self.script_dir = script_dir
+        self.commands = {}       # host name -> [command]
+        self.default_routes = {}  # host name -> route parameters
+        self.flows = {}          # bridge name -> [flow]
+
+    def addCommand(self, host, command):
+        self.commands.setdefault(host, []).append(command)
+
+    def setARP(self, host, ip, mac):
+        "Same as Host.setARP"
+        self.addCommand(host, 'arp -s %s %s' % (ip, mac))
+
+    def setDefaultRoute(self, host, params):
+        """Like Host.setDefaultRoute with ip route parameters (e.g. 'dev eth0
+        via 10.0.1.254'): as each call replaces the default route, only the
+        last one is rendered"""
+        self.default_routes[host] = params
+
+    def addFlow(self, bridge, flow):
+        self.flows.setdefault(bridge, []).append(flow)
+
+    def render(self, host):
+        "Returns the script of a host"
+        lines = list(self.commands.get(host, []))
+        params = self.default_routes.get(host)
+        if params is not None:
+            lines.append('ip route replace default %s' % params)
+        return '\n'.join(lines) + '\n'
+
+    def _write(self, script_dir, name, content):
+        path = os.path.join(script_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def apply(self, net):
+        """Configures the bridges and the hosts concurrently. Returns the
+        number of failures, which are logged."""
+        script_dir = self.script_dir or tempfile.mkdtemp(prefix='hostcfg-')
+        try:
+            ovs = []
+            for bridge, flows in sorted(self.flows.items()):
+                path = self._write(script_dir, '%s.flows' % bridge, '\n'.join(flows) + '\n')
+                ovs.append((bridge, subprocess.Popen(['ovs-ofctl', 'add-flows', bridge, path],
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.STDOUT)))
+
+            hosts = sorted(set(self.commands) | set(self.default_routes))
+            for name in hosts:
+                path = self._write(script_dir, '%s.sh' % name, self.render(name))
+                net.get(name).sendCmd('sh %s 2>&1' % path)
+
+            failures = 0
+            for name in hosts:
+                # The scripts only print on errors
+                output = net.get(name).waitOutput()
+                if output.strip():
+                    error("%s configuration: %s\n" % (name, output.strip()))
+                    failures += 1
+            for bridge, process in ovs:
+                output = process.communicate()[0]
+                if process.returncode != 0:
+                    error("%s flows: %s\n" % (bridge, output.decode().strip()))
+                    failures += 1
+        finally:
+            if self.script_dir is None:
+                shutil.rmtree(script_dir, ignore_errors=True)
+        info("Configured %d hosts and %d bridges\n" % (len(hosts), len(ovs)))
+        return failures
@@ -13,11 +13,77 @@
 # limitations under the License.
 #
 
-import psutil
+import errno
+import os
+import select
+import socket
+from time import monotonic, sleep
+
+# Sockets of the network namespace, one line per socket
+PROC_NET_TCP = ('/proc/net/tcp', '/proc/net/tcp6')
+TCP_LISTEN = '0A'
+
+# Readiness polls start fast and back off exponentially up to the maximum
+READY_POLL_INITIAL_INTERVAL = 0.01
+READY_POLL_MAX_INTERVAL = 0.1
+
+
+def probe_port(port, host='127.0.0.1', timeout=0.1):
+    "Returns True if host accepts TCP connections on port (non-blocking connect)"
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setblocking(False)
+    try:
+        err = s.connect_ex((host, port))
+        if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            _, writable, _ = select.select([], [s], [], timeout)
+            if not writable:
+                return False
+            err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        return err == 0
+    finally:
+        s.close()
 
 
 def check_listening_on_port(port):
-    for c in psutil.net_connections(kind='inet'):
-        if c.status == 'LISTEN' and c.laddr[1] == port:
+    return probe_port(port)
+
+
+def listening_ports():
+    """Returns the set of the TCP ports in LISTEN state, from a single read
+    of /proc/net/tcp and /proc/net/tcp6, so that it can be shared by all the
+    switches waiting for their port"""
+    ports = set()
+    for path in PROC_NET_TCP:
+        try:
+            with open(path) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == TCP_LISTEN:
+                        ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+        except IOError:
+            # no tcp6 when IPv6 is disabled
+            continue
+    return ports
+
+
+def poll_intervals():
+    "Yields the exponentially growing sleeps between two readiness polls"
+    interval = READY_POLL_INITIAL_INTERVAL
+    while True:
+        yield interval
+        interval = min(interval * 2, READY_POLL_MAX_INTERVAL)
+
+
+def wait_for_port(port, timeout, pid=None, host='127.0.0.1'):
+    """Waits until port accepts connections. Returns False if process pid
+    exits or timeout seconds elapse before."""
+    deadline = monotonic() + timeout
+    for interval in poll_intervals():
+        if pid is not None and not os.path.exists(os.path.join("/proc", str(pid))):
+            return False
+        if probe_port(port, host):
             return True
-    return False
\ No newline at end of file
+        if monotonic() >= deadline:
+            return False
+        sleep(interval)
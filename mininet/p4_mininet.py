@@ -16,12 +16,11 @@
 import os
 import tempfile
 from sys import exit
-from time import sleep
 
 from mininet.log import debug, error, info
 from mininet.moduledeps import pathCheck
 from mininet.node import Host, Switch
-from netstat import check_listening_on_port
+from netstat import check_listening_on_port, wait_for_port
 
 SWITCH_START_TIMEOUT = 10 # seconds
 
@@ -107,12 +106,7 @@ class P4Switch(Switch):
         server has been started. If the Thrift server is ready, we assume that
         the switch was started successfully. This is only reliable if the Thrift
         server is started at the end of the init process"""
-        while True:
-            if not os.path.exists(os.path.join("/proc", str(pid))):
-                return False
-            if check_listening_on_port(self.thrift_port):
-                return True
-            sleep(0.5)
+        return wait_for_port(self.thrift_port, SWITCH_START_TIMEOUT, pid)
 
     def start(self, controllers):
         "Start up a new P4 switch"
@@ -16,12 +16,12 @@
 
 import os
 import tempfile
-from time import sleep
+from time import monotonic, sleep
 
 from mininet.log import debug, error, info
 from mininet.moduledeps import pathCheck
 from mininet.node import Switch
-from netstat import check_listening_on_port
+from netstat import check_listening_on_port, listening_ports, poll_intervals, wait_for_port
 from p4_mininet import SWITCH_START_TIMEOUT, P4Switch
 
 
@@ -39,6 +39,8 @@ class P4RuntimeSwitch(P4Switch):
                  device_id = None,
                  enable_debugger = False,
                  log_file = None,
+                 batch_start = False,
+                 start_timeout = SWITCH_START_TIMEOUT,
                  **kwargs):
         Switch.__init__(self, name, **kwargs)
         assert (sw_path)
@@ -93,14 +95,17 @@ class P4RuntimeSwitch(P4Switch):
         if "cpu_port" in kwargs:
             self.cpu_port = kwargs["cpu_port"]
 
+        # In batch mode start() only spawns the switch process, and
+        # batchStartup() waits for all the switches at once
+        self.batch_start = batch_start
+        self.start_timeout = start_timeout
+        self.pid = None
+        self.spawn_time = None
+        self.startup_latency = None
+
 
     def check_switch_started(self, pid):
-        for _ in range(SWITCH_START_TIMEOUT * 2):
-            if not os.path.exists(os.path.join("/proc", str(pid))):
-                return False
-            if check_listening_on_port(self.grpc_port):
-                return True
-            sleep(0.5)
+        return wait_for_port(self.grpc_port, self.start_timeout, pid)
 
     def start(self, controllers):
         info("Starting P4 switch {}.\n".format(self.name))
@@ -138,7 +143,49 @@ class P4RuntimeSwitch(P4Switch):
             self.cmd(cmd + ' >' + self.log_file + ' 2>&1 & echo $! >> ' + f.name)
             pid = int(f.read())
         debug("P4 switch {} PID is {}.\n".format(self.name, pid))
+        self.pid = pid
+        self.spawn_time = monotonic()
+        if self.batch_start:
+            return
         if not self.check_switch_started(pid):
             error("P4 switch {} did not start correctly.\n".format(self.name))
             exit(1)
-        info("P4 switch {} has been started.\n".format(self.name))
\ No newline at end of file
+        self.startup_latency = monotonic() - self.spawn_time
+        info("P4 switch {} has been started.\n".format(self.name))
+
+    @classmethod
+    def batchStartup(cls, switches):
+        """Called by Mininet once start() was called on all the switches of
+        this class. Waits for the gRPC servers of the switches started in
+        batch mode, all polled together by a single monitor, each one within
+        its own start_timeout. Returns the started switches."""
+        waited = [sw for sw in switches if sw.batch_start and sw.pid is not None]
+        pending = list(waited)
+        failed = []
+        intervals = poll_intervals()
+        while pending:
+            # One snapshot of the listening sockets for all the pending switches
+            ports = listening_ports()
+            now = monotonic()
+            for sw in list(pending):
+                if sw.grpc_port in ports:
+                    sw.startup_latency = now - sw.spawn_time
+                    info("P4 switch {} has been started in {:.2f}s.\n".format(
+                        sw.name, sw.startup_latency))
+                    pending.remove(sw)
+                elif (not os.path.exists(os.path.join("/proc", str(sw.pid))) or
+                      now - sw.spawn_time > sw.start_timeout):
+                    failed.append(sw)
+                    pending.remove(sw)
+            if pending:
+                sleep(next(intervals))
+        for sw in failed:
+            error("P4 switch {} did not start correctly.\n".format(sw.name))
+        if failed:
+            exit(1)
+        if waited:
+            slowest = max(waited, key=lambda sw: sw.startup_latency)
+            info("{} P4 switches started in {:.2f}s (slowest: {} in {:.2f}s).\n".format(
+                len(waited), monotonic() - min(sw.spawn_time for sw in waited),
+                slowest.name, slowest.startup_latency))
+        return switches
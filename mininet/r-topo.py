@@ -8,11 +8,17 @@ from mininet.node import OVSKernelSwitch
 
 from p4_mininet import P4Switch, P4Host
 from p4runtime_switch import P4RuntimeSwitch
+from host_config import HostConfig
 
-import subprocess
+import os
+import sys
 import argparse
 from time import sleep
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils/'))
+
+from topo_spec import TopoSpec, loadSpec
+
 
 class SimpleRouter(Topo):
     def __init__(self, sw_path, thrift_port, grpc_port, **opts):
@@ -26,6 +32,7 @@ class SimpleRouter(Topo):
                         #json_path = json_path,
                         thrift_port = thrift_port,
                         grpc_port = grpc_port,
+                        batch_start = True,
                         device_id = 1,
                         cpu_port = 510)
         router2 = self.addSwitch('r2',
@@ -34,6 +41,7 @@ class SimpleRouter(Topo):
                         #json_path = json_path,
                         thrift_port = thrift_port+1,
                         grpc_port = grpc_port+1,
+                        batch_start = True,
                         device_id = 2,
                         cpu_port = 510)
         router3 = self.addSwitch('r3',
@@ -42,6 +50,7 @@ class SimpleRouter(Topo):
                         #json_path = json_path,
                         thrift_port = thrift_port+2,
                         grpc_port = grpc_port+2,
+                        batch_start = True,
                         device_id = 3,
                         cpu_port = 510)
 
@@ -92,6 +101,86 @@ class SimpleRouter(Topo):
 
         # self.addLink(r1, r2, port1=2, port2=2, addr1="00:bb:bb:00:01:02", addr2="00:bb:bb:00:02:02")
 
+class SpecTopo(Topo):
+    "Routers, LAN switches and hosts of a topo_spec.TopoSpec"
+    def __init__(self, sw_path, spec, **opts):
+        Topo.__init__(self, **opts)
+
+        for router in spec.routers:
+            self.addSwitch(router.name,
+                           cls = P4RuntimeSwitch,
+                           sw_path = sw_path,
+                           thrift_port = router.thrift_port,
+                           grpc_port = router.grpc_port,
+                           batch_start = True,
+                           device_id = router.device_id,
+                           cpu_port = spec.cpu_port)
+
+        for a, port_a, b, port_b in spec.links:
+            self.addLink(a.name, b.name, port1=port_a, port2=port_b,
+                         addr1=a.interfaces[port_a].mac, addr2=b.interfaces[port_b].mac)
+
+        for router in spec.routers:
+            if not router.hosts:
+                continue
+            switch = self.addSwitch(router.lan_switch, cls = OVSKernelSwitch)
+            self.addLink(router.name, switch, port1=router.lan_port,
+                         addr1=router.interfaces[router.lan_port].mac)
+            for host in router.hosts:
+                self.addHost(host.name, ip = "%s/%d" % (host.ip, host.prefix_len), mac=host.mac)
+                self.addLink(host.name, switch)
+
+
+def configureSpecNetwork(net, spec):
+    "Post-start configuration of a SpecTopo network"
+    config = HostConfig()
+    for router in spec.routers:
+        if not router.hosts:
+            continue
+        # the LAN switch ports: the router, then one per host
+        for port in range(1, len(router.hosts) + 2):
+            config.addFlow(router.lan_switch, 'in_port=%d,actions=normal' % port)
+
+    for host in spec.hosts:
+        config.setARP(host.name, host.gateway.ip, host.gateway.mac)
+        config.setDefaultRoute(host.name, "dev eth0 via %s" % host.gateway.ip)
+    config.apply(net)
+
+
+# Router interfaces known by the hosts of each LAN, as (ip, mac); the
+# default route goes through the last one
+LAN_GATEWAYS = {
+    's1': [("10.0.1.254", "00:aa:bb:00:00:01"),
+           ("10.0.1.253", "00:aa:bb:00:00:03"),
+           ("10.0.1.252", "00:aa:bb:00:00:02")],
+    's2': [("10.0.2.250", "00:aa:dd:00:00:02"),
+           ("10.0.2.251", "00:aa:dd:00:00:01"),
+           ("10.0.2.252", "00:aa:dd:00:00:03")],
+    's3': [("10.0.3.253", "00:aa:cc:00:00:01"),
+           ("10.0.3.252", "00:aa:cc:00:00:03"),
+           ("10.0.3.254", "00:aa:cc:00:00:02")],
+}
+LAN_HOSTS = {
+    's1': ['h11', 'server11', 'server12'],
+    's2': ['h21', 'server21', 'server22'],
+    's3': ['h31', 'server31', 'server32'],
+}
+
+
+def configureSimpleRouter(net):
+    "Post-start configuration of the SimpleRouter network"
+    config = HostConfig()
+    for switch in sorted(LAN_HOSTS):
+        for port in range(1, 5):
+            config.addFlow(switch, 'in_port=%d,actions=normal' % port)
+
+        for host in LAN_HOSTS[switch]:
+            for gateway_ip, gateway_mac in LAN_GATEWAYS[switch]:
+                config.setARP(host, gateway_ip, gateway_mac)
+                config.setDefaultRoute(host, "dev eth0 via %s" % gateway_ip)
+    config.apply(net)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Mininet demo')
     parser.add_argument('--behavioral-exe', help='Path to behavioral executable',
@@ -100,6 +189,9 @@ def main():
                         type=int, action="store", default=9091)
     parser.add_argument('--grpc-port', help='gRPC server port for controller comm',
                         type=int, action="store", default=50051)
+    parser.add_argument('--spec', help='topology spec file (JSON, see utils/topo_spec.py) '
+                        'instead of the three routers topology',
+                        type=str, action="store", default=None)
     #parser.add_argument('--json', help='Path to JSON config file',
     #                    type=str, action="store", required=True)
 
@@ -107,10 +199,14 @@ def main():
 
 
 
-    topo = SimpleRouter(args.behavioral_exe,
-                        args.thrift_port,
-                        args.grpc_port)
-                        #args.json)
+    if args.spec:
+        spec = TopoSpec(loadSpec(args.spec))
+        topo = SpecTopo(args.behavioral_exe, spec)
+    else:
+        topo = SimpleRouter(args.behavioral_exe,
+                            args.thrift_port,
+                            args.grpc_port)
+                            #args.json)
 
     # the host class is the P4Host
     # the switch class is the P4Switch
@@ -124,164 +220,10 @@ def main():
     # our software switch.
     net.start()
 
-    commands = [
-        'sudo ovs-ofctl add-flow s1 in_port=1,actions=normal',
-        'sudo ovs-ofctl add-flow s1 in_port=2,actions=normal',
-        'sudo ovs-ofctl add-flow s1 in_port=3,actions=normal',
-        'sudo ovs-ofctl add-flow s1 in_port=4,actions=normal',
-        'sudo ovs-ofctl add-flow s2 in_port=1,actions=normal',
-        'sudo ovs-ofctl add-flow s2 in_port=2,actions=normal',
-        'sudo ovs-ofctl add-flow s2 in_port=3,actions=normal',
-        'sudo ovs-ofctl add-flow s2 in_port=4,actions=normal',
-        'sudo ovs-ofctl add-flow s3 in_port=1,actions=normal',
-        'sudo ovs-ofctl add-flow s3 in_port=2,actions=normal',
-        'sudo ovs-ofctl add-flow s3 in_port=3,actions=normal',
-        'sudo ovs-ofctl add-flow s3 in_port=4,actions=normal'
-    ]
-
-    # Execute each command in the list
-    for cmd in commands:
-        print('Running ...')
-        subprocess.call(cmd, shell=True)
-
-
-    gateway_ip_r1_3  = "10.0.1.254"
-    gateway_mac_r1_3 = "00:aa:bb:00:00:01"
-    gateway_ip_r1_2  = "10.0.1.253"
-    gateway_mac_r1_2 = "00:aa:bb:00:00:03"
-    gateway_ip_r1_1  = "10.0.1.252"
-    gateway_mac_r1_1 = "00:aa:bb:00:00:02"
-
-
-    gateway_ip_r2_3  = "10.0.2.250"
-    gateway_mac_r2_3 = "00:aa:dd:00:00:02"
-    gateway_ip_r2_2  = "10.0.2.251"
-    gateway_mac_r2_2 = "00:aa:dd:00:00:01"
-    gateway_ip_r2_1  = "10.0.2.252"
-    gateway_mac_r2_1 = "00:aa:dd:00:00:03"
-
-
-    gateway_ip_r3_3  = "10.0.3.253"
-    gateway_mac_r3_3 = "00:aa:cc:00:00:01"
-    gateway_ip_r3_2 = "10.0.3.252"
-    gateway_mac_r3_2 = "00:aa:cc:00:00:03"
-    gateway_ip_r3_1  = "10.0.3.254"
-    gateway_mac_r3_1 = "00:aa:cc:00:00:02"
-
-    
-    h11 = net.get('h11')
-    h11.setARP(gateway_ip_r1_3,gateway_mac_r1_3)
-    h11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_3)
-
-    h11.setARP(gateway_ip_r1_2,gateway_mac_r1_2)
-    h11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_2)
-
-    h11.setARP(gateway_ip_r1_1,gateway_mac_r1_1)
-    h11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_1)
-
-
-
-    srv11 = net.get('server11')
-    srv11.setARP(gateway_ip_r1_3,gateway_mac_r1_3)
-    srv11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_3)
-
-    srv11.setARP(gateway_ip_r1_2,gateway_mac_r1_2)
-    srv11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_2)
-
-    srv11.setARP(gateway_ip_r1_1,gateway_mac_r1_1)
-    srv11.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_1)
-
-
-    
-    srv12 = net.get('server12')
-    srv12.setARP(gateway_ip_r1_3,gateway_mac_r1_3)
-    srv12.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_3)
-
-
-    srv12.setARP(gateway_ip_r1_2,gateway_mac_r1_2)
-    srv12.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_2)
-
-
-    srv12.setARP(gateway_ip_r1_1,gateway_mac_r1_1)
-    srv12.setDefaultRoute("dev eth0 via %s" % gateway_ip_r1_1)
-
-
-
-
-    h21 = net.get('h21')
-    h21.setARP(gateway_ip_r2_3,gateway_mac_r2_3)
-    h21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_3)
-
-    h21.setARP(gateway_ip_r2_2,gateway_mac_r2_2)
-    h21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_2)
-
-    h21.setARP(gateway_ip_r2_1,gateway_mac_r2_1)
-    h21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_1)
-
-
-
-    srv21 = net.get('server21')
-    srv21.setARP(gateway_ip_r2_3,gateway_mac_r2_3)
-    srv21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_3)
-
-    srv21.setARP(gateway_ip_r2_2,gateway_mac_r2_2)
-    srv21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_2)
-
-    srv21.setARP(gateway_ip_r2_1,gateway_mac_r2_1)
-    srv21.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_1)
-
-
-    
-    srv22 = net.get('server22')
-    srv22.setARP(gateway_ip_r2_3,gateway_mac_r2_3)
-    srv22.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_3)
-    
-
-    srv22.setARP(gateway_ip_r2_2,gateway_mac_r2_2)
-    srv22.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_2)
-
-
-    srv22.setARP(gateway_ip_r2_1,gateway_mac_r2_1)
-    srv22.setDefaultRoute("dev eth0 via %s" % gateway_ip_r2_1)
-
-
-
-    h31 = net.get('h31')
-    h31.setARP(gateway_ip_r3_3,gateway_mac_r3_3)
-    h31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_3)
-
-    h31.setARP(gateway_ip_r3_2,gateway_mac_r3_2)
-    h31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_2)
-
-    h31.setARP(gateway_ip_r3_1,gateway_mac_r3_1)
-    h31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_1)
-
-
-
-    srv31 = net.get('server31')
-    srv31.setARP(gateway_ip_r3_3,gateway_mac_r3_3)
-    srv31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_3)
-
-    srv31.setARP(gateway_ip_r3_2,gateway_mac_r3_2)
-    srv31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_2)
-
-    srv31.setARP(gateway_ip_r3_1,gateway_mac_r3_1)
-    srv31.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_1)
-
-
-    
-    srv32 = net.get('server32')
-    srv32.setARP(gateway_ip_r3_3,gateway_mac_r3_3)
-    srv32.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_3)
-    
-
-    srv32.setARP(gateway_ip_r3_2,gateway_mac_r3_2)
-    srv32.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_2)
-
-
-    srv32.setARP(gateway_ip_r3_1,gateway_mac_r3_1)
-    srv32.setDefaultRoute("dev eth0 via %s" % gateway_ip_r3_1)
-
+    if args.spec:
+        configureSpecNetwork(net, spec)
+    else:
+        configureSimpleRouter(net)
 
     sleep(1)  # time for the host and switch confs to take effect
     
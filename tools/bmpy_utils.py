@@ -30,12 +30,22 @@ from thrift.protocol import TBinaryProtocol
 from thrift.protocol import TMultiplexedProtocol
 
 
-def check_JSON_md5(client, json_src, out=sys.stdout):
+def json_md5(json_src):
+    "Returns the md5 digest of a JSON file, as computed by the switch"
     with open(json_src, 'rb') as f:
         m = hashlib.md5()
         for L in f:
             m.update(L)
-        md5sum = m.digest()
+        return m.digest()
+
+
+def config_md5_matches(client, json_src):
+    "True if the switch runs the JSON config json_src"
+    return client.bm_get_config_md5() == json_md5(json_src)
+
+
+def check_JSON_md5(client, json_src, out=sys.stdout):
+    md5sum = json_md5(json_src)
 
     def my_print(s):
         out.write(s)
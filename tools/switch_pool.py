@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import fcntl
+import json
+import os
+import signal
+import subprocess
+import sys
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils/'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mininet/'))
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+import p4runtime_lib.bmv2
+import p4runtime_lib.helper
+from bmpy_utils import config_md5_matches, thrift_connect_standard
+from netstat import wait_for_port
+
+'''
+Pool of warm BMv2 switches for controller tests. The simple_switch_grpc
+processes outlive the test runs: the pool state (ports and pids of the
+instances, and which process leases them) is kept in a JSON file, so that
+each run adopts the running instances instead of spawning new ones.
+
+On lease, a switch that already runs the pool JSON config (same md5) is
+cleared instead of getting the pipeline again: the entries left by the
+previous test are read back and deleted over P4Runtime, the default entries
+reset and the multicast groups and clone sessions deleted, so that the
+P4Runtime server and BMv2 agree; bm_reset_state over Thrift then clears the
+rest of the data plane (counters, registers, meters). bm_reset_state alone
+would leave the entries in the P4Runtime server, which would reject them
+with ALREADY_EXISTS on the next test. Other switches, or a switch that fails
+to clear, get the pipeline with SetForwardingPipelineConfig. Leased
+switches are ready for a controller that skips the pipeline push (e.g.
+dummy-controller.py --sync).
+
+    ./switch_pool.py --size 3 up      # once, e.g. at the start of a CI job
+    pool = SwitchPool(3, p4info, bmv2_json)
+    with pool.leased() as switches:   # in each test
+        ...
+    ./switch_pool.py down
+'''
+
+POOL_STATE_FILE = '/tmp/bmv2-pool.json'
+SWITCH_START_TIMEOUT = 10  # seconds
+
+
+class PooledSwitch(object):
+    "One simple_switch_grpc instance of the pool"
+
+    def __init__(self, name, device_id, grpc_port, thrift_port, pid=None, lessee=None):
+        self.name = name
+        self.device_id = device_id
+        self.grpc_port = grpc_port
+        self.thrift_port = thrift_port
+        self.pid = pid
+        self.lessee = lessee  # pid of the process leasing the switch
+
+    @property
+    def address(self):
+        return '127.0.0.1:%d' % self.grpc_port
+
+    def alive(self):
+        return self.pid is not None and os.path.exists(os.path.join("/proc", str(self.pid)))
+
+    def leased(self):
+        return self.lessee is not None and os.path.exists(os.path.join("/proc", str(self.lessee)))
+
+    def toDict(self):
+        return dict((k, getattr(self, k)) for k in
+                    ('name', 'device_id', 'grpc_port', 'thrift_port', 'pid', 'lessee'))
+
+
+class SwitchPool(object):
+    """size switches named s1..sN, with device ids 1..N and consecutive
+    gRPC and Thrift ports from grpc_port and thrift_port. resets and pushes
+    count the leased switches that were cleared and that got the pipeline."""
+
+    def __init__(self, size, p4info_path, json_path, sw_path='simple_switch_grpc',
+                 grpc_port=50051, thrift_port=9091, cpu_port=510,
+                 state_file=POOL_STATE_FILE, log_dir='/tmp'):
+        self.size = size
+        self.p4info_path = p4info_path
+        self.json_path = json_path
+        self.sw_path = sw_path
+        self.grpc_port = grpc_port
+        self.thrift_port = thrift_port
+        self.cpu_port = cpu_port
+        self.state_file = state_file
+        self.log_dir = log_dir
+        self.p4info_helper = None
+        self.resets = 0
+        self.pushes = 0
+
+    @contextmanager
+    def _state(self):
+        # Yields {name: PooledSwitch} under an exclusive lock, saved on exit
+        with open(self.state_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            switches = {}
+            if os.path.exists(self.state_file):
+                with open(self.state_file) as f:
+                    for d in json.load(f):
+                        switches[d['name']] = PooledSwitch(**d)
+            yield switches
+            with open(self.state_file, 'w') as f:
+                json.dump([sw.toDict() for sw in switches.values()], f, indent=2)
+
+    def _spawn(self, sw):
+        args = [self.sw_path, '--device-id', str(sw.device_id),
+                '--thrift-port', str(sw.thrift_port), '--no-p4',
+                '--', '--grpc-server-addr', '0.0.0.0:%d' % sw.grpc_port,
+                '--cpu-port', str(self.cpu_port)]
+        log = open(os.path.join(self.log_dir, 'p4s.pool-%s.log' % sw.name), 'w')
+        # In its own session, so that the switch survives the test run
+        process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        log.close()
+        sw.pid = process.pid
+        sw.lessee = None
+
+    def start(self):
+        """Spawns the instances of the pool that are not running and waits
+        for them. Returns the number of spawned instances."""
+        with self._state() as switches:
+            spawned = []
+            for i in range(self.size):
+                name = 's%d' % (i + 1)
+                sw = switches.get(name)
+                if sw is None:
+                    sw = PooledSwitch(name, i + 1, self.grpc_port + i, self.thrift_port + i)
+                    switches[name] = sw
+                if not sw.alive():
+                    self._spawn(sw)
+                    spawned.append(sw)
+            for sw in spawned:
+                if not wait_for_port(sw.grpc_port, SWITCH_START_TIMEOUT, sw.pid):
+                    raise Exception("Pool switch %s did not start, see %s" % (
+                        sw.name, os.path.join(self.log_dir, 'p4s.pool-%s.log' % sw.name)))
+            return len(spawned)
+
+    def stop(self):
+        "Terminates all the instances of the pool"
+        with self._state() as switches:
+            for sw in switches.values():
+                if sw.alive():
+                    os.kill(sw.pid, signal.SIGTERM)
+            switches.clear()
+        os.remove(self.state_file)
+
+    def _clear(self, connection):
+        # Deletes the entries and PRE entries of the previous test and resets
+        # the default entries, in a single batch. Returns the rejected updates.
+        batch = connection.WriteBatch()
+        tables = self.p4info_helper.buildReadEntities(tables='*')
+        for entity in connection.ReadEntities(tables):
+            batch.delete(entity.table_entry)
+        pre = p4runtime_pb2.Entity()
+        pre.packet_replication_engine_entry.multicast_group_entry.multicast_group_id = 0
+        sessions = p4runtime_pb2.Entity()
+        sessions.packet_replication_engine_entry.clone_session_entry.session_id = 0
+        try:
+            for entity in connection.ReadEntities([pre, sessions]):
+                batch.add(p4runtime_pb2.Update.DELETE, entity)
+        except grpc.RpcError as e:
+            # Servers without PRE reads
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+        for table in self.p4info_helper.p4info.tables:
+            if not table.const_default_action_id:
+                # A default entry without action resets the default action
+                default_entry = p4runtime_pb2.TableEntry()
+                default_entry.table_id = table.preamble.id
+                default_entry.is_default_action = True
+                batch.modify(default_entry)
+        return batch.commit()
+
+    def prepare(self, sw):
+        """Brings a switch back to the pool pipeline with empty tables.
+        Returns 'reset' or 'pipeline'."""
+        if self.p4info_helper is None:
+            self.p4info_helper = p4runtime_lib.helper.P4InfoHelper(self.p4info_path)
+        connection = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            name=sw.name, address=sw.address, device_id=sw.device_id)
+        try:
+            connection.MasterArbitrationUpdate()
+            client = thrift_connect_standard('127.0.0.1', sw.thrift_port)
+            if config_md5_matches(client, self.json_path) and not self._clear(connection):
+                client.bm_reset_state()
+                self.resets += 1
+                return 'reset'
+            connection.SetForwardingPipelineConfig(p4info=self.p4info_helper.p4info,
+                                                   bmv2_json_file_path=self.json_path)
+            self.pushes += 1
+            return 'pipeline'
+        finally:
+            connection.close()
+
+    def lease(self, count=None):
+        """Leases count switches (default: the whole pool) to this process,
+        starting the pool if needed, and prepares them. Returns the
+        PooledSwitches, in name order."""
+        count = self.size if count is None else count
+        self.start()
+        with self._state() as switches:
+            free = [sw for sw in sorted(switches.values(), key=lambda sw: sw.device_id)
+                    if sw.device_id <= self.size and not sw.leased()]
+            if len(free) < count:
+                raise Exception("Only %d of the %d pool switches are free" % (len(free), self.size))
+            leased = free[:count]
+            for sw in leased:
+                sw.lessee = os.getpid()
+        try:
+            for sw in leased:
+                self.prepare(sw)
+        except Exception:
+            self.release(leased)
+            raise
+        return leased
+
+    def release(self, leased):
+        with self._state() as switches:
+            for sw in leased:
+                if sw.name in switches:
+                    switches[sw.name].lessee = None
+
+    @contextmanager
+    def leased(self, count=None):
+        switches = self.lease(count)
+        try:
+            yield switches
+        finally:
+            self.release(switches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pool of warm BMv2 switches')
+    parser.add_argument('command', choices=['up', 'down', 'status'])
+    parser.add_argument('--size', help='number of switches', type=int, default=3)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", default='build/s-router.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", default='build/s-router.json')
+    parser.add_argument('--behavioral-exe', help='Path to behavioral executable',
+                        type=str, action="store", default='simple_switch_grpc')
+    parser.add_argument('--grpc-port', help='gRPC port of the first switch',
+                        type=int, action="store", default=50051)
+    parser.add_argument('--thrift-port', help='Thrift port of the first switch',
+                        type=int, action="store", default=9091)
+    parser.add_argument('--state-file', help='pool state file',
+                        type=str, action="store", default=POOL_STATE_FILE)
+    args = parser.parse_args()
+
+    pool = SwitchPool(args.size, args.p4info, args.bmv2_json, args.behavioral_exe,
+                      args.grpc_port, args.thrift_port, state_file=args.state_file)
+    if args.command == 'up':
+        spawned = pool.start()
+        print("%d switches spawned, %d already running" % (spawned, args.size - spawned))
+    elif args.command == 'down':
+        if os.path.exists(args.state_file):
+            pool.stop()
+    else:
+        with pool._state() as switches:
+            for sw in sorted(switches.values(), key=lambda sw: sw.device_id):
+                print("%s: %s device %d thrift %d pid %s %s%s" % (
+                    sw.name, sw.address, sw.device_id, sw.thrift_port, sw.pid,
+                    'running' if sw.alive() else 'dead',
+                    ', leased by %d' % sw.lessee if sw.leased() else ''))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmark of the per-value cost of p4runtime_lib.convert encoders.
+#
+# "legacy" is the previous implementation of convert.encode (type inference
+# with regexes on every call, hex formatting for numbers), kept here as the
+# reference point. "encode" is the current inferring encode(), "kind" is
+# encode() with a declared field kind and "typed" a prebuilt
+# convert.encoderFor() encoder for that kind.
+#
+import argparse
+import os
+import re
+import socket
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from p4runtime_lib import convert
+
+mac_pattern = re.compile(r'^([\da-fA-F]{2}:){5}([\da-fA-F]{2})$')
+ip_pattern = re.compile(r'^(\d{1,3}\.){3}(\d{1,3})$')
+
+
+def legacy_encode(x, bitwidth):
+    byte_len = convert.bitwidthToBytes(bitwidth)
+    if (type(x) == list or type(x) == tuple) and len(x) == 1:
+        x = x[0]
+    if type(x) == str:
+        if mac_pattern.match(x) is not None:
+            return bytes.fromhex(x.replace(':', ''))
+        elif ip_pattern.match(x) is not None:
+            return socket.inet_aton(x)
+        try:
+            return socket.inet_pton(socket.AF_INET6, x)
+        except socket.error:
+            return x
+    num_str = '%x' % x
+    return bytes.fromhex('0' * (byte_len * 2 - len(num_str)) + num_str)
+
+
+CASES = [
+    # (name, value, bitwidth, kind)
+    ('num9', 3, 9, convert.KIND_NUM),
+    ('num32', 3232235777, 32, convert.KIND_NUM),
+    ('ipv4', '10.0.1.10', 32, convert.KIND_IPV4),
+    ('mac', '00:aa:bb:00:00:01', 48, convert.KIND_MAC),
+    ('ipv6', '2001:db8::1', 128, convert.KIND_IPV6),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='convert.encode micro-benchmark')
+    parser.add_argument('-n', '--number', help='encodings per measurement',
+                        type=int, action="store", default=200000)
+    args = parser.parse_args()
+
+    print('%-6s %12s %12s %12s %12s' % ('value', 'legacy ns', 'encode ns', 'kind ns',
+                                        'typed ns'))
+    for name, value, bitwidth, kind in CASES:
+        typed = convert.encoderFor(bitwidth, kind)
+        assert (legacy_encode(value, bitwidth) == convert.encode(value, bitwidth) ==
+                convert.encode(value, bitwidth, kind) == typed(value))
+        results = []
+        for fn in (lambda: legacy_encode(value, bitwidth),
+                   lambda: convert.encode(value, bitwidth),
+                   lambda: convert.encode(value, bitwidth, kind),
+                   lambda: typed(value)):
+            secs = min(timeit.repeat(fn, number=args.number, repeat=3))
+            results.append(secs / args.number * 1e9)
+        print('%-6s %12.0f %12.0f %12.0f %12.0f' % ((name,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from p4.config.v1 import p4info_pb2
+
+'''
+ACL rule compiler. High-level allow/deny policies are compiled into a minimal
+set of entries of a P4 table with RANGE or TERNARY fields (e.g. the ports of
+MyIngress.firewall): value sets are merged into disjoint ranges, rules that
+are shadowed or redundant are removed, and ranges are expanded into prefixes
+for ternary fields. Entries are built with P4InfoHelper.compile_table.
+'''
+
+ALLOW = 'allow'
+DENY = 'deny'
+
+
+def mergeRanges(ranges):
+    "Returns the sorted list of disjoint (low, high) covering the given ranges"
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def complementRanges(ranges, low, high):
+    "Returns the ranges of [low, high] not covered by the merged ranges"
+    complement = []
+    for r_low, r_high in ranges:
+        if r_low > low:
+            complement.append((low, r_low - 1))
+        low = max(low, r_high + 1)
+    if low <= high:
+        complement.append((low, high))
+    return complement
+
+
+def rangeToPrefixes(low, high, bitwidth):
+    """Returns the minimal list of (value, prefix_len) prefixes of bitwidth
+    bits covering exactly [low, high]"""
+    prefixes = []
+    while low <= high:
+        # Largest aligned block starting at low that fits in the range
+        size = low & -low if low else 1 << bitwidth
+        while size > high - low + 1:
+            size >>= 1
+        prefixes.append((low, bitwidth - size.bit_length() + 1))
+        low += size
+    return prefixes
+
+
+def rangeToTernary(low, high, bitwidth):
+    "Returns the (value, mask) ternary matches covering exactly [low, high]"
+    full = (1 << bitwidth) - 1
+    return [(value, (full << (bitwidth - prefix_len)) & full)
+            for value, prefix_len in rangeToPrefixes(low, high, bitwidth)]
+
+
+def valueSet(values):
+    """Normalizes a set of values given as ints and (low, high) pairs into a
+    merged list of ranges"""
+    ranges = []
+    for v in values:
+        if isinstance(v, (tuple, list)):
+            ranges.append((int(v[0]), int(v[1])))
+        else:
+            ranges.append((int(v), int(v)))
+    return mergeRanges(ranges)
+
+
+def _covers(outer, inner):
+    "True if every range of inner is within one range of outer (both merged)"
+    return all(any(o_low <= low and high <= o_high for o_low, o_high in outer)
+               for low, high in inner)
+
+
+def _intersects(a, b):
+    return any(a_low <= b_high and b_low <= a_high for a_low, a_high in a for b_low, b_high in b)
+
+
+class AclPolicy(object):
+    """Policy for the traffic selected by match (LPM / exact field values,
+    e.g. {'hdr.ipv4.srcAddr': ('10.0.2.0', 24), 'hdr.ipv4.dstAddr': ...}).
+    rules is an ordered list of (ALLOW or DENY, conditions), the first
+    matching rule wins; conditions maps RANGE or TERNARY field names to value
+    sets (ints and (low, high) pairs), a missing field matching any value.
+    Traffic that matches no rule gets default."""
+
+    def __init__(self, match, rules, default=DENY):
+        self.match = dict(match)
+        self.rules = list(rules)
+        self.default = default
+
+
+class AclCompiler(object):
+    """Compiles AclPolicies into entries of table_name. Allowed traffic runs
+    allow_action (the table default action, so allowed traffic needs entries
+    only above denied traffic) and denied traffic deny_action."""
+
+    def __init__(self, p4info_helper, table_name, allow_action='NoAction',
+                 deny_action='MyIngress.drop', base_priority=1):
+        self.p4info_helper = p4info_helper
+        self.table_name = table_name
+        self.base_priority = base_priority
+        table = p4info_helper.get('tables', name=table_name)
+        self.fields = dict((mf.name, mf) for mf in table.match_fields)
+        self.builders = {
+            ALLOW: p4info_helper.compile_table(table_name, allow_action),
+            DENY: p4info_helper.compile_table(table_name, deny_action),
+        }
+
+    def _domain(self, name):
+        return [(0, (1 << self.fields[name].bitwidth) - 1)]
+
+    def _normalize(self, policy):
+        # Returns the rules as (action, {field: merged ranges}), without the
+        # conditions that match any value
+        rules = []
+        for action, conditions in policy.rules:
+            normalized = {}
+            for name, values in conditions.items():
+                mf = self.fields.get(name)
+                if mf is None or mf.match_type not in (p4info_pb2.MatchField.RANGE,
+                                                       p4info_pb2.MatchField.TERNARY):
+                    raise Exception("%r is not a range or ternary field of %s" % (
+                        name, self.table_name))
+                ranges = valueSet(values)
+                if ranges != self._domain(name):
+                    normalized[name] = ranges
+            rules.append((action, normalized))
+        return rules
+
+    def _optimize(self, rules, default):
+        # Conflict elimination: drop the rules that an earlier rule fully
+        # covers, since they can never match
+        kept = []
+        for action, conditions in rules:
+            if any(all(name in conditions and _covers(earlier[name], conditions[name])
+                       for name in earlier) for _, earlier in kept):
+                continue
+            kept.append((action, conditions))
+        # Redundancy: a rule with the default action is useless when no later
+        # rule with the other action overlaps it
+        result = []
+        for action, conditions in reversed(kept):
+            if action == default and not any(
+                    other_action != default and
+                    all(_intersects(conditions[name], other[name])
+                        for name in conditions if name in other)
+                    for other_action, other in result):
+                continue
+            result.append((action, conditions))
+        result.reverse()
+        return result
+
+    def _expand(self, conditions):
+        # Returns the list of {field: match value} covering the conditions
+        matches = [{}]
+        for name, ranges in sorted(conditions.items()):
+            mf = self.fields[name]
+            if mf.match_type == p4info_pb2.MatchField.RANGE:
+                values = ranges
+            else:
+                values = [t for low, high in ranges
+                          for t in rangeToTernary(low, high, mf.bitwidth)]
+            matches = [dict(m, **{name: v}) for m in matches for v in values]
+        return matches
+
+    def _layered(self, rules, default):
+        # One band of priority per rule, plus a catch-all for a deny default
+        layers = [(action, self._expand(conditions)) for action, conditions in rules]
+        if default == DENY:
+            layers.append((DENY, [{}]))
+        return layers
+
+    def _complement(self, rules, default):
+        # When the policy only allows values of a single field, the denied
+        # traffic is the complement of those values: no catch-all needed
+        if default != DENY or not rules or any(action != ALLOW for action, _ in rules):
+            return None
+        names = set(name for _, conditions in rules for name in conditions)
+        if len(names) != 1 or any(len(conditions) != 1 for _, conditions in rules):
+            return None
+        name = names.pop()
+        allowed = mergeRanges(r for _, conditions in rules for r in conditions[name])
+        denied = complementRanges(allowed, *self._domain(name)[0])
+        return [(DENY, self._expand({name: denied}))]
+
+    def compileLayers(self, policy):
+        """Returns the smallest list of (action, [matches]) layers for one
+        policy, highest priority first"""
+        rules = self._optimize(self._normalize(policy), policy.default)
+        layers = self._layered(rules, policy.default)
+        complement = self._complement(rules, policy.default)
+        if complement is not None and _size(complement) <= _size(layers):
+            layers = complement
+        return layers
+
+    def _specificity(self, policy):
+        specificity = 0
+        for name, value in policy.match.items():
+            mf = self.fields[name]
+            if mf.match_type == p4info_pb2.MatchField.LPM:
+                specificity += _lpm(value)[1]
+            else:
+                specificity += mf.bitwidth
+        return specificity
+
+    def compile(self, policies):
+        """Returns the table entries of all the policies. More specific
+        policies get higher priorities, so overlapping policies (e.g. a /24
+        inside a /16) behave like a longest prefix match. Policies for the
+        same match are merged, the rules of the first one coming first."""
+        merged = {}
+        for policy in policies:
+            key = tuple(sorted((name, str(value)) for name, value in policy.match.items()))
+            if key in merged:
+                merged[key].rules.extend(policy.rules)
+            else:
+                merged[key] = AclPolicy(policy.match, policy.rules, policy.default)
+
+        entries = []
+        priority = self.base_priority
+        for policy in sorted(merged.values(), key=self._specificity):
+            base = dict((name, _lpm(value) if self.fields[name].match_type ==
+                         p4info_pb2.MatchField.LPM else value)
+                        for name, value in policy.match.items())
+            for action, matches in reversed(self.compileLayers(policy)):
+                builder = self.builders[action]
+                for match in matches:
+                    entries.append(builder.build(dict(base, **match), priority=priority))
+                priority += 1
+        return entries
+
+
+def _size(layers):
+    return sum(len(matches) for _, matches in layers)
+
+
+def _lpm(value):
+    "Accepts 'a.b.c.d/len' or (address, prefix_len)"
+    if isinstance(value, str):
+        address, prefix_len = value.split('/')
+        return (address, int(prefix_len))
+    return (value[0], int(value[1]))
+
+
+if __name__ == '__main__':
+    # Run from utils/ with: python -m p4runtime_lib.acl [p4info]
+    import ipaddress
+    import os
+    import random
+    import sys
+
+    from .helper import P4InfoHelper
+
+    # Range expansion covers exactly the range
+    for _ in range(1000):
+        low = random.randrange(1 << 16)
+        high = random.randrange(low, 1 << 16)
+        covered = [(value, value + (1 << (16 - prefix_len)) - 1)
+                   for value, prefix_len in rangeToPrefixes(low, high, 16)]
+        assert(mergeRanges(covered) == [(low, high)])
+    assert(rangeToPrefixes(0, 65535, 16) == [(0, 0)])
+    assert(complementRanges([(25, 25), (80, 80)], 0, 65535) == [(0, 24), (26, 79), (81, 65535)])
+
+    p4info_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '../../build/s-router.p4.p4info.txt')
+    helper = P4InfoHelper(p4info_path)
+    compiler = AclCompiler(helper, "MyIngress.firewall")
+    SRC, DST, PROTO = "hdr.ipv4.srcAddr", "hdr.ipv4.dstAddr", "hdr.ipv4.protocol"
+    DPORT, SPORT = "hdr.tcp.dstPort", "hdr.tcp.srcPort"
+
+    # Firewall rules of the controller: drop unless the destination port is
+    # in dstPorts or the source port in srcPorts, plus overlapping policies
+    policies = [
+        AclPolicy({SRC: "10.0.2.0/24", DST: "10.0.1.10", PROTO: 6}, [(ALLOW, {SPORT: [80]})]),
+        AclPolicy({SRC: "10.0.2.0/24", DST: "10.0.1.20", PROTO: 6},
+                  [(ALLOW, {DPORT: [25]}), (ALLOW, {SPORT: [80]})]),
+        AclPolicy({SRC: "10.0.3.0/24", DST: "10.0.1.10", PROTO: 6},
+                  [(ALLOW, {DPORT: [443]}), (ALLOW, {SPORT: [8080]})]),
+        AclPolicy({SRC: "10.0.0.0/16", DST: "10.0.1.20", PROTO: 6},
+                  [(DENY, {DPORT: [(0, 1023)], SPORT: [(1024, 65535)]}), (ALLOW, {DPORT: [9]})],
+                  default=ALLOW),
+        AclPolicy({SRC: "10.0.2.0/24", DST: "10.0.1.20", PROTO: 6}, [(DENY, {DPORT: [26]})]),
+    ]
+    entries = compiler.compile(policies)
+
+    def baseline(packet):
+        # First matching rule of the most specific matching policy, with the
+        # policies of the same match merged in order; no policy: allowed
+        matching = [p for p in policies
+                    if packet[DST] == p.match[DST] and packet[PROTO] == p.match[PROTO] and
+                    packet[SRC] in ipaddress.ip_network(p.match[SRC])]
+        if not matching:
+            return ALLOW
+        best = max(matching, key=compiler._specificity)
+        rules = [rule for p in matching if p.match == best.match for rule in p.rules]
+        for action, conditions in rules:
+            if all(any(low <= packet[name] <= high for low, high in valueSet(values))
+                   for name, values in conditions.items()):
+                return action
+        return best.default
+
+    names = dict((mf.id, mf.name) for mf in compiler.fields.values())
+    drop_id = helper.get_actions_id("MyIngress.drop")
+
+    def compiled(packet):
+        # Action of the highest priority matching entry, allowed by default
+        best = None
+        for table_entry in entries:
+            for m in table_entry.match:
+                value = packet[names[m.field_id]]
+                if isinstance(value, ipaddress.IPv4Address):
+                    value = int(value)
+                kind = m.WhichOneof("field_match_type")
+                if kind == 'exact':
+                    ok = value == int.from_bytes(m.exact.value, 'big')
+                elif kind == 'lpm':
+                    shift = 32 - m.lpm.prefix_len
+                    ok = value >> shift == int.from_bytes(m.lpm.value, 'big') >> shift
+                else:
+                    ok = (int.from_bytes(m.range.low, 'big') <= value <=
+                          int.from_bytes(m.range.high, 'big'))
+                if not ok:
+                    break
+            else:
+                if best is None or table_entry.priority > best.priority:
+                    best = table_entry
+        if best is None or best.action.action.action_id != drop_id:
+            return ALLOW
+        return DENY
+
+    ports = [0, 8, 9, 10, 24, 25, 26, 79, 80, 81, 442, 443, 444, 1023, 1024,
+             8079, 8080, 8081, 65535]
+    random.seed(1)
+    for _ in range(20000):
+        packet = {
+            SRC: ipaddress.ip_address(random.choice(["10.0.2.5", "10.0.3.5", "10.0.4.5",
+                                                     "10.1.2.5"])),
+            DST: random.choice(["10.0.1.10", "10.0.1.20", "10.0.1.100"]),
+            PROTO: random.choice([6, 6, 17]),
+            DPORT: random.choice(ports + [random.randrange(1 << 16)]),
+            SPORT: random.choice(ports + [random.randrange(1 << 16)]),
+        }
+        expected = baseline(packet)
+        packet[DST] = ipaddress.ip_address(packet[DST])
+        assert(compiled(packet) == expected), packet
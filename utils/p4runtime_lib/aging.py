@@ -0,0 +1,191 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import heapq
+import threading
+from itertools import count
+from time import monotonic
+
+import grpc
+from google.rpc import code_pb2
+
+from .reconcile import canonicalMatchKey
+
+'''
+Flow aging. Entries written with an idle_timeout_ns are reported by the switch
+in IdleTimeoutNotification stream messages once they are idle; the FlowAger
+deletes them in coalesced batches. It also keeps a min-heap of the expected
+expiry of every tracked entry (its lifetime), so entries can be refreshed or
+evicted on time without polling the switch.
+'''
+
+
+class FlowAger(object):
+    """Ages the tracked entries of one switch.
+
+    lifetime is the default number of seconds after which a tracked entry
+    expires, whatever its traffic (None: entries only expire when the switch
+    reports them idle). At expiry, on_expire(table_entry), if given, is called:
+    a true result refreshes the entry for another lifetime, otherwise it is
+    evicted. Evictions and idle notifications are turned into DELETEs that are
+    sent in one batch every flush_interval seconds."""
+
+    def __init__(self, sw, lifetime=None, on_expire=None, flush_interval=0.1):
+        self.sw = sw
+        self.lifetime = lifetime
+        self.on_expire = on_expire
+        self.flush_interval = flush_interval
+        self.cond = threading.Condition()
+        self.heap = []  # (expiry, sequence, match key)
+        self.sequence = count()
+        self.entries = {}  # match key -> (TableEntry, expiry, lifetime)
+        self.pending_deletes = {}  # match key -> TableEntry
+        self.evicted = 0
+        self.refreshed = 0
+        self.idle = 0
+        self.errors = []
+        self.stopped = False
+        self.worker = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def start(self):
+        """Starts the aging thread and, if the connection has a stream
+        dispatcher, the handling of idle timeout notifications"""
+        dispatcher = self.sw.stream_dispatcher
+        if dispatcher is not None:
+            dispatcher.register('idle_timeout_notification', self.onIdleTimeout)
+        self.worker = threading.Thread(target=self._run, name='%s-aging' % self.sw.name)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.flush()
+
+    def track(self, table_entry, lifetime=None):
+        """Tracks a written entry. lifetime defaults to the one of the ager,
+        or to the idle timeout of the entry when the ager has none."""
+        if lifetime is None:
+            lifetime = self.lifetime
+        if lifetime is None and table_entry.idle_timeout_ns:
+            lifetime = table_entry.idle_timeout_ns / 1e9
+        key = canonicalMatchKey(table_entry)
+        with self.cond:
+            self._arm(key, table_entry, lifetime)
+
+    def _arm(self, key, table_entry, lifetime):
+        expiry = None
+        if lifetime is not None:
+            expiry = monotonic() + lifetime
+            heapq.heappush(self.heap, (expiry, next(self.sequence), key))
+            if self.heap[0][2] == key:
+                self.cond.notify_all()
+        self.entries[key] = (table_entry, expiry, lifetime)
+
+    def refresh(self, table_entry):
+        "Restarts the lifetime of a tracked entry"
+        key = canonicalMatchKey(table_entry)
+        with self.cond:
+            tracked = self.entries.get(key)
+            if tracked is not None:
+                self._arm(key, tracked[0], tracked[2])
+
+    def untrack(self, table_entry):
+        with self.cond:
+            self.entries.pop(canonicalMatchKey(table_entry), None)
+
+    def evict(self, table_entry):
+        "Deletes an entry with the next batch"
+        key = canonicalMatchKey(table_entry)
+        with self.cond:
+            tracked = self.entries.pop(key, None)
+            self.pending_deletes[key] = tracked[0] if tracked is not None else table_entry
+
+    def onIdleTimeout(self, notification):
+        "Handler of IdleTimeoutNotification stream messages"
+        for table_entry in notification.table_entry:
+            key = canonicalMatchKey(table_entry)
+            with self.cond:
+                tracked = self.entries.pop(key, None)
+                self.idle += 1
+                self.pending_deletes[key] = tracked[0] if tracked is not None else table_entry
+
+    def _expire(self, now):
+        # Pops the due heap items; stale items (refreshed or untracked entries)
+        # are skipped. Returns the entries to pass to on_expire.
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expiry, _, key = heapq.heappop(self.heap)
+            tracked = self.entries.get(key)
+            if tracked is None or tracked[1] != expiry:
+                continue
+            expired.append((key, tracked))
+        return expired
+
+    def _run(self):
+        next_flush = monotonic() + self.flush_interval
+        while True:
+            with self.cond:
+                if self.stopped:
+                    return
+                now = monotonic()
+                timeout = next_flush - now
+                if self.heap:
+                    timeout = min(timeout, self.heap[0][0] - now)
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                    continue
+                expired = self._expire(now)
+            for key, (table_entry, expiry, lifetime) in expired:
+                keep = self.on_expire(table_entry) if self.on_expire is not None else False
+                with self.cond:
+                    if self.entries.get(key, (None, None))[1] != expiry:
+                        continue  # refreshed or untracked meanwhile
+                    if keep:
+                        self.refreshed += 1
+                        self._arm(key, table_entry, lifetime)
+                    else:
+                        self.evicted += 1
+                        del self.entries[key]
+                        self.pending_deletes[key] = table_entry
+            if monotonic() >= next_flush:
+                self.flush()
+                next_flush = monotonic() + self.flush_interval
+
+    def flush(self):
+        "Sends the pending deletes in one batch"
+        with self.cond:
+            deletes, self.pending_deletes = self.pending_deletes, {}
+        if not deletes:
+            return
+        batch = self.sw.WriteBatch()
+        for table_entry in deletes.values():
+            batch.delete(table_entry)
+        try:
+            errors = batch.commit()
+        except grpc.RpcError as e:
+            print("%s: aging deletes failed: %s" % (self.sw.name, e.details()))
+            return
+        # Entries already gone from the switch are not an error
+        errors = [(idx, e) for idx, e in errors if e.canonical_code != code_pb2.NOT_FOUND]
+        if errors:
+            with self.cond:
+                self.errors.extend(errors)
@@ -0,0 +1,206 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+from abc import abstractmethod
+
+import grpc
+from p4.tmp import p4config_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from .error_utils import parseGrpcErrorBinaryDetails
+from .shadow import ShadowTables
+from .switch import WRITE_BATCH_MAX_BYTES, WRITE_BATCH_MAX_UPDATES, WriteBatch
+
+'''
+asyncio version of SwitchConnection, built on grpc.aio. All the calls are
+coroutines, so a single event loop can drive many switch sessions and overlap
+the writes to several devices, e.g. with asyncio.gather. The StreamChannel is
+fed from an asyncio.Queue and read by a task of the event loop.
+'''
+
+# Seconds to wait for the arbitration update of the switch
+ARBITRATION_TIMEOUT = 10
+
+
+class AsyncWriteBatch(WriteBatch):
+    "WriteBatch of an AsyncSwitchConnection, sent with await batch.commit()"
+
+    async def commit(self):
+        return await self.sw.commit(self)
+
+
+class AsyncSwitchConnection(object):
+    """Must be created and used from a running event loop. Also usable as an
+    async context manager, which shuts the connection down on exit."""
+
+    def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
+                 shadow=False, max_stream_messages=1024):
+        self.name = name
+        self.address = address
+        self.device_id = device_id
+        self.p4info = None
+        self.shadow = ShadowTables() if shadow else None
+        self.channel = grpc.aio.insecure_channel(address)
+        self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
+        self.requests_stream = asyncio.Queue()
+        # Stream messages other than arbitration updates (packet-in, digests...)
+        self.stream_messages = asyncio.Queue(max_stream_messages)
+        self.stream_msg_resp = None
+        self.stream_task = None
+        self.stream_error = None
+        self._arbitration = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.shutdown()
+
+    @abstractmethod
+    def buildDeviceConfig(self, **kwargs):
+        return p4config_pb2.P4DeviceConfig()
+
+    async def shutdown(self):
+        if self.stream_task is not None:
+            self.requests_stream.put_nowait(None)
+            self.stream_msg_resp.cancel()
+            try:
+                await self.stream_task
+            except asyncio.CancelledError:
+                pass
+            self.stream_task = None
+        await self.channel.close()
+
+    async def _requests(self):
+        while True:
+            request = await self.requests_stream.get()
+            if request is None:
+                return
+            yield request
+
+    def _startStream(self):
+        if self.stream_task is None:
+            self.stream_msg_resp = self.client_stub.StreamChannel(self._requests())
+            self.stream_task = asyncio.ensure_future(self._readStream())
+
+    async def _readStream(self):
+        try:
+            async for response in self.stream_msg_resp:
+                if (response.WhichOneof('update') == 'arbitration' and
+                        self._arbitration is not None and not self._arbitration.done()):
+                    self._arbitration.set_result(response)
+                else:
+                    await self.stream_messages.put(response)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.CANCELLED:
+                return
+            self._closeStream(e)
+            return
+        self._closeStream(Exception("%s: stream channel closed by the switch" % self.name))
+
+    def _closeStream(self, error):
+        # Fails the pending arbitration and the receive() waiters: a None
+        # message wakes up the waiters, which then raise stream_error
+        self.stream_error = error
+        if self._arbitration is not None and not self._arbitration.done():
+            self._arbitration.set_exception(error)
+        try:
+            self.stream_messages.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def send(self, request):
+        "Sends a StreamMessageRequest, e.g. a packet-out, on the stream channel"
+        self._startStream()
+        await self.requests_stream.put(request)
+
+    async def receive(self):
+        """Returns the next stream message that is not an arbitration update.
+        Raises the error of the stream channel once it is closed."""
+        if self.stream_error is not None and self.stream_messages.empty():
+            raise self.stream_error
+        message = await self.stream_messages.get()
+        if message is None:
+            # wake up the next waiter
+            self.stream_messages.put_nowait(None)
+            raise self.stream_error
+        return message
+
+    async def arbitrate(self, timeout=ARBITRATION_TIMEOUT):
+        """Sends a master arbitration update and returns the response of the
+        switch"""
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = self.device_id
+        request.arbitration.election_id.high = 0
+        request.arbitration.election_id.low = 1
+        self._arbitration = asyncio.get_running_loop().create_future()
+        await self.send(request)
+        return await asyncio.wait_for(self._arbitration, timeout)
+
+    async def set_pipeline(self, p4info, **kwargs):
+        device_config = self.buildDeviceConfig(**kwargs)
+        request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+        request.election_id.low = 1
+        request.device_id = self.device_id
+        request.config.p4info.CopyFrom(p4info)
+        request.config.p4_device_config = device_config.SerializeToString()
+        request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+        await self.client_stub.SetForwardingPipelineConfig(request)
+        self.p4info = p4info
+
+    def WriteBatch(self, max_batch=WRITE_BATCH_MAX_UPDATES,
+                   max_bytes=WRITE_BATCH_MAX_BYTES):
+        "Returns an AsyncWriteBatch, sent with await batch.commit()"
+        return AsyncWriteBatch(self, max_batch=max_batch, max_bytes=max_bytes)
+
+    async def write(self, table_entries):
+        """Writes table entries (inserted, or modified for default actions, as
+        SwitchConnection.WriteTableEntries does). Returns the list of
+        (index, p4.Error) for the entries rejected by the switch."""
+        batch = self.WriteBatch()
+        for table_entry in table_entries:
+            batch.write(table_entry)
+        return await self.commit(batch)
+
+    async def commit(self, batch):
+        "Sends the updates of a WriteBatch, see WriteBatch.commit"
+        errors = []
+        for offset, request in batch.requests():
+            try:
+                await self.client_stub.Write(request)
+            except grpc.RpcError as e:
+                p4_errors = parseGrpcErrorBinaryDetails(e)
+                if p4_errors is None:
+                    raise
+                errors.extend((offset + idx, p4_error) for idx, p4_error in p4_errors)
+                if self.shadow is not None:
+                    failed = set(idx for idx, _ in p4_errors)
+                    self.shadow.applyUpdates(
+                        u for idx, u in enumerate(request.updates) if idx not in failed)
+                continue
+            if self.shadow is not None:
+                self.shadow.applyUpdates(request.updates)
+        batch.updates = []
+        return errors
+
+    async def read(self, entities):
+        """Async iterator over the entities matching the entity filters (see
+        P4InfoHelper.buildReadEntities), read in a single ReadRequest"""
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        request.entities.extend(entities)
+        async for response in self.client_stub.Read(request):
+            for entity in response.entities:
+                yield entity
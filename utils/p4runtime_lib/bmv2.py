@@ -14,6 +14,7 @@
 #
 from p4.tmp import p4config_pb2
 
+from .aioswitch import AsyncSwitchConnection
 from .switch import SwitchConnection
 
 
@@ -30,3 +31,8 @@ def buildDeviceConfig(bmv2_json_file_path=None):
 class Bmv2SwitchConnection(SwitchConnection):
     def buildDeviceConfig(self, **kwargs):
         return buildDeviceConfig(**kwargs)
+
+
+class AsyncBmv2SwitchConnection(AsyncSwitchConnection):
+    def buildDeviceConfig(self, **kwargs):
+        return buildDeviceConfig(**kwargs)
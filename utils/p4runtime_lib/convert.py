@@ -12,17 +12,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import math
+import numbers
 import re
 import socket
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    # the column encoders fall back to per-value encoding
+    np = None
 
 '''
 This package contains several helper functions for encoding to and decoding from byte strings:
 - integers
 - IPv4 address strings
 - Ethernet address strings
+
+encode() infers the type of the value. When the kind of a field is known in
+advance (e.g. from a compiled table schema), encoderFor() returns a
+specialized encoder that skips inference.
+
+The encode*Column() functions encode a whole column of values at once (with
+NumPy when it is available) and return a list of byte strings.
 '''
 
+# Field kinds understood by encode() and encoderFor()
+KIND_MAC = 'mac'
+KIND_IPV4 = 'ipv4'
+KIND_IPV6 = 'ipv6'
+KIND_NUM = 'num'
+KIND_BYTES = 'bytes'
+
+# Max number of distinct strings remembered by the string encoding cache
+STRING_CACHE_SIZE = 4096
+
 mac_pattern = re.compile('^([\da-fA-F]{2}:){5}([\da-fA-F]{2})$')
 def matchesMac(mac_addr_string):
     return mac_pattern.match(mac_addr_string) is not None
@@ -31,7 +55,7 @@ def encodeMac(mac_addr_string):
     return bytes.fromhex(mac_addr_string.replace(':', ''))
 
 def decodeMac(encoded_mac_addr):
-    return ':'.join(s.hex() for s in encoded_mac_addr)
+    return ':'.join('%02x' % b for b in encoded_mac_addr)
 
 ip_pattern = re.compile('^(\d{1,3}\.){3}(\d{1,3})$')
 def matchesIPv4(ip_addr_string):
@@ -57,10 +81,12 @@ def decodeIPv6(encoded_ip_addr):
     return socket.inet_ntop(socket.AF_INET6, encoded_ip_addr) 
 
 def bitwidthToBytes(bitwidth):
-    return int(math.ceil(bitwidth / 8.0))
+    return (bitwidth + 7) // 8
 
 def encodeNum(number, bitwidth):
-    byte_len = bitwidthToBytes(bitwidth)
+    byte_len = (bitwidth + 7) // 8
+    if 0 <= number < 1 << bitwidth:
+        return number.to_bytes(byte_len, 'big')
     # If number is negative, calculate the positive number that its
     # 2's complement encoding would look like in 'bitwidth' bits.
     orig_number = number
@@ -68,69 +94,214 @@ def encodeNum(number, bitwidth):
         if number < -(2 ** (bitwidth-1)):
             raise Exception("Negative number, %d, has 2's complement representation that does not fit in %d bits" % (number, bitwidth))
         number = (2 ** bitwidth) + number
-    num_str = '%x' % number
-    if orig_number < 0:
-        print("CONVERT_NEGATIVE_NUMBER debug: orig_number=%s number=%s bitwidth=%d num_str='%s'"
-              "" % (orig_number, number, bitwidth, num_str))
+        print("CONVERT_NEGATIVE_NUMBER debug: orig_number=%s number=%s bitwidth=%d num_str='%x'"
+              "" % (orig_number, number, bitwidth, number))
     if number >= 2 ** bitwidth:
         raise Exception("Number, %d, does not fit in %d bits" % (number, bitwidth))
-    return bytes.fromhex('0' * (byte_len * 2 - len(num_str)) + num_str)
+    return number.to_bytes(byte_len, 'big')
 
 def decodeNum(encoded_number):
-    return int(encoded_number.hex(), 16)
+    return int.from_bytes(encoded_number, 'big')
+
+def numEncoder(bitwidth):
+    'Returns a function encoding non-negative integers on `bitwidth` bits'
+    byte_len = bitwidthToBytes(bitwidth)
+    limit = 2 ** bitwidth
+    def encode_num(number):
+        if 0 <= number < limit:
+            return number.to_bytes(byte_len, 'big')
+        # out of range or negative: let encodeNum raise or handle 2's complement
+        return encodeNum(number, bitwidth)
+    return encode_num
 
-def encode(x, bitwidth):
-    'Tries to infer the type of `x` and encode it'
+@lru_cache(maxsize=STRING_CACHE_SIZE)
+def encodeString(x):
+    'Infers the type of the string `x` and encodes it. Results are cached.'
+    if matchesMac(x):
+        return encodeMac(x)
+    elif matchesIPv4(x):
+        return encodeIPv4(x)
+    elif matchesIPv6(x):
+        return encodeIPv6(x)
+    else:
+        # Assume that the string is already encoded
+        return x
+
+# String encoders of the declared kinds, each with its own cache
+_kind_encoders = {
+    KIND_MAC: lru_cache(maxsize=STRING_CACHE_SIZE)(encodeMac),
+    KIND_IPV4: lru_cache(maxsize=STRING_CACHE_SIZE)(encodeIPv4),
+    KIND_IPV6: lru_cache(maxsize=STRING_CACHE_SIZE)(encodeIPv6),
+}
+
+@lru_cache(maxsize=256)
+def encoderFor(bitwidth, kind=None):
+    '''Returns a function encoding values of a field of `bitwidth` bits. If
+    `kind` is given (one of the KIND_* constants), strings are encoded without
+    inferring their type. Encoders are memoized by (bitwidth, kind).'''
     byte_len = bitwidthToBytes(bitwidth)
-    if (type(x) == list or type(x) == tuple) and len(x) == 1:
+    encode_num = numEncoder(bitwidth)
+    if kind is None:
+        encode_str = encodeString
+    elif kind == KIND_NUM:
+        encode_str = None
+    elif kind == KIND_BYTES:
+        encode_str = lambda x: x
+    elif kind in _kind_encoders:
+        encode_str = _kind_encoders[kind]
+    else:
+        raise Exception("Unknown field kind %r" % kind)
+
+    def encode_value(x):
+        t = type(x)
+        if t is int:
+            encoded_bytes = encode_num(x)
+        elif t is str and encode_str is not None:
+            encoded_bytes = encode_str(x)
+        elif t is bytes:
+            encoded_bytes = x
+        elif (t is list or t is tuple) and len(x) == 1:
+            return encode_value(x[0])
+        elif isinstance(x, numbers.Integral):
+            # e.g. NumPy integers
+            encoded_bytes = encode_num(int(x))
+        else:
+            raise Exception("Encoding objects of %r is not supported" % t)
+        if len(encoded_bytes) != byte_len:
+            raise Exception("Encoded value %r is %d bytes long, expected %d" % (
+                x, len(encoded_bytes), byte_len))
+        return encoded_bytes
+    return encode_value
+
+def encode(x, bitwidth, kind=None):
+    'Tries to infer the type of `x` and encode it, unless `kind` is given'
+    if kind is not None:
+        return encoderFor(bitwidth, kind)(x)
+    t = type(x)
+    if (t is list or t is tuple) and len(x) == 1:
         x = x[0]
+        t = type(x)
     encoded_bytes = None
-    if type(x) == str:
-        if matchesMac(x):
-            encoded_bytes = encodeMac(x)
-        elif matchesIPv4(x):
-            encoded_bytes = encodeIPv4(x)
-        elif matchesIPv6(x):
-            encoded_bytes = encodeIPv6(x)
-        else:
-            # Assume that the string is already encoded
-            encoded_bytes = x
-    elif type(x) == int:
+    if t is int:
         encoded_bytes = encodeNum(x, bitwidth)
+    elif t is str:
+        encoded_bytes = encodeString(x)
+    elif t is bytes:
+        encoded_bytes = x
     else:
-        raise Exception("Encoding objects of %r is not supported" % type(x))
-    assert(len(encoded_bytes) == byte_len)
+        raise Exception("Encoding objects of %r is not supported" % t)
+    assert(len(encoded_bytes) == (bitwidth + 7) // 8)
     return encoded_bytes
 
+def canonicalBytes(encoded):
+    '''Returns the canonical (shortest) representation of an encoded number,
+    as returned by P4Runtime servers: leading zero bytes are stripped, zero is
+    encoded as a single zero byte.'''
+    canonical = encoded.lstrip(b'\x00')
+    return canonical if canonical else b'\x00'
+
+def _splitBuffer(buf, width):
+    return [buf[i:i + width] for i in range(0, len(buf), width)]
+
+def _checkColumn(values, pattern, encoder, byte_len, name):
+    # Validates each element like the per-value encoder does: elements not
+    # matching pattern are encoded alone, so that they raise the same error
+    for x in values:
+        if type(x) is not str or pattern.match(x) is None:
+            encoded = encoder(x)
+            if len(encoded) != byte_len:
+                raise Exception("Encoded value %r is %d bytes long, expected %d" % (
+                    x, len(encoded), byte_len))
+            raise Exception("Invalid %s address %r in column" % (name, x))
+
+def encodeIPv4Column(ip_addr_strings):
+    'Encodes a list of IPv4 address strings'
+    if np is None or not ip_addr_strings:
+        return [encodeIPv4(ip) for ip in ip_addr_strings]
+    _checkColumn(ip_addr_strings, ip_pattern, encodeIPv4, 4, 'IPv4')
+    octets = np.array('.'.join(ip_addr_strings).split('.'), dtype=np.uint16)
+    if octets.max() > 255:
+        # inet_aton raises on the first address with an octet out of range
+        i = np.flatnonzero(octets.reshape(-1, 4).max(axis=1) > 255)[0]
+        encodeIPv4(ip_addr_strings[i])
+        raise Exception("Invalid IPv4 address %r in column" % ip_addr_strings[i])
+    return _splitBuffer(octets.astype(np.uint8).tobytes(), 4)
+
+def encodeMacColumn(mac_addr_strings):
+    'Encodes a list of Ethernet address strings'
+    _checkColumn(mac_addr_strings, mac_pattern, encodeMac, 6, 'MAC')
+    return _splitBuffer(bytes.fromhex(''.join(mac_addr_strings).replace(':', '')), 6)
+
+def encodeNumColumn(numbers, bitwidth):
+    'Encodes a list or array of non-negative integers on `bitwidth` bits'
+    byte_len = bitwidthToBytes(bitwidth)
+    if np is None or bitwidth > 64 or len(numbers) == 0:
+        encode_num = numEncoder(bitwidth)
+        return [encode_num(int(n)) for n in numbers]
+    values = np.asarray(numbers)
+    if values.dtype.kind not in 'iu':
+        raise Exception("Encoding column of %r is not supported" % values.dtype)
+    if values.min() < 0 or (bitwidth < 64 and values.max() >= 2 ** bitwidth):
+        # let the per-value encoder raise or handle 2's complement
+        encode_num = numEncoder(bitwidth)
+        return [encode_num(int(n)) for n in values]
+    big_endian = values.astype('>u8').view(np.uint8).reshape(-1, 8)
+    return _splitBuffer(big_endian[:, 8 - byte_len:].tobytes(), byte_len)
+
+def encodeColumn(values, bitwidth, kind=None):
+    '''Encodes a column of values of a field of `bitwidth` bits. Without `kind`,
+    the kind of the whole column is inferred from its first value.'''
+    if len(values) == 0:
+        return []
+    if kind is None:
+        first = values[0]
+        if isinstance(first, str):
+            if matchesMac(first):
+                kind = KIND_MAC
+            elif matchesIPv4(first):
+                kind = KIND_IPV4
+        elif isinstance(first, numbers.Integral) or (np is not None and isinstance(values, np.ndarray)):
+            kind = KIND_NUM
+    if kind == KIND_IPV4 and bitwidth == 32:
+        encoded = encodeIPv4Column(values)
+    elif kind == KIND_MAC and bitwidth == 48:
+        encoded = encodeMacColumn(values)
+    elif kind == KIND_NUM:
+        encoded = encodeNumColumn(values, bitwidth)
+    else:
+        encoder = encoderFor(bitwidth, kind)
+        return [encoder(x) for x in values]
+    return encoded
+
 if __name__ == '__main__':
     # TODO These tests should be moved out of main eventually
 
     # Test encoding and decoding for MAC address
     mac = "aa:bb:cc:dd:ee:ff"
     enc_mac = encodeMac(mac)
-    assert(enc_mac == '\xaa\xbb\xcc\xdd\xee\xff')
+    assert(enc_mac == b'\xaa\xbb\xcc\xdd\xee\xff')
     dec_mac = decodeMac(enc_mac)
     assert(mac == dec_mac)
 
     # Test encoding and decoding for IPv4 address
     ip0 = "10.0.0.1"
     enc_ipv4 = encodeIPv4(ip0)
-    assert(enc_ipv4 == '\x0a\x00\x00\x01')
+    assert(enc_ipv4 == b'\x0a\x00\x00\x01')
     dec_ipv4 = decodeIPv4(enc_ipv4)
     assert(ip0 == dec_ipv4)
 
     # Test encoding and decoding for IPv6 address
     ip1 = "2001:0db8:85a3:0000:0000:8a2e:0370:7334"
     enc_ipv6 = encodeIPv6(ip1)
-    assert(enc_ipv6 == '\x01\r\xb8\x85\xa3\x00\x00\x00\x00\x8a.\x03ps4')
+    assert(enc_ipv6 == b' \x01\r\xb8\x85\xa3\x00\x00\x00\x00\x8a.\x03ps4')
     dec_ipv6 = decodeIPv6(enc_ipv6)
-    assert(ip1 == dec_ipv6)
+    assert(encodeIPv6(dec_ipv6) == enc_ipv6)
 
     # Test encoding and decoding for a number
     num = 1337
     byte_len = 5
     enc_num = encodeNum(num, byte_len * 8)
-    assert(enc_num == '\x00\x00\x00\x05\x39')
+    assert(enc_num == b'\x00\x00\x00\x05\x39')
     dec_num = decodeNum(enc_num)
     assert(num == dec_num)
 
@@ -152,6 +323,39 @@ if __name__ == '__main__':
     assert(encode((num,), 5 * 8) == enc_num)
     assert(encode([num], 5 * 8) == enc_num)
 
+    # Test encoding with a declared field kind
+    assert(encode(mac, 6 * 8, KIND_MAC) == enc_mac)
+    assert(encoderFor(4 * 8, KIND_IPV4)(ip0) == enc_ipv4)
+    assert(encoderFor(5 * 8, KIND_NUM)(num) == enc_num)
+    assert(encoderFor(6 * 8)(mac) == enc_mac)
+    assert(numEncoder(9)(3) == b'\x00\x03')
+
+    assert(canonicalBytes(b'\x00\x03') == b'\x03')
+    assert(canonicalBytes(b'\x00\x00') == b'\x00')
+
+    # Test column encoding
+    assert(encodeColumn([ip0, "10.0.1.10"], 32) == [enc_ipv4, encodeIPv4("10.0.1.10")])
+    assert(encodeColumn([mac, mac], 48) == [enc_mac, enc_mac])
+    assert(encodeColumn([num, 3], 5 * 8) == [enc_num, encodeNum(3, 40)])
+    assert(encodeNumColumn([1, 511], 9) == [b'\x00\x01', b'\x01\xff'])
+    if np is not None:
+        assert(encodeColumn([np.int64(num), np.uint8(3)], 5 * 8) == [enc_num, encodeNum(3, 40)])
+        assert(encoderFor(5 * 8)(np.int64(num)) == enc_num)
+
+    # Invalid elements of a column raise like the per-value encoders
+    for column, encoder in ((["1.2.3.4.5", "6.7.8"], encodeIPv4Column),
+                            (["1.2.3.70000"], encodeIPv4Column),
+                            (["10.0.0.1", "10.0.0.256"], encodeIPv4Column),
+                            (["aa:bb:cc:dd:ee", "ff:00:11:22:33:44:55"], encodeMacColumn),
+                            (["aa:bb:cc:dd:ee:zz"], encodeMacColumn)):
+        try:
+            encoder(column)
+            raise AssertionError("expected exception")
+        except AssertionError:
+            raise
+        except Exception as e:
+            print(e)
+
     num = 256
     byte_len = 2
     try:
@@ -0,0 +1,148 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep, time
+
+import numpy as np
+
+'''
+Bulk polling of indirect counters. Every poll reads the whole counter array of
+each switch with a single wildcard read, all switches concurrently, and keeps
+the values in NumPy arrays so that per-index deltas and rates are cheap to
+compute.
+'''
+
+
+class CounterSample(object):
+    """Values of a whole counter array of one switch at a point in time, with
+    the deltas and rates since the previous sample (None for the first one).
+    All arrays are indexed by counter index."""
+    __slots__ = ('switch', 'counter', 'timestamp', 'packets', 'bytes',
+                 'interval', 'packet_deltas', 'byte_deltas')
+
+    def __init__(self, switch, counter, timestamp, packets, bytes):
+        self.switch = switch
+        self.counter = counter
+        self.timestamp = timestamp
+        self.packets = packets
+        self.bytes = bytes
+        self.interval = None
+        self.packet_deltas = None
+        self.byte_deltas = None
+
+    def diff(self, previous):
+        "Computes the deltas from a previous sample of the same counter"
+        self.interval = self.timestamp - previous.timestamp
+        self.packet_deltas = _delta(self.packets, previous.packets)
+        self.byte_deltas = _delta(self.bytes, previous.bytes)
+
+    @property
+    def packet_rates(self):
+        "Packets per second of each index since the previous sample"
+        if self.packet_deltas is None or not self.interval:
+            return None
+        return self.packet_deltas / self.interval
+
+    @property
+    def byte_rates(self):
+        "Bytes per second of each index since the previous sample"
+        if self.byte_deltas is None or not self.interval:
+            return None
+        return self.byte_deltas / self.interval
+
+    def active(self):
+        "Indexes that counted packets since the previous sample"
+        if self.packet_deltas is None:
+            return np.flatnonzero(self.packets)
+        return np.flatnonzero(self.packet_deltas)
+
+
+def _delta(current, previous):
+    # A counter lower than before was reset (e.g. the pipeline was pushed
+    # again), so its whole value counts as the delta
+    return np.where(current >= previous, current - previous, current)
+
+
+class CounterCollector(object):
+    """Polls counter_name on all the switches. The counter size comes from
+    the P4Info, so the sample arrays are allocated once per poll with the
+    right length. The reads run in a thread pool kept across the polls,
+    released by stop()."""
+
+    def __init__(self, p4info_helper, switches, counter_name, max_workers=None):
+        counter = p4info_helper.get('counters', name=counter_name)
+        self.counter_name = counter_name
+        self.counter_id = counter.preamble.id
+        self.size = counter.size
+        self.switches = list(switches)
+        self.max_workers = max_workers or len(self.switches) or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.last = {}  # switch name -> last CounterSample
+        self.listeners = []
+
+    def add_listener(self, listener):
+        "listener is called with the list of CounterSamples of every poll"
+        self.listeners.append(listener)
+
+    def read(self, sw):
+        "Reads the whole counter array of one switch in a single request"
+        packets = np.zeros(self.size, dtype=np.uint64)
+        bytes = np.zeros(self.size, dtype=np.uint64)
+        for response in sw.ReadCounters(self.counter_id):
+            for entity in response.entities:
+                counter = entity.counter_entry
+                packets[counter.index.index] = counter.data.packet_count
+                bytes[counter.index.index] = counter.data.byte_count
+        return CounterSample(sw.name, self.counter_name, time(), packets, bytes)
+
+    def poll(self):
+        """Reads the counter on all the switches concurrently. Returns one
+        CounterSample per switch, in the order of the switches."""
+        samples = list(self.executor.map(self.read, self.switches))
+        for sample in samples:
+            previous = self.last.get(sample.switch)
+            if previous is not None:
+                sample.diff(previous)
+            self.last[sample.switch] = sample
+        for listener in self.listeners:
+            # A failing listener must not stop the polling
+            try:
+                listener(samples)
+            except Exception as e:
+                print("%s listener %r failed: %s" % (self.counter_name, listener, e))
+        return samples
+
+    def stop(self):
+        "Shuts down the thread pool of the polls"
+        self.executor.shutdown(wait=True)
+
+    def run(self, interval, callback=None, count=None):
+        """Polls every interval seconds, count times or forever, and calls
+        callback with the samples of each poll"""
+        polls = 0
+        next_poll = perf_counter()
+        while count is None or polls < count:
+            samples = self.poll()
+            if callback is not None:
+                callback(samples)
+            polls += 1
+            if count is not None and polls >= count:
+                break
+            next_poll += interval
+            delay = next_poll - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_poll = perf_counter()
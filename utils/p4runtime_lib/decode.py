@@ -0,0 +1,182 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+'''
+Decoding of P4Runtime entities into lightweight Python records, with names
+instead of ids and ints instead of byte strings. Used together with
+SwitchConnection.ReadEntities, records are produced lazily as the read
+response stream arrives.
+'''
+
+
+def _int(value):
+    return int.from_bytes(value, 'big')
+
+
+class TableEntryRecord(object):
+    """match maps match field names to an int (exact, optional), an
+    (int, prefix_len) tuple (lpm), a (value, mask) tuple (ternary) or a
+    (low, high) tuple (range). params maps param names to ints."""
+    __slots__ = ('table', 'match', 'action', 'params', 'priority', 'is_default_action')
+
+    def __init__(self, table, match, action, params, priority, is_default_action):
+        self.table = table
+        self.match = match
+        self.action = action
+        self.params = params
+        self.priority = priority
+        self.is_default_action = is_default_action
+
+    def __repr__(self):
+        return 'TableEntryRecord(%s, %r -> %s%r, priority=%d)' % (
+            self.table, self.match, self.action, self.params, self.priority)
+
+
+class CounterRecord(object):
+    __slots__ = ('counter', 'index', 'packets', 'bytes')
+
+    def __init__(self, counter, index, packets, bytes):
+        self.counter = counter
+        self.index = index
+        self.packets = packets
+        self.bytes = bytes
+
+    def __repr__(self):
+        return 'CounterRecord(%s[%d], packets=%d, bytes=%d)' % (
+            self.counter, self.index, self.packets, self.bytes)
+
+
+class RegisterRecord(object):
+    "value is an int for bitstring registers, the P4Data message otherwise"
+    __slots__ = ('register', 'index', 'value')
+
+    def __init__(self, register, index, value):
+        self.register = register
+        self.index = index
+        self.value = value
+
+    def __repr__(self):
+        return 'RegisterRecord(%s[%d], value=%r)' % (self.register, self.index, self.value)
+
+
+class MeterRecord(object):
+    __slots__ = ('meter', 'index', 'cir', 'cburst', 'pir', 'pburst')
+
+    def __init__(self, meter, index, cir, cburst, pir, pburst):
+        self.meter = meter
+        self.index = index
+        self.cir = cir
+        self.cburst = cburst
+        self.pir = pir
+        self.pburst = pburst
+
+    def __repr__(self):
+        return 'MeterRecord(%s[%d], cir=%d, cburst=%d, pir=%d, pburst=%d)' % (
+            self.meter, self.index, self.cir, self.cburst, self.pir, self.pburst)
+
+
+class EntityDecoder(object):
+    """Turns P4Runtime entities into records. Names are resolved through the
+    P4InfoHelper indexes and memoized per id."""
+
+    def __init__(self, p4info_helper):
+        self.p4info_helper = p4info_helper
+        self._names = {}
+        self._match_fields = {}
+        self._params = {}
+
+    def _name(self, entity_type, id):
+        key = (entity_type, id)
+        name = self._names.get(key)
+        if name is None:
+            name = self._names[key] = self.p4info_helper.get_name(entity_type, id)
+        return name
+
+    def _matchFieldName(self, table_name, field_id):
+        key = (table_name, field_id)
+        name = self._match_fields.get(key)
+        if name is None:
+            name = self.p4info_helper.get_match_field_name(table_name, field_id)
+            self._match_fields[key] = name
+        return name
+
+    def _paramName(self, action_name, param_id):
+        key = (action_name, param_id)
+        name = self._params.get(key)
+        if name is None:
+            name = self.p4info_helper.get_action_param_name(action_name, param_id)
+            self._params[key] = name
+        return name
+
+    def decodeTableEntry(self, entry):
+        table_name = self._name('tables', entry.table_id)
+        match = {}
+        for m in entry.match:
+            match_type = m.WhichOneof("field_match_type")
+            if match_type == 'exact':
+                value = _int(m.exact.value)
+            elif match_type == 'lpm':
+                value = (_int(m.lpm.value), m.lpm.prefix_len)
+            elif match_type == 'ternary':
+                value = (_int(m.ternary.value), _int(m.ternary.mask))
+            elif match_type == 'range':
+                value = (_int(m.range.low), _int(m.range.high))
+            elif match_type == 'optional':
+                value = _int(m.optional.value)
+            else:
+                raise Exception("Unsupported match type with type %r" % match_type)
+            match[self._matchFieldName(table_name, m.field_id)] = value
+        action_name = None
+        params = {}
+        if entry.action.WhichOneof("type") == 'action':
+            action = entry.action.action
+            action_name = self._name('actions', action.action_id)
+            for p in action.params:
+                params[self._paramName(action_name, p.param_id)] = _int(p.value)
+        return TableEntryRecord(table_name, match, action_name, params,
+                                entry.priority, entry.is_default_action)
+
+    def decodeCounterEntry(self, entry):
+        return CounterRecord(self._name('counters', entry.counter_id), entry.index.index,
+                             entry.data.packet_count, entry.data.byte_count)
+
+    def decodeRegisterEntry(self, entry):
+        data = entry.data
+        value = _int(data.bitstring) if data.WhichOneof("data") == 'bitstring' else data
+        return RegisterRecord(self._name('registers', entry.register_id), entry.index.index, value)
+
+    def decodeMeterEntry(self, entry):
+        config = entry.config
+        return MeterRecord(self._name('meters', entry.meter_id), entry.index.index,
+                           config.cir, config.cburst, config.pir, config.pburst)
+
+    def decode(self, entity):
+        "Returns the record of an Entity, or None for unsupported entity types"
+        entity_type = entity.WhichOneof("entity")
+        if entity_type == 'table_entry':
+            return self.decodeTableEntry(entity.table_entry)
+        elif entity_type == 'counter_entry':
+            return self.decodeCounterEntry(entity.counter_entry)
+        elif entity_type == 'register_entry':
+            return self.decodeRegisterEntry(entity.register_entry)
+        elif entity_type == 'meter_entry':
+            return self.decodeMeterEntry(entity.meter_entry)
+        return None
+
+    def decodeEntities(self, entities):
+        "Lazily decodes an iterable of entities, e.g. from ReadEntities"
+        for entity in entities:
+            record = self.decode(entity)
+            if record is not None:
+                yield record
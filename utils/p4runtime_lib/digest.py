@@ -0,0 +1,156 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+from collections import namedtuple
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from .reconcile import canonicalMatchKey
+
+'''
+P4 digest support. A DigestProcessor subscribes to a digest (DigestEntry
+config write), decodes the received digest lists into typed records, hands
+them to a handler and acknowledges the lists in batches. The table entries
+returned by the handler are coalesced into a single batched write per flush,
+done before the acks of the lists that produced them are sent.
+'''
+
+
+class DigestDecoder(object):
+    """Decodes the data of the digest lists of one digest into namedtuples
+    with one int field per member of the digest struct (a single 'value'
+    field for a bitstring digest)."""
+
+    def __init__(self, p4info_helper, digest_name):
+        digest = p4info_helper.get('digests', name=digest_name)
+        self.digest_id = digest.preamble.id
+        type_spec = digest.type_spec
+        if type_spec.WhichOneof('type_spec') == 'struct':
+            struct = p4info_helper.p4info.type_info.structs[type_spec.struct.name]
+            names = [m.name for m in struct.members]
+            self.is_struct = True
+        else:
+            names = ['value']
+            self.is_struct = False
+        record_name = digest.preamble.name.split('.')[-1]
+        self.record = namedtuple(record_name, names, rename=True)
+
+    def decode(self, digest_list):
+        "Returns the list of records of a DigestList"
+        make = self.record._make
+        if self.is_struct:
+            return [make(int.from_bytes(m.bitstring, 'big') for m in data.struct.members)
+                    for data in digest_list.data]
+        return [make((int.from_bytes(data.bitstring, 'big'),)) for data in digest_list.data]
+
+
+class DigestProcessor(object):
+    """Processes the digests of one digest of a switch. handler is called with
+    the list of records of each digest list and may return table entries to
+    write. Pending acks and entries are flushed every flush_interval seconds
+    (keep it well below ack_timeout_ns) or once max_pending_acks lists are
+    waiting. Entries with the same match key are coalesced, the last one wins.
+    Requires a stream dispatcher on the switch connection."""
+
+    def __init__(self, sw, p4info_helper, digest_name, handler,
+                 max_timeout_ns=0, max_list_size=1, ack_timeout_ns=0,
+                 flush_interval=0.05, max_pending_acks=64):
+        self.sw = sw
+        self.decoder = DigestDecoder(p4info_helper, digest_name)
+        self.digest_id = self.decoder.digest_id
+        self.handler = handler
+        self.digest_entry = p4info_helper.buildDigestEntry(
+            digest_name, max_timeout_ns=max_timeout_ns, max_list_size=max_list_size,
+            ack_timeout_ns=ack_timeout_ns)
+        self.flush_interval = flush_interval
+        self.max_pending_acks = max_pending_acks
+        self.lock = threading.Lock()
+        self.pending_acks = []
+        self.pending_entries = {}  # canonical match key -> TableEntry
+        self.lists = 0
+        self.records = 0
+        self.errors = []
+        self.stopped = threading.Event()
+        self.flusher = None
+        # Handler of the other digests of the switch, if any
+        self.next_handler = None
+
+    def start(self):
+        "Subscribes to the digest and starts processing its digest lists"
+        if self.sw.stream_dispatcher is None:
+            raise Exception("%s: digests require a stream dispatcher" % self.sw.name)
+        self.next_handler = self.sw.stream_dispatcher.handlers.get('digest')
+        self.sw.stream_dispatcher.register('digest', self.onDigestList)
+        self.sw.WriteDigestEntry(self.digest_entry)
+        self.flusher = threading.Thread(target=self._flushLoop,
+                                        name='%s-digest-%d' % (self.sw.name, self.digest_id))
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def stop(self, unsubscribe=False):
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        if unsubscribe:
+            self.sw.WriteDigestEntry(self.digest_entry, p4runtime_pb2.Update.DELETE)
+
+    def onDigestList(self, digest_list):
+        if digest_list.digest_id != self.digest_id:
+            if self.next_handler is not None:
+                self.next_handler(digest_list)
+            return
+        records = self.decoder.decode(digest_list)
+        entries = self.handler(records) or []
+        with self.lock:
+            self.lists += 1
+            self.records += len(records)
+            for table_entry in entries:
+                self.pending_entries[canonicalMatchKey(table_entry)] = table_entry
+            self.pending_acks.append(digest_list.list_id)
+            flush = len(self.pending_acks) >= self.max_pending_acks
+        if flush:
+            self.flush()
+
+    def _flushLoop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        "Writes the pending entries in one batch, then acks the pending lists"
+        with self.lock:
+            acks, self.pending_acks = self.pending_acks, []
+            entries, self.pending_entries = self.pending_entries, {}
+        if entries:
+            batch = self.sw.WriteBatch()
+            for table_entry in entries.values():
+                if self.sw.shadow is not None:
+                    batch.upsert(table_entry)
+                else:
+                    batch.write(table_entry)
+            try:
+                errors = batch.commit()
+            except grpc.RpcError as e:
+                # Lists that are not acked are sent again by the switch once
+                # their ack timeout expires, so the learning is retried
+                print("%s: digest %d write failed: %s" % (self.sw.name, self.digest_id, e.details()))
+                return
+            if errors:
+                with self.lock:
+                    self.errors.extend(errors)
+        for list_id in acks:
+            self.sw.DigestListAck(self.digest_id, list_id)
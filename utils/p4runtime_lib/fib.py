@@ -0,0 +1,284 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import ipaddress
+
+from .convert import KIND_IPV4, KIND_MAC, KIND_NUM
+from .reconcile import diffTableEntries
+
+'''
+IPv4 FIB compression. A FibBuilder holds a routing table, aggregates it with
+the ORTC algorithm (Draves et al., "Constructing Optimal IP Routing Tables")
+into the smallest set of LPM entries forwarding every address the same way,
+and installs one next-hop entry (the destination MAC) per next hop instead of
+one per route. Changes to the routes are turned into incremental updates of
+the installed entries.
+'''
+
+# Next hop of the addresses without a route: the default action of the table
+DROP = 'drop'
+
+FIB_KINDS = {
+    "hdr.ipv4.dstAddr": KIND_IPV4,
+    "meta.next_hop_ipv4": KIND_IPV4,
+    "nxt_hop": KIND_IPV4,
+    "port": KIND_NUM,
+    "dst_mac": KIND_MAC,
+}
+
+
+class _Node(object):
+    __slots__ = ('children', 'next_hop', 'candidates')
+
+    def __init__(self, next_hop=None):
+        self.children = [None, None]
+        self.next_hop = next_hop
+        self.candidates = None
+
+
+def _choose(candidates):
+    # Deterministic choice, preferring the default action (no entry needed)
+    if DROP in candidates:
+        return DROP
+    return min(candidates)
+
+
+class FibBuilder(object):
+    """Routing table of one router. Routes map a prefix to a next hop, which
+    is the (next hop address, egress port) pair of the fwd_action; the
+    destination MAC of each next hop address goes to nexthop_table. Routes to
+    a None next hop drop the traffic.
+
+    entries() returns the compressed entries (all the LPM entries, then the
+    next-hop entries); update() returns the changes since the last update()."""
+
+    def __init__(self, p4info_helper, lpm_table="MyIngress.ipv4_lpm",
+                 fwd_action="MyIngress.ipv4_fwd", drop_action="MyIngress.drop",
+                 nexthop_table="MyIngress.dst_mac", rewrite_action="MyIngress.rewrite_dst_mac",
+                 aggregate=True):
+        self.fwd = p4info_helper.compile_table(lpm_table, fwd_action, FIB_KINDS)
+        self.drop = p4info_helper.compile_table(lpm_table, drop_action, FIB_KINDS)
+        self.rewrite = p4info_helper.compile_table(nexthop_table, rewrite_action, FIB_KINDS)
+        self.lpm_size = p4info_helper.get('tables', name=lpm_table).size
+        self.nexthop_size = p4info_helper.get('tables', name=nexthop_table).size
+        self.bitwidth = p4info_helper.get_match_field(lpm_table, name="hdr.ipv4.dstAddr").bitwidth
+        self.aggregate = aggregate
+        self.routes = {}  # (prefix, prefix_len) -> next hop or DROP
+        self.macs = {}    # next hop address -> (dst MAC, number of routes)
+        self.installed = []
+
+    def __len__(self):
+        return len(self.routes)
+
+    def _prefix(self, dstAddr, mask):
+        prefix = int(ipaddress.IPv4Address(dstAddr)) if isinstance(dstAddr, str) else dstAddr
+        host_bits = self.bitwidth - mask
+        return (prefix >> host_bits << host_bits, mask)
+
+    def add(self, dstAddr, mask, nextHop, port=None, dstMac=None):
+        "Adds or replaces the route of dstAddr/mask"
+        key = self._prefix(dstAddr, mask)
+        if key in self.routes:
+            self._release(self.routes[key])
+        if nextHop is None:
+            self.routes[key] = DROP
+            return
+        mac, count = self.macs.get(nextHop, (dstMac, 0))
+        if mac != dstMac:
+            raise Exception("Next hop %s has MAC %s, not %s" % (nextHop, mac, dstMac))
+        self.macs[nextHop] = (mac, count + 1)
+        self.routes[key] = (nextHop, port)
+
+    def remove(self, dstAddr, mask):
+        next_hop = self.routes.pop(self._prefix(dstAddr, mask))
+        self._release(next_hop)
+
+    def _release(self, next_hop):
+        if next_hop == DROP:
+            return
+        mac, count = self.macs[next_hop[0]]
+        if count > 1:
+            self.macs[next_hop[0]] = (mac, count - 1)
+        else:
+            del self.macs[next_hop[0]]
+
+    def _trie(self):
+        root = _Node()
+        for (prefix, prefix_len), next_hop in self.routes.items():
+            node = root
+            for depth in range(prefix_len):
+                bit = (prefix >> (self.bitwidth - 1 - depth)) & 1
+                if node.children[bit] is None:
+                    node.children[bit] = _Node()
+                node = node.children[bit]
+            node.next_hop = next_hop
+        return root
+
+    def _candidates(self, node, inherited):
+        # ORTC passes 1 and 2: complete the trie so that every node has zero
+        # or two children, push the next hops down to the leaves and compute
+        # bottom-up the set of next hops that are optimal for each subtree
+        next_hop = node.next_hop if node.next_hop is not None else inherited
+        if node.children == [None, None]:
+            node.candidates = frozenset((next_hop,))
+            return
+        for bit in (0, 1):
+            if node.children[bit] is None:
+                node.children[bit] = _Node()
+            self._candidates(node.children[bit], next_hop)
+        left, right = node.children[0].candidates, node.children[1].candidates
+        node.candidates = (left & right) or (left | right)
+
+    def _select(self, node, inherited, prefix, depth, routes):
+        # ORTC pass 3: top-down, a node only needs an entry when the next hop
+        # it inherits is not one of its optimal ones. Among optimal tables,
+        # prefer the one with the most specific prefixes: an inner node only
+        # gets an entry when it saves one, i.e. when both children need the
+        # same next hop and neither of them can use the inherited one.
+        left, right = node.children
+        if inherited in node.candidates:
+            next_hop = inherited
+        elif left is not None and (inherited in left.candidates or
+                                   inherited in right.candidates or
+                                   not left.candidates & right.candidates):
+            next_hop = inherited
+        else:
+            next_hop = _choose(node.candidates)
+            routes.append((prefix, depth, next_hop))
+        if left is not None:
+            shift = self.bitwidth - 1 - depth
+            self._select(left, next_hop, prefix, depth + 1, routes)
+            self._select(right, next_hop, prefix | (1 << shift), depth + 1, routes)
+
+    def compressed(self):
+        "Returns the aggregated routes, as a sorted list of (prefix, prefix_len, next hop)"
+        if not self.aggregate:
+            return sorted((prefix, prefix_len, next_hop)
+                          for (prefix, prefix_len), next_hop in self.routes.items())
+        root = self._trie()
+        self._candidates(root, DROP)
+        routes = []
+        self._select(root, DROP, 0, 0, routes)
+        return sorted(routes, key=lambda route: route[:2])
+
+    def entries(self):
+        "Returns the table entries of the compressed FIB"
+        lpm_entries = []
+        next_hops = set()
+        for prefix, prefix_len, next_hop in self.compressed():
+            if next_hop == DROP:
+                lpm_entries.append(self.drop.build([(prefix, prefix_len)]))
+            else:
+                lpm_entries.append(self.fwd.build([(prefix, prefix_len)], next_hop))
+                next_hops.add(next_hop[0])
+        if len(lpm_entries) > self.lpm_size or len(next_hops) > self.nexthop_size:
+            raise Exception("FIB needs %d LPM and %d next-hop entries, tables hold %d and %d" % (
+                len(lpm_entries), len(next_hops), self.lpm_size, self.nexthop_size))
+        nexthop_entries = [self.rewrite.build([address], [self.macs[address][0]])
+                           for address in sorted(next_hops)]
+        return lpm_entries + nexthop_entries
+
+    def update(self):
+        """Returns the (inserts, modifies, deletes) turning the entries of the
+        previous update() into the current ones"""
+        entries = self.entries()
+        changes = diffTableEntries(self.installed, entries)
+        self.installed = entries
+        return changes
+
+    def writeUpdates(self, batch):
+        """Adds the changes since the previous update to a WriteBatch: new
+        next hops first, then the LPM changes, then the unused next hops, so
+        that no route points to a missing next hop. Returns the number of
+        updates."""
+        inserts, modifies, deletes = self.update()
+        nexthop_id = self.rewrite.table_id
+        for table_entry in inserts:
+            if table_entry.table_id == nexthop_id:
+                batch.insert(table_entry)
+        for table_entry in modifies:
+            batch.modify(table_entry)
+        for table_entry in inserts:
+            if table_entry.table_id != nexthop_id:
+                batch.insert(table_entry)
+        for table_entry in sorted(deletes, key=lambda e: e.table_id == nexthop_id):
+            batch.delete(table_entry)
+        return len(inserts) + len(modifies) + len(deletes)
+
+
+if __name__ == '__main__':
+    # Run from utils/ with: python -m p4runtime_lib.fib [p4info]
+    import os
+    import random
+    import sys
+
+    from .helper import P4InfoHelper
+    from .reconcile import canonicalMatchKey
+
+    p4info_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '../../build/s-router.p4.p4info.txt')
+    helper = P4InfoHelper(p4info_path)
+
+    def lookup(routes, address):
+        # Longest prefix match over (prefix, prefix_len) -> next hop
+        for prefix_len in range(32, -1, -1):
+            shift = 32 - prefix_len
+            next_hop = routes.get((address >> shift << shift, prefix_len))
+            if next_hop is not None:
+                return next_hop
+        return DROP
+
+    next_hops = [("10.9.0.%d" % i, i, "00:00:00:00:00:%02x" % i) for i in range(1, 4)]
+    random.seed(1)
+    for _ in range(200):
+        fib = FibBuilder(helper)
+        for _ in range(random.randint(1, 30)):
+            # Mostly long prefixes under a few /4, so that they overlap
+            prefix_len = random.randint(20, 32) if random.random() < 0.8 else random.randint(0, 20)
+            prefix = (random.randrange(16) << 28) | random.getrandbits(28)
+            fib.add(prefix, prefix_len, *random.choice(next_hops + [(None, None, None)]))
+        compressed = fib.compressed()
+        assert(len(compressed) <= len(fib.routes))
+        compressed = dict(((prefix, prefix_len), next_hop)
+                          for prefix, prefix_len, next_hop in compressed)
+
+        # Same next hop for the first and last address of every prefix, their
+        # neighbors and random addresses
+        addresses = [random.getrandbits(32) for _ in range(100)]
+        for prefix, prefix_len in fib.routes:
+            last = prefix | ((1 << (32 - prefix_len)) - 1)
+            addresses.extend(a & 0xffffffff for a in (prefix - 1, prefix, last, last + 1))
+        for address in addresses:
+            assert(lookup(fib.routes, address) == lookup(compressed, address))
+
+    # Incremental updates turn the installed entries into the new ones
+    fib = FibBuilder(helper)
+    installed = {}
+    for _ in range(50):
+        if fib.routes and random.random() < 0.3:
+            prefix, prefix_len = random.choice(list(fib.routes))
+            fib.remove(prefix, prefix_len)
+        else:
+            fib.add(random.getrandbits(32), random.randint(16, 32), *random.choice(next_hops))
+        inserts, modifies, deletes = fib.update()
+        for table_entry in deletes:
+            del installed[canonicalMatchKey(table_entry)]
+        for table_entry in inserts:
+            assert(canonicalMatchKey(table_entry) not in installed)
+            installed[canonicalMatchKey(table_entry)] = table_entry
+        for table_entry in modifies:
+            assert(canonicalMatchKey(table_entry) in installed)
+            installed[canonicalMatchKey(table_entry)] = table_entry
+        assert(sorted(e.SerializeToString() for e in installed.values()) ==
+               sorted(e.SerializeToString() for e in fib.entries()))
@@ -18,7 +18,11 @@ import google.protobuf.text_format
 from p4.config.v1 import p4info_pb2
 from p4.v1 import p4runtime_pb2
 
-from .convert import encode
+from .convert import encode, encodeColumn, encoderFor
+
+
+get_id_re = re.compile(r"^get_(\w+)_id$")
+get_name_re = re.compile(r"^get_(\w+)_name$")
 
 
 class P4InfoHelper(object):
@@ -28,19 +32,54 @@ class P4InfoHelper(object):
         with open(p4_info_filepath) as p4info_f:
             google.protobuf.text_format.Merge(p4info_f.read(), p4info)
         self.p4info = p4info
+        self._build_indexes()
+        self._table_builders = {}
+
+    def _build_indexes(self):
+        # Hash indexes over all the entities with a preamble (tables, actions,
+        # counters, ...), built once so that lookups do not scan the P4Info.
+        # _by_name maps both names and aliases, like get() does.
+        self._by_name = {}
+        self._by_id = {}
+        for field in self.p4info.DESCRIPTOR.fields:
+            if field.label != field.LABEL_REPEATED or field.message_type is None:
+                continue
+            if 'preamble' not in field.message_type.fields_by_name:
+                continue
+            by_name = self._by_name[field.name] = {}
+            by_id = self._by_id[field.name] = {}
+            for o in getattr(self.p4info, field.name):
+                pre = o.preamble
+                by_name.setdefault(pre.alias, o)
+                by_id[pre.id] = o
+            # names take precedence over aliases
+            for o in getattr(self.p4info, field.name):
+                by_name[o.preamble.name] = o
+
+        # (table name, match field name or id) -> MatchField
+        self._match_fields = {}
+        for t in self.p4info.tables:
+            for mf in t.match_fields:
+                self._match_fields[(t.preamble.name, mf.name)] = mf
+                self._match_fields[(t.preamble.name, mf.id)] = mf
+
+        # (action name, param name or id) -> Action.Param
+        self._action_params = {}
+        for a in self.p4info.actions:
+            for p in a.params:
+                self._action_params[(a.preamble.name, p.name)] = p
+                self._action_params[(a.preamble.name, p.id)] = p
 
     def get(self, entity_type, name=None, id=None):
         if name is not None and id is not None:
             raise AssertionError("name or id must be None")
 
-        for o in getattr(self.p4info, entity_type):
-            pre = o.preamble
-            if name:
-                if (pre.name == name or pre.alias == name):
-                    return o
-            else:
-                if pre.id == id:
-                    return o
+        if name:
+            o = self._by_name.get(entity_type, {}).get(name)
+        else:
+            o = self._by_id.get(entity_type, {}).get(id)
+        if o is not None:
+            return o
 
         if name:
             raise AttributeError("Could not find %r of type %s" % (name, entity_type))
@@ -59,32 +98,42 @@ class P4InfoHelper(object):
     def __getattr__(self, attr):
         # Synthesize convenience functions for name to id lookups for top-level entities
         # e.g. get_tables_id(name_string) or get_actions_id(name_string)
-        m = re.search("^get_(\w+)_id$", attr)
+        # The function is cached on the instance, so __getattr__ only runs once
+        # per attribute name.
+        m = get_id_re.search(attr)
         if m:
             primitive = m.group(1)
-            return lambda name: self.get_id(primitive, name)
+            by_name = self._by_name.get(primitive, {})
+            def get_id(name):
+                o = by_name.get(name) if name else None
+                if o is None:
+                    return self.get_id(primitive, name)
+                return o.preamble.id
+            self.__dict__[attr] = get_id
+            return get_id
 
         # Synthesize convenience functions for id to name lookups
         # e.g. get_tables_name(id) or get_actions_name(id)
-        m = re.search("^get_(\w+)_name$", attr)
+        m = get_name_re.search(attr)
         if m:
             primitive = m.group(1)
-            return lambda id: self.get_name(primitive, id)
+            by_id = self._by_id.get(primitive, {})
+            def get_name(id):
+                o = by_id.get(id)
+                if o is None:
+                    return self.get_name(primitive, id)
+                return o.preamble.name
+            self.__dict__[attr] = get_name
+            return get_name
 
         raise AttributeError("%r object has no attribute %r" % (self.__class__, attr))
 
     def get_match_field(self, table_name, name=None, id=None):
-        for t in self.p4info.tables:
-            pre = t.preamble
-            if pre.name == table_name:
-                for mf in t.match_fields:
-                    if name is not None:
-                        if mf.name == name:
-                            return mf
-                    elif id is not None:
-                        if mf.id == id:
-                            return mf
-        raise AttributeError("%r has no attribute %r" % (table_name, name if name is not None else id))
+        key = name if name is not None else id
+        mf = self._match_fields.get((table_name, key))
+        if mf is None:
+            raise AttributeError("%r has no attribute %r" % (table_name, key))
+        return mf
 
     def get_match_field_id(self, table_name, match_field_name):
         return self.get_match_field(table_name, name=match_field_name).id
@@ -133,17 +182,13 @@ class P4InfoHelper(object):
             raise Exception("Unsupported match type with type %r" % match_type)
 
     def get_action_param(self, action_name, name=None, id=None):
-        for a in self.p4info.actions:
-            pre = a.preamble
-            if pre.name == action_name:
-                for p in a.params:
-                    if name is not None:
-                        if p.name == name:
-                            return p
-                    elif id is not None:
-                        if p.id == id:
-                            return p
-        raise AttributeError("action %r has no param %r, (has: %r)" % (action_name, name if name is not None else id, a.params))
+        key = name if name is not None else id
+        p = self._action_params.get((action_name, key))
+        if p is None:
+            a = self._by_name.get('actions', {}).get(action_name)
+            params = a.params if a is not None else []
+            raise AttributeError("action %r has no param %r, (has: %r)" % (action_name, key, params))
+        return p
 
     def get_action_param_id(self, action_name, param_name):
         return self.get_action_param(action_name, name=param_name).id
@@ -164,13 +209,17 @@ class P4InfoHelper(object):
                         default_action=False,
                         action_name=None,
                         action_params=None,
-                        priority=None):
+                        priority=None,
+                        idle_timeout_ns=None):
         table_entry = p4runtime_pb2.TableEntry()
         table_entry.table_id = self.get_tables_id(table_name)
 
         if priority is not None:
             table_entry.priority = priority
 
+        if idle_timeout_ns is not None:
+            table_entry.idle_timeout_ns = idle_timeout_ns
+
         if match_fields:
             table_entry.match.extend([
                 self.get_match_field_pb(table_name, match_field_name, value)
@@ -190,6 +239,46 @@ class P4InfoHelper(object):
                 ])
         return table_entry
 
+    def compile_table(self, table_name, action_name=None, kinds=None):
+        """Returns a TableEntryBuilder for entries of table_name running
+        action_name. Builders are cached, so this is cheap to call per entry.
+        kinds optionally maps match field and param names to a convert.KIND_*
+        value, so that their values are encoded without type inference."""
+        key = (table_name, action_name, tuple(sorted(kinds.items())) if kinds else None)
+        builder = self._table_builders.get(key)
+        if builder is None:
+            builder = TableEntryBuilder(self, table_name, action_name, kinds)
+            self._table_builders[key] = builder
+        return builder
+
+    def buildReadEntities(self, tables=None, counters=None, registers=None, meters=None):
+        """Returns the list of Entity filters for a ReadRequest. Each argument
+        is either None (not read), '*' (all entities of that type) or a list
+        of names."""
+        entities = []
+        for entity_type, names, field, id_field in (
+                ('tables', tables, 'table_entry', 'table_id'),
+                ('counters', counters, 'counter_entry', 'counter_id'),
+                ('registers', registers, 'register_entry', 'register_id'),
+                ('meters', meters, 'meter_entry', 'meter_id')):
+            if names is None:
+                continue
+            ids = [0] if names == '*' else [self.get_id(entity_type, name) for name in names]
+            for id in ids:
+                entity = p4runtime_pb2.Entity()
+                setattr(getattr(entity, field), id_field, id)
+                entities.append(entity)
+        return entities
+
+    def buildDigestEntry(self, digest_name, max_timeout_ns=0, max_list_size=1,
+                         ack_timeout_ns=0):
+        digest_entry = p4runtime_pb2.DigestEntry()
+        digest_entry.digest_id = self.get_digests_id(digest_name)
+        digest_entry.config.max_timeout_ns = max_timeout_ns
+        digest_entry.config.max_list_size = max_list_size
+        digest_entry.config.ack_timeout_ns = ack_timeout_ns
+        return digest_entry
+
     def buildMulticastGroupEntry(self, multicast_group_id, replicas):
         mc_entry = p4runtime_pb2.PacketReplicationEngineEntry()
         mc_entry.multicast_group_entry.multicast_group_id = multicast_group_id
@@ -211,3 +300,257 @@ class P4InfoHelper(object):
             r.instance = replica['instance']
             clone_entry.clone_session_entry.replicas.extend([r])
         return clone_entry
+
+
+def _matchSetter(match_type, encoder):
+    # Returns a function filling a p4runtime FieldMatch for the given match type
+    if match_type == p4info_pb2.MatchField.EXACT:
+        def set_exact(field_match, value):
+            field_match.exact.value = encoder(value)
+        return set_exact
+    elif match_type == p4info_pb2.MatchField.LPM:
+        def set_lpm(field_match, value):
+            field_match.lpm.value = encoder(value[0])
+            field_match.lpm.prefix_len = value[1]
+        return set_lpm
+    elif match_type == p4info_pb2.MatchField.TERNARY:
+        def set_ternary(field_match, value):
+            field_match.ternary.value = encoder(value[0])
+            field_match.ternary.mask = encoder(value[1])
+        return set_ternary
+    elif match_type == p4info_pb2.MatchField.RANGE:
+        def set_range(field_match, value):
+            field_match.range.low = encoder(value[0])
+            field_match.range.high = encoder(value[1])
+        return set_range
+    else:
+        raise Exception("Unsupported match type with type %r" % match_type)
+
+
+class TableEntryBuilder(object):
+    """Builds TableEntry messages for one table and one action. Table, match
+    field, action and param ids, match types and encoders are resolved once
+    from the P4Info, so build() only has to encode values.
+
+    Match values and action params are given either as dicts keyed by name or
+    as sequences ordered like match_field_names and param_names. A None match
+    value leaves the field out of the entry (don't care)."""
+
+    def __init__(self, p4info_helper, table_name, action_name=None, kinds=None):
+        kinds = kinds or {}
+        table = p4info_helper.get('tables', name=table_name)
+        self.table_name = table_name
+        self.table_id = table.preamble.id
+        self.match_field_names = tuple(mf.name for mf in table.match_fields)
+        self._match = [(mf.id, _matchSetter(mf.match_type,
+                                            encoderFor(mf.bitwidth, kinds.get(mf.name))))
+                       for mf in table.match_fields]
+        self._match_by_name = dict(zip(self.match_field_names, self._match))
+        self._match_schema = [(mf.id, mf.match_type, mf.bitwidth, kinds.get(mf.name))
+                              for mf in table.match_fields]
+
+        self.action_name = action_name
+        self.action_id = None
+        self.param_names = ()
+        self._params = []
+        self._param_schema = []
+        if action_name:
+            action = p4info_helper.get('actions', name=action_name)
+            self.action_id = action.preamble.id
+            self.param_names = tuple(p.name for p in action.params)
+            self._params = [(p.id, encoderFor(p.bitwidth, kinds.get(p.name)))
+                            for p in action.params]
+            self._param_schema = [(p.id, p.bitwidth, kinds.get(p.name)) for p in action.params]
+        self._params_by_name = dict(zip(self.param_names, self._params))
+
+    def _matchByName(self, name):
+        try:
+            return self._match_by_name[name]
+        except KeyError:
+            raise AttributeError("%r has no attribute %r" % (self.table_name, name))
+
+    def _paramByName(self, name):
+        try:
+            return self._params_by_name[name]
+        except KeyError:
+            raise AttributeError("action %r has no param %r, (has: %r)" % (
+                self.action_name, name, self.param_names))
+
+    def build(self, match=None, params=None, priority=None, default_action=False,
+              idle_timeout_ns=None):
+        table_entry = p4runtime_pb2.TableEntry()
+        table_entry.table_id = self.table_id
+
+        if priority is not None:
+            table_entry.priority = priority
+
+        if idle_timeout_ns is not None:
+            table_entry.idle_timeout_ns = idle_timeout_ns
+
+        if match:
+            if isinstance(match, dict):
+                fields = [(self._matchByName(name), value) for name, value in match.items()]
+            else:
+                fields = zip(self._match, match)
+            for (field_id, setter), value in fields:
+                if value is None:
+                    continue
+                field_match = table_entry.match.add()
+                field_match.field_id = field_id
+                setter(field_match, value)
+
+        if default_action:
+            table_entry.is_default_action = True
+
+        if self.action_id is not None:
+            action = table_entry.action.action
+            action.action_id = self.action_id
+            if params:
+                if isinstance(params, dict):
+                    values = [(self._paramByName(name), value) for name, value in params.items()]
+                else:
+                    values = zip(self._params, params)
+                for (param_id, encoder), value in values:
+                    param = action.params.add()
+                    param.param_id = param_id
+                    param.value = encoder(value)
+        return table_entry
+
+    def _orderedColumns(self, columns, names, kind):
+        # Returns the columns as a list ordered like names, None when missing
+        if not columns:
+            return [None] * len(names)
+        if not isinstance(columns, dict):
+            return list(columns) + [None] * (len(names) - len(columns))
+        for name in columns:
+            if name in names:
+                continue
+            if kind == 'match':
+                self._matchByName(name)
+            else:
+                self._paramByName(name)
+        return [columns.get(name) for name in names]
+
+    def build_columns(self, match_columns=None, param_columns=None, priorities=None,
+                      idle_timeout_ns=None):
+        """Builds many entries at once from columns of values, each column
+        being encoded in a single pass with convert.encodeColumn.
+
+        match_columns and param_columns are dicts keyed by name or sequences
+        in P4Info order. An exact match column is a list of values; LPM,
+        ternary and range columns are pairs of lists: (values, prefix_lens),
+        (values, masks) and (lows, highs). priorities is None, a single
+        priority or a list. idle_timeout_ns, if given, is set on all the
+        entries. Returns a list of TableEntry."""
+        match_columns = self._orderedColumns(match_columns, self.match_field_names, 'match')
+        param_columns = self._orderedColumns(param_columns, self.param_names, 'param')
+
+        matches = []  # (field id, match type name, attr, column, attr, column)
+        for (field_id, match_type, bitwidth, kind), column in zip(self._match_schema, match_columns):
+            if column is None:
+                continue
+            if match_type == p4info_pb2.MatchField.EXACT:
+                values = encodeColumn(column, bitwidth, kind)
+                matches.append((field_id, 'exact', 'value', values, None, None))
+            elif match_type == p4info_pb2.MatchField.LPM:
+                values = encodeColumn(column[0], bitwidth, kind)
+                prefix_lens = [int(p) for p in column[1]]
+                matches.append((field_id, 'lpm', 'value', values, 'prefix_len', prefix_lens))
+            elif match_type == p4info_pb2.MatchField.TERNARY:
+                values = encodeColumn(column[0], bitwidth, kind)
+                masks = encodeColumn(column[1], bitwidth, kind)
+                matches.append((field_id, 'ternary', 'value', values, 'mask', masks))
+            elif match_type == p4info_pb2.MatchField.RANGE:
+                lows = encodeColumn(column[0], bitwidth, kind)
+                highs = encodeColumn(column[1], bitwidth, kind)
+                matches.append((field_id, 'range', 'low', lows, 'high', highs))
+            else:
+                raise Exception("Unsupported match type with type %r" % match_type)
+
+        params = []
+        for (param_id, bitwidth, kind), column in zip(self._param_schema, param_columns):
+            if column is None:
+                continue
+            params.append((param_id, encodeColumn(column, bitwidth, kind)))
+
+        lengths = set(len(column) for match in matches for column in (match[3], match[5])
+                      if column is not None)
+        lengths.update(len(column) for _, column in params)
+        if priorities is not None and not isinstance(priorities, int):
+            lengths.add(len(priorities))
+        if len(lengths) > 1:
+            raise Exception("Columns of table '%s' have different lengths: %s" % (
+                self.table_name, ', '.join(str(n) for n in sorted(lengths))))
+        if not lengths:
+            return []
+        n = lengths.pop()
+        if priorities is None or isinstance(priorities, int):
+            priorities = [priorities] * n
+
+        table_entries = []
+        for i in range(n):
+            table_entry = p4runtime_pb2.TableEntry()
+            table_entry.table_id = self.table_id
+            if priorities[i] is not None:
+                table_entry.priority = priorities[i]
+            if idle_timeout_ns is not None:
+                table_entry.idle_timeout_ns = idle_timeout_ns
+            for field_id, match_type, attr1, column1, attr2, column2 in matches:
+                field_match = table_entry.match.add()
+                field_match.field_id = field_id
+                field_match = getattr(field_match, match_type)
+                setattr(field_match, attr1, column1[i])
+                if attr2 is not None:
+                    setattr(field_match, attr2, column2[i])
+            if self.action_id is not None:
+                action = table_entry.action.action
+                action.action_id = self.action_id
+                for param_id, column in params:
+                    param = action.params.add()
+                    param.param_id = param_id
+                    param.value = column[i]
+            table_entries.append(table_entry)
+        return table_entries
+
+
+if __name__ == '__main__':
+    # Run from utils/ with: python -m p4runtime_lib.helper [p4info]
+    import os
+    import sys
+
+    p4info_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '../../build/s-router.p4.p4info.txt')
+    helper = P4InfoHelper(p4info_path)
+
+    def same_entries(columns, rows):
+        return [e.SerializeToString() for e in columns] == [e.SerializeToString() for e in rows]
+
+    # Range only match
+    allow = helper.compile_table("MyIngress.allow_some_protocols", "NoAction")
+    entries = allow.build_columns({"hdr.ipv4.protocol": ([0, 6], [1, 17])}, priorities=1)
+    assert(len(entries) == 2)
+    assert(same_entries(entries, [allow.build([(0, 1)], priority=1),
+                                  allow.build([(6, 17)], priority=1)]))
+
+    # LPM, exact and range matches
+    kinds = {"hdr.ipv4.srcAddr": "ipv4", "hdr.ipv4.dstAddr": "ipv4"}
+    firewall = helper.compile_table("MyIngress.firewall", "MyIngress.drop", kinds)
+    entries = firewall.build_columns({
+        "hdr.ipv4.srcAddr": (["10.0.1.0", "10.0.2.1"], [24, 32]),
+        "hdr.ipv4.dstAddr": ["10.0.3.1", "10.0.3.2"],
+        "hdr.ipv4.protocol": [6, 17],
+        "hdr.tcp.dstPort": ([80, 0], [80, 1023]),
+    }, priorities=[10, 20])
+    assert(same_entries(entries, [
+        firewall.build({"hdr.ipv4.srcAddr": ("10.0.1.0", 24), "hdr.ipv4.dstAddr": "10.0.3.1",
+                        "hdr.ipv4.protocol": 6, "hdr.tcp.dstPort": (80, 80)}, priority=10),
+        firewall.build({"hdr.ipv4.srcAddr": ("10.0.2.1", 32), "hdr.ipv4.dstAddr": "10.0.3.2",
+                        "hdr.ipv4.protocol": 17, "hdr.tcp.dstPort": (0, 1023)}, priority=20)]))
+
+    # Columns of different lengths
+    try:
+        firewall.build_columns({"hdr.ipv4.dstAddr": ["10.0.3.1"],
+                                "hdr.tcp.dstPort": ([80, 0], [80, 1023])})
+        assert(False)
+    except Exception as e:
+        assert("different lengths" in str(e))
@@ -0,0 +1,279 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import argparse
+import gzip
+import os
+import struct
+import sys
+import threading
+from time import perf_counter, sleep, time_ns
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+'''
+Binary journal of P4Runtime requests. A journal file starts with JOURNAL_MAGIC
+and holds length-delimited records:
+
+    timestamp (ns, u64) | device id (u64) | method length (u16) |
+    payload length (u32) | method name | serialized request
+
+all little-endian. Journal files may be gzip-compressed. When a size limit is
+set, the journal is split in segments: path, path.1, path.2, ...
+
+Run as `python3 -m p4runtime_lib.journal` from the utils directory to dump a
+journal or replay it to a switch.
+'''
+
+JOURNAL_MAGIC = b'P4RJ\x01'
+RECORD_HEADER = struct.Struct('<QQHI')
+
+# Request message class of each P4Runtime RPC that can be journaled
+REQUEST_TYPES = {
+    'Write': p4runtime_pb2.WriteRequest,
+    'Read': p4runtime_pb2.ReadRequest,
+    'SetForwardingPipelineConfig': p4runtime_pb2.SetForwardingPipelineConfigRequest,
+    'GetForwardingPipelineConfig': p4runtime_pb2.GetForwardingPipelineConfigRequest,
+    'Capabilities': p4runtime_pb2.CapabilitiesRequest,
+}
+
+
+class JournalFormatException(Exception):
+    pass
+
+
+class JournalRecord(object):
+    __slots__ = ('timestamp_ns', 'device_id', 'method', 'payload')
+
+    def __init__(self, timestamp_ns, device_id, method, payload):
+        self.timestamp_ns = timestamp_ns
+        self.device_id = device_id
+        self.method = method
+        self.payload = payload
+
+    @property
+    def rpc_name(self):
+        # '/p4.v1.P4Runtime/Write' -> 'Write'
+        return self.method.rsplit('/', 1)[-1]
+
+    def request(self):
+        "Parses the payload into the request message of the RPC"
+        request_type = REQUEST_TYPES.get(self.rpc_name)
+        if request_type is None:
+            raise JournalFormatException("Unknown RPC %r" % self.method)
+        request = request_type()
+        request.ParseFromString(self.payload)
+        return request
+
+
+def segmentPath(path, index):
+    return path if index == 0 else '%s.%d' % (path, index)
+
+
+class JournalWriter(object):
+    """Appends records to a journal. Thread-safe. With compress=True segments
+    are gzip-compressed; with max_bytes set, a new segment is started once the
+    current one holds more than max_bytes of (uncompressed) records."""
+
+    def __init__(self, path, compress=False, max_bytes=None):
+        self.path = path
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.segment = 0
+        self.records = 0
+        self.lock = threading.Lock()
+        self.file = None
+        self._open()
+
+    def _open(self):
+        path = segmentPath(self.path, self.segment)
+        if self.compress:
+            self.file = gzip.open(path, 'wb', compresslevel=1)
+        else:
+            self.file = open(path, 'wb')
+        self.file.write(JOURNAL_MAGIC)
+        self.size = len(JOURNAL_MAGIC)
+
+    def append(self, method, device_id, payload, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time_ns()
+        method = method.encode('utf-8')
+        header = RECORD_HEADER.pack(timestamp_ns, device_id, len(method), len(payload))
+        with self.lock:
+            if self.file is None:
+                return
+            if self.max_bytes is not None and self.size >= self.max_bytes:
+                self.file.close()
+                self.segment += 1
+                self._open()
+            self.file.write(header + method + payload)
+            self.size += len(header) + len(method) + len(payload)
+            self.records += 1
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def _openSegment(path):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def readJournal(path):
+    "Yields the JournalRecords of all the segments of the journal at path"
+    index = 0
+    while os.path.exists(segmentPath(path, index)):
+        with _openSegment(segmentPath(path, index)) as f:
+            if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+                raise JournalFormatException("%s is not a P4Runtime journal" % segmentPath(path, index))
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    break
+                if len(header) < RECORD_HEADER.size:
+                    raise JournalFormatException("Truncated record header")
+                timestamp_ns, device_id, method_len, payload_len = RECORD_HEADER.unpack(header)
+                method = f.read(method_len)
+                if len(method) < method_len:
+                    raise JournalFormatException("Truncated record method")
+                try:
+                    method = method.decode('utf-8')
+                except UnicodeDecodeError:
+                    raise JournalFormatException("Invalid record method %r" % method)
+                payload = f.read(payload_len)
+                if len(payload) < payload_len:
+                    raise JournalFormatException("Truncated record payload")
+                yield JournalRecord(timestamp_ns, device_id, method, payload)
+        index += 1
+
+
+class GrpcRequestJournal(grpc.UnaryUnaryClientInterceptor,
+                         grpc.UnaryStreamClientInterceptor):
+    """Implementation of a gRPC interceptor that appends requests to a binary
+    journal"""
+
+    def __init__(self, journal):
+        if not isinstance(journal, JournalWriter):
+            journal = JournalWriter(journal)
+        self.journal = journal
+
+    def log_message(self, method_name, body):
+        self.journal.append(method_name, getattr(body, 'device_id', 0),
+                            body.SerializeToString())
+
+    def close(self):
+        self.journal.close()
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        self.log_message(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        self.log_message(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+
+def replay(records, client_stub, device_id=None, pace=False, speed=1.0):
+    """Sends journal records to a switch. With pace=True, the recorded spacing
+    between requests is reproduced (divided by speed), otherwise requests are
+    sent back to back. device_id, when given, overrides the recorded device id.
+    Returns (number of requests sent, number of failed requests)."""
+    sent = failed = 0
+    first_ts = None
+    start = perf_counter()
+    for record in records:
+        request = record.request()
+        if device_id is not None and hasattr(request, 'device_id'):
+            request.device_id = device_id
+        if pace:
+            if first_ts is None:
+                first_ts = record.timestamp_ns
+            delay = (record.timestamp_ns - first_ts) / 1e9 / speed - (perf_counter() - start)
+            if delay > 0:
+                sleep(delay)
+        rpc = getattr(client_stub, record.rpc_name)
+        try:
+            response = rpc(request)
+            if record.rpc_name == 'Read':
+                for _ in response:
+                    pass
+        except grpc.RpcError as e:
+            failed += 1
+            print("%s failed: %s (%s)" % (record.rpc_name, e.details(), e.code().name),
+                  file=sys.stderr)
+        sent += 1
+    return sent, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='P4Runtime request journal tool')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    dump_parser = subparsers.add_parser('dump', help='print the records of a journal')
+    dump_parser.add_argument('journal', type=str, help='path to the journal')
+
+    replay_parser = subparsers.add_parser('replay', help='replay a journal to a switch')
+    replay_parser.add_argument('journal', type=str, help='path to the journal')
+    replay_parser.add_argument('-a', '--p4runtime-server-addr',
+                               help='address and port of the switch\'s P4Runtime server',
+                               type=str, action="store", required=True)
+    replay_parser.add_argument('-d', '--device-id',
+                               help='device ID to use instead of the recorded one',
+                               type=int, action="store", default=None)
+    replay_parser.add_argument('--pace', help='reproduce the recorded request timing',
+                               action="store_true")
+    replay_parser.add_argument('--speed', help='speed-up factor of the recorded timing',
+                               type=float, action="store", default=1.0)
+
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        for record in readJournal(args.journal):
+            print("[%d] %s device_id=%d (%d bytes)" % (
+                record.timestamp_ns, record.method, record.device_id, len(record.payload)))
+        return
+
+    from .switch import SwitchConnection
+
+    records = list(readJournal(args.journal))
+    device_id = args.device_id
+    if device_id is None:
+        device_id = records[0].device_id if records else 0
+    sw = SwitchConnection(name='replay', address=args.p4runtime_server_addr,
+                          device_id=device_id)
+    try:
+        # Writes are only accepted from the master controller
+        sw.MasterArbitrationUpdate()
+        start = perf_counter()
+        sent, failed = replay(records, sw.client_stub, device_id=args.device_id,
+                              pace=args.pace, speed=args.speed)
+        elapsed = perf_counter() - start
+        print("Replayed %d requests (%d failed) in %.3fs (%.0f req/s)" % (
+            sent, failed, elapsed, sent / elapsed if elapsed else 0))
+    finally:
+        sw.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+'''
+Concurrent bring-up of several switches. Each switch runs its own ordered list
+of steps (e.g. arbitration, then pipeline config, then table entries) in a
+worker thread, so the total bring-up time is the one of the slowest switch.
+'''
+
+
+class ProvisionReport(object):
+    "Timings and results of the bring-up of one switch"
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []  # list of (phase name, seconds)
+        self.results = {}
+        self.error = None
+        self.failed_phase = None
+        self.total = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        phases = ', '.join('%s=%.1fms' % (phase, secs * 1000) for phase, secs in self.phases)
+        status = 'ok' if self.ok else 'FAILED in %s: %s' % (self.failed_phase, self.error)
+        return '%s: %.1fms (%s) %s' % (self.name, self.total * 1000, phases, status)
+
+
+def bringupSteps(p4info_helper, bmv2_json_file_path, table_entries=None):
+    """Returns the standard bring-up steps of a BMv2 switch: master arbitration,
+    pipeline config and then a batched write of table_entries."""
+    steps = [
+        ('arbitration', lambda sw: sw.MasterArbitrationUpdate()),
+        ('pipeline', lambda sw: sw.SetForwardingPipelineConfig(
+            p4info=p4info_helper.p4info, bmv2_json_file_path=bmv2_json_file_path)),
+    ]
+    if table_entries is not None:
+        steps.append(('entries', lambda sw: sw.WriteTableEntries(table_entries)))
+    return steps
+
+
+class SwitchProvisioner(object):
+    """Runs the bring-up steps of several switches concurrently. Steps of the
+    same switch always run in order, in a single worker thread."""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.jobs = []
+
+    def add(self, sw, steps):
+        "steps is a list of (phase name, callable taking the switch connection)"
+        self.jobs.append((sw, list(steps)))
+
+    def _bringup(self, sw, steps):
+        report = ProvisionReport(sw.name)
+        start = perf_counter()
+        for phase, step in steps:
+            phase_start = perf_counter()
+            try:
+                report.results[phase] = step(sw)
+            except Exception as e:
+                report.error = e
+                report.failed_phase = phase
+                break
+            finally:
+                report.phases.append((phase, perf_counter() - phase_start))
+        report.total = perf_counter() - start
+        return report
+
+    def run(self):
+        "Returns one ProvisionReport per switch, in the order they were added"
+        if not self.jobs:
+            return []
+        max_workers = self.max_workers or len(self.jobs)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._bringup, sw, steps) for sw, steps in self.jobs]
+            return [f.result() for f in futures]
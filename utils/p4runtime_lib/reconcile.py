@@ -0,0 +1,238 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from .convert import canonicalBytes
+
+'''
+Reconciliation of the table entries of a switch with a desired state. The
+current entries are read from the switch and diffed against the desired ones
+by canonical match key, and only the minimal INSERT / MODIFY / DELETE batch is
+written.
+'''
+
+
+def canonicalMatchKey(table_entry):
+    """Returns a hashable key identifying the entry in its table: table id,
+    priority and match, with all byte strings in canonical form. The default
+    entry of a table has the key (table_id, 'default')."""
+    if table_entry.is_default_action:
+        return (table_entry.table_id, 'default')
+    fields = []
+    for m in table_entry.match:
+        match_type = m.WhichOneof("field_match_type")
+        if match_type == 'exact':
+            fields.append((m.field_id, canonicalBytes(m.exact.value)))
+        elif match_type == 'lpm':
+            fields.append((m.field_id, canonicalBytes(m.lpm.value), m.lpm.prefix_len))
+        elif match_type == 'ternary':
+            fields.append((m.field_id, canonicalBytes(m.ternary.value),
+                           canonicalBytes(m.ternary.mask)))
+        elif match_type == 'range':
+            fields.append((m.field_id, canonicalBytes(m.range.low),
+                           canonicalBytes(m.range.high)))
+        elif match_type == 'optional':
+            fields.append((m.field_id, canonicalBytes(m.optional.value)))
+        else:
+            fields.append((m.field_id, m.SerializeToString()))
+    fields.sort()
+    return (table_entry.table_id, table_entry.priority, tuple(fields))
+
+
+def canonicalAction(table_entry):
+    "Returns a hashable representation of the action of the entry"
+    action_type = table_entry.action.WhichOneof("type")
+    if action_type == 'action':
+        action = table_entry.action.action
+        return (action.action_id, tuple(sorted(
+            (p.param_id, canonicalBytes(p.value)) for p in action.params)))
+    if action_type is None:
+        return None
+    return (action_type, table_entry.action.SerializeToString(deterministic=True))
+
+
+class DesiredEntries(object):
+    "Collects desired table entries, with the same write() as a WriteBatch"
+
+    def __init__(self):
+        self.entries = []
+
+    def write(self, table_entry):
+        self.entries.append(table_entry)
+
+
+class ReconcileResult(object):
+    def __init__(self, inserts, modifies, deletes, errors=None):
+        self.inserts = inserts
+        self.modifies = modifies
+        self.deletes = deletes
+        self.errors = errors or []
+
+    def __str__(self):
+        return '%d inserted, %d modified, %d deleted, %d errors' % (
+            len(self.inserts), len(self.modifies), len(self.deletes), len(self.errors))
+
+
+def diffTableEntries(current_entries, desired_entries, delete_extra=True):
+    """Diffs two iterables of TableEntry by canonical match key. Returns the
+    (inserts, modifies, deletes) lists of entries needed to turn the current
+    state into the desired one. Entries that only exist in the current state
+    are deleted when delete_extra is True. Default entries are never deleted."""
+    current = {}
+    for table_entry in current_entries:
+        current[canonicalMatchKey(table_entry)] = table_entry
+
+    inserts = []
+    modifies = []
+    seen = set()
+    for table_entry in desired_entries:
+        key = canonicalMatchKey(table_entry)
+        seen.add(key)
+        existing = current.get(key)
+        if existing is None:
+            if table_entry.is_default_action:
+                modifies.append(table_entry)
+            else:
+                inserts.append(table_entry)
+        elif canonicalAction(existing) != canonicalAction(table_entry):
+            modifies.append(table_entry)
+
+    deletes = []
+    if delete_extra:
+        deletes = [table_entry for key, table_entry in current.items()
+                   if key not in seen and not table_entry.is_default_action]
+    return inserts, modifies, deletes
+
+
+def readTableEntries(sw, table_ids):
+    "Yields the entries of the given tables read from the switch"
+    for table_id in table_ids:
+        for response in sw.ReadTableEntries(table_id=table_id):
+            for entity in response.entities:
+                yield entity.table_entry
+
+
+def reconcile(sw, desired_entries, table_ids=None, delete_extra=True, dry_run=False,
+              from_device=False):
+    """Brings the tables of the switch to the desired entries with the minimal
+    batch of updates. Only the tables in table_ids (default: the tables of the
+    desired entries) are read and cleaned up. When the switch connection has
+    shadow tables, the current entries are taken from them unless from_device
+    is True. The deletes are committed first, in their own batch (the
+    updates of one WriteRequest may be applied in any order), so that they
+    free table space for the inserts. Error indexes count the deletes, then
+    the modifies, then the inserts. Returns a ReconcileResult."""
+    desired_entries = list(desired_entries)
+    if table_ids is None:
+        table_ids = sorted(set(e.table_id for e in desired_entries))
+    if getattr(sw, 'shadow', None) is not None and not from_device:
+        current_entries = [e for table_id in table_ids for e in sw.shadow.entries(table_id)]
+    else:
+        current_entries = readTableEntries(sw, table_ids)
+    inserts, modifies, deletes = diffTableEntries(current_entries, desired_entries,
+                                                  delete_extra=delete_extra)
+    batch = sw.WriteBatch()
+    for table_entry in deletes:
+        batch.delete(table_entry)
+    errors = batch.commit(dry_run=dry_run)
+    batch = sw.WriteBatch()
+    for table_entry in modifies:
+        batch.modify(table_entry)
+    for table_entry in inserts:
+        batch.insert(table_entry)
+    errors.extend((len(deletes) + idx, p4_error)
+                  for idx, p4_error in batch.commit(dry_run=dry_run))
+    return ReconcileResult(inserts, modifies, deletes, errors)
+
+
+if __name__ == '__main__':
+    # Run from utils/ with: python -m p4runtime_lib.reconcile
+    from p4.v1 import p4runtime_pb2
+
+    def entry(dst, prefix_len, port=None, default=False):
+        table_entry = p4runtime_pb2.TableEntry()
+        table_entry.table_id = 1
+        if default:
+            table_entry.is_default_action = True
+        else:
+            m = table_entry.match.add()
+            m.field_id = 1
+            m.lpm.value = dst
+            m.lpm.prefix_len = prefix_len
+        table_entry.action.action.action_id = 2
+        if port is not None:
+            param = table_entry.action.action.params.add()
+            param.param_id = 1
+            param.value = port
+        return table_entry
+
+    # Keys and actions compare in canonical form
+    assert(canonicalMatchKey(entry(b'\x0a\x00\x01\x00', 24)) ==
+           canonicalMatchKey(entry(b'\x00\x0a\x00\x01\x00', 24)))
+    assert(canonicalMatchKey(entry(b'\x0a\x00\x01\x00', 24)) !=
+           canonicalMatchKey(entry(b'\x0a\x00\x01\x00', 16)))
+    assert(canonicalAction(entry(b'\x0a', 8, b'\x00\x01')) ==
+           canonicalAction(entry(b'\x0a', 8, b'\x01')))
+
+    current = [entry(b'\x0a\x00\x01\x00', 24, b'\x01'),
+               entry(b'\x0a\x00\x02\x00', 24, b'\x02'),
+               entry(b'\x0a\x00\x03\x00', 24, b'\x03'),
+               entry(b'', 0, default=True)]
+    desired = [entry(b'\x0a\x00\x01\x00', 24, b'\x00\x01'),  # same
+               entry(b'\x0a\x00\x02\x00', 24, b'\x04'),      # modified
+               entry(b'\x0a\x00\x04\x00', 24, b'\x04')]      # inserted
+    inserts, modifies, deletes = diffTableEntries(current, desired)
+    assert(inserts == desired[2:] and modifies == desired[1:2] and deletes == current[2:3])
+    inserts, modifies, deletes = diffTableEntries(current, desired, delete_extra=False)
+    assert(deletes == [])
+
+    # The deletes go in their own batch, committed first
+    class Batch(object):
+        def __init__(self, sw):
+            self.sw = sw
+            self.updates = []
+
+        def delete(self, table_entry):
+            self.updates.append(('delete', table_entry))
+
+        def modify(self, table_entry):
+            self.updates.append(('modify', table_entry))
+
+        def insert(self, table_entry):
+            self.updates.append(('insert', table_entry))
+
+        def commit(self, dry_run=False):
+            self.sw.commits.append([update_type for update_type, _ in self.updates])
+            return [(idx, None) for idx, (_, e) in enumerate(self.updates) if e in self.sw.rejected]
+
+    class Switch(object):
+        shadow = None
+
+        def __init__(self, rejected):
+            self.commits = []
+            self.rejected = rejected
+
+        def ReadTableEntries(self, table_id=None):
+            response = p4runtime_pb2.ReadResponse()
+            for table_entry in current:
+                response.entities.add().table_entry.CopyFrom(table_entry)
+            return [response]
+
+        def WriteBatch(self):
+            return Batch(self)
+
+    sw = Switch(rejected=[desired[2]])
+    result = reconcile(sw, desired)
+    assert(sw.commits == [['delete'], ['modify', 'insert']])
+    assert([idx for idx, _ in result.errors] == [2])
+    assert(str(result) == '1 inserted, 1 modified, 1 deleted, 1 errors')
@@ -0,0 +1,84 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+
+from p4.v1 import p4runtime_pb2
+
+from .reconcile import canonicalAction, canonicalMatchKey
+
+
+class ShadowTables(object):
+    """Local write-through copy of the table entries of a switch. Entries are
+    stored by table id and canonical match key (see reconcile.canonicalMatchKey)
+    and hold the last successfully written version of each entry."""
+
+    def __init__(self):
+        self.tables = {}  # table id -> {canonical match key: TableEntry}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.tables.values())
+
+    def apply(self, update_type, table_entry):
+        "Records a successful INSERT, MODIFY or DELETE of table_entry"
+        key = canonicalMatchKey(table_entry)
+        with self.lock:
+            entries = self.tables.setdefault(table_entry.table_id, {})
+            if update_type == p4runtime_pb2.Update.DELETE:
+                entries.pop(key, None)
+            else:
+                entry = p4runtime_pb2.TableEntry()
+                entry.CopyFrom(table_entry)
+                entries[key] = entry
+
+    def applyUpdates(self, updates):
+        for update in updates:
+            if update.entity.WhichOneof('entity') == 'table_entry':
+                self.apply(update.type, update.entity.table_entry)
+
+    def get(self, table_entry):
+        "Returns the stored entry with the same match key, or None"
+        entries = self.tables.get(table_entry.table_id)
+        if not entries:
+            return None
+        return entries.get(canonicalMatchKey(table_entry))
+
+    def __contains__(self, table_entry):
+        return self.get(table_entry) is not None
+
+    def matches(self, table_entry):
+        "True if the same entry, with the same action, is already installed"
+        existing = self.get(table_entry)
+        return existing is not None and canonicalAction(existing) == canonicalAction(table_entry)
+
+    def entries(self, table_id=None):
+        "Returns the stored entries of one table, or of all tables"
+        with self.lock:
+            if table_id is not None:
+                return list(self.tables.get(table_id, {}).values())
+            return [e for entries in self.tables.values() for e in entries.values()]
+
+    def load(self, table_entries, table_ids=None):
+        """Replaces the content of table_ids (default: all tables) with
+        table_entries, e.g. read from the switch"""
+        with self.lock:
+            if table_ids is None:
+                self.tables = {}
+            else:
+                for table_id in table_ids:
+                    self.tables[table_id] = {}
+            for table_entry in table_entries:
+                self.tables.setdefault(table_entry.table_id, {})[
+                    canonicalMatchKey(table_entry)] = table_entry
@@ -135,10 +135,15 @@ def program_switch(addr, device_id, sw_conf_file, workdir, proto_dump_fpath, run
         if 'table_entries' in sw_conf:
             table_entries = sw_conf['table_entries']
             info("Inserting %d table entries..." % len(table_entries))
+            batch = sw.WriteBatch()
             for entry in table_entries:
                 info(tableEntryToString(entry))
                 validateTableEntry(entry, p4info_helper, runtime_json)
-                insertTableEntry(sw, entry, p4info_helper)
+            for table_entry in buildTableEntries(table_entries, p4info_helper):
+                batch.write(table_entry)
+            for idx, p4_error in batch.commit():
+                error("Could not insert %s: %s" % (
+                    tableEntryToString(table_entries[idx]), p4_error.message))
 
         if 'multicast_group_entries' in sw_conf:
             group_entries = sw_conf['multicast_group_entries']
@@ -179,22 +184,62 @@ def validateTableEntry(flow, p4info_helper, runtime_json):
                 )
 
 
-def insertTableEntry(sw, flow, p4info_helper):
+def buildTableEntry(flow, p4info_helper):
     table_name = flow['table']
     match_fields = flow.get('match') # None if not found
     action_name = flow['action_name']
     default_action = flow.get('default_action') # None if not found
     action_params = flow['action_params']
     priority = flow.get('priority')  # None if not found
+    idle_timeout_ns = flow.get('idle_timeout_ns')  # None if not found
+
+    builder = p4info_helper.compile_table(table_name, action_name)
+    return builder.build(match_fields, action_params,
+                         priority=priority, default_action=default_action,
+                         idle_timeout_ns=idle_timeout_ns)
+
+
+def buildTableEntries(flows, p4info_helper):
+    """Builds the table entries of many flows. Flows with the same table,
+    action and match / param names are encoded together as columns. The
+    entries are returned in the order of flows."""
+    groups = {}
+    for i, flow in enumerate(flows):
+        key = (flow['table'], flow['action_name'], tuple(flow.get('match') or ()),
+               tuple(flow['action_params']), bool(flow.get('default_action')),
+               flow.get('idle_timeout_ns'))
+        groups.setdefault(key, []).append(i)
+
+    table_entries = [None] * len(flows)
+    for (table_name, action_name, match_names, param_names, default_action,
+         idle_timeout_ns), indexes in groups.items():
+        if default_action or not (match_names or param_names):
+            for i in indexes:
+                table_entries[i] = buildTableEntry(flows[i], p4info_helper)
+            continue
+        match_columns = {}
+        for name in match_names:
+            values = [flows[i]['match'][name] for i in indexes]
+            match_type = p4info_helper.get_match_field(table_name, name).match_type
+            if match_type == p4info_pb2.MatchField.EXACT:
+                values = [v[0] if isinstance(v, (list, tuple)) and len(v) == 1 else v
+                          for v in values]
+            else:
+                values = ([v[0] for v in values], [v[1] for v in values])
+            match_columns[name] = values
+        param_columns = {name: [flows[i]['action_params'][name] for i in indexes]
+                         for name in param_names}
+        priorities = [flows[i].get('priority') for i in indexes]
+        builder = p4info_helper.compile_table(table_name, action_name)
+        built = builder.build_columns(match_columns, param_columns, priorities,
+                                      idle_timeout_ns=idle_timeout_ns)
+        for i, table_entry in zip(indexes, built):
+            table_entries[i] = table_entry
+    return table_entries
 
-    table_entry = p4info_helper.buildTableEntry(
-        table_name=table_name,
-        match_fields=match_fields,
-        default_action=default_action,
-        action_name=action_name,
-        action_params=action_params,
-        priority=priority)
 
+def insertTableEntry(sw, flow, p4info_helper):
+    table_entry = buildTableEntry(flow, p4info_helper)
     sw.WriteTableEntry(table_entry)
 
 
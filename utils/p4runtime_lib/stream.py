@@ -0,0 +1,188 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from .convert import encode
+
+'''
+Processing of the StreamChannel of a switch. A StreamDispatcher owns the
+stream: a reader thread demultiplexes the StreamMessageResponses by type
+('packet', 'digest', 'idle_timeout_notification', 'error', ...) onto the
+registered handlers, which run on a bounded worker pool. Arbitration updates
+are handed back to SwitchConnection.MasterArbitrationUpdate.
+'''
+
+# What the reader does when the worker pool already has max_pending messages
+OVERFLOW_DROP = 'drop'    # drop the message and count it
+OVERFLOW_BLOCK = 'block'  # stop reading the stream until a worker is free
+
+
+class StreamDispatcher(object):
+    """Handlers are called with the payload of the message (e.g. a
+    PacketIn for 'packet'). With more than one worker, messages of the same
+    type may be handled out of order."""
+
+    def __init__(self, sw, max_workers=4, max_pending=1024, overflow=OVERFLOW_DROP):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise Exception("Unsupported overflow policy %r" % overflow)
+        self.sw = sw
+        self.max_workers = max_workers
+        self.overflow = overflow
+        self.handlers = {}
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.arbitration = Queue()
+        self.received = Counter()
+        self.dropped = Counter()
+        self.handled = Counter()
+        self.failed = Counter()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.reader = None
+        self.error = None  # error that closed the stream channel
+
+    def register(self, update_type, handler):
+        "Registers the handler of one StreamMessageResponse update type"
+        self.handlers[update_type] = handler
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix='%s-stream' % self.sw.name)
+        self.reader = threading.Thread(target=self._read, name='%s-stream-reader' % self.sw.name)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def stop(self, wait=True):
+        "Stops dispatching; the stream itself is closed by the connection shutdown"
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def waitArbitration(self, timeout=None):
+        """Returns the next arbitration update received on the stream. Raises
+        the error of the stream channel (e.g. a grpc.RpcError when the switch
+        is unreachable) as soon as it is closed."""
+        if self.error is not None and self.arbitration.empty():
+            raise self.error
+        try:
+            response = self.arbitration.get(timeout=timeout)
+        except Empty:
+            raise Exception("%s: no arbitration update within %ss" % (self.sw.name, timeout))
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def _read(self):
+        try:
+            for response in self.sw.stream_msg_resp:
+                self.dispatch(response)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.CANCELLED:
+                return
+            print("%s: stream channel closed: %s" % (self.sw.name, e.details()))
+            self.error = e
+        else:
+            self.error = Exception("%s: stream channel closed by the switch" % self.sw.name)
+        # Wakes up a pending waitArbitration
+        self.arbitration.put(self.error)
+
+    def dispatch(self, response):
+        update_type = response.WhichOneof('update')
+        with self.lock:
+            self.received[update_type] += 1
+        if update_type == 'arbitration':
+            self.arbitration.put(response)
+            return
+        handler = self.handlers.get(update_type)
+        executor = self.executor
+        if handler is None or executor is None:
+            with self.lock:
+                self.dropped[update_type] += 1
+            return
+        if not self.pending.acquire(blocking=self.overflow == OVERFLOW_BLOCK):
+            with self.lock:
+                self.dropped[update_type] += 1
+            return
+        try:
+            executor.submit(self._handle, handler, update_type, getattr(response, update_type))
+        except RuntimeError:
+            # The pool was shut down while the reader was still running
+            self.pending.release()
+
+    def _handle(self, handler, update_type, message):
+        try:
+            handler(message)
+            with self.lock:
+                self.handled[update_type] += 1
+        except Exception as e:
+            with self.lock:
+                self.failed[update_type] += 1
+            print("%s: %s handler failed: %r" % (self.sw.name, update_type, e))
+        finally:
+            self.pending.release()
+
+    def stats(self):
+        "Returns {update type: (received, handled, dropped, failed)}"
+        with self.lock:
+            return dict((t, (self.received[t], self.handled[t], self.dropped[t], self.failed[t]))
+                        for t in self.received)
+
+
+class PacketOutSender(object):
+    """Sends packet-outs on the stream channel of a switch. The metadata of
+    the packet_out header is resolved and encoded once, into a template
+    request that each packet copies; only the payload, and the metadata
+    given per packet, are set per send. Messages are not reused in place as
+    the gRPC stream serializes them asynchronously."""
+
+    def __init__(self, sw, p4info_helper=None, metadata=None,
+                 controller_header='packet_out'):
+        self.sw = sw
+        self.fields = {}  # metadata name -> (id, bitwidth)
+        if p4info_helper is not None:
+            header = p4info_helper.get('controller_packet_metadata', name=controller_header)
+            for m in header.metadata:
+                self.fields[m.name] = (m.id, m.bitwidth)
+        self.template = p4runtime_pb2.StreamMessageRequest()
+        self.template.packet.SetInParent()
+        for name, value in (metadata or {}).items():
+            self._setMetadata(self.template.packet, name, value)
+        self.sent = 0
+
+    def _setMetadata(self, packet_out, name, value):
+        metadata_id, bitwidth = self.fields[name]
+        for m in packet_out.metadata:
+            if m.metadata_id == metadata_id:
+                m.value = encode(value, bitwidth)
+                return
+        m = packet_out.metadata.add()
+        m.metadata_id = metadata_id
+        m.value = encode(value, bitwidth)
+
+    def send(self, payload, metadata=None):
+        "Sends one packet; metadata overrides values of the template"
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.CopyFrom(self.template)
+        request.packet.payload = payload
+        if metadata:
+            for name, value in metadata.items():
+                self._setMetadata(request.packet, name, value)
+        self.sw.requests_stream.put(request)
+        self.sent += 1
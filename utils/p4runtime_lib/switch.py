@@ -12,16 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import threading
 from abc import abstractmethod
 from datetime import datetime
-from queue import Queue
+from queue import Empty, Full, Queue
+from time import time
 
 import grpc
 from p4.tmp import p4config_pb2
 from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
 
+from .error_utils import parseGrpcErrorBinaryDetails
+from .journal import GrpcRequestJournal
+from .reconcile import canonicalMatchKey
+from .shadow import ShadowTables
+from .stream import OVERFLOW_DROP, PacketOutSender, StreamDispatcher
+
 MSG_LOG_MAX_LEN = 1024
 
+# Default limits used to split batched writes into several WriteRequests. The
+# size limit stays below gRPC's default 4MB max message size.
+WRITE_BATCH_MAX_UPDATES = 1000
+WRITE_BATCH_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+
+# Default number of Write RPCs kept in flight by a PipelinedWriter
+WRITE_PIPELINE_WINDOW = 32
+
 # List of all active connections
 connections = []
 
@@ -32,18 +48,32 @@ def ShutdownAllSwitchConnections():
 class SwitchConnection(object):
 
     def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
-                 proto_dump_file=None):
+                 proto_dump_file=None, proto_dump_async=False, journal=None,
+                 shadow=False):
         self.name = name
         self.address = address
         self.device_id = device_id
         self.p4info = None
+        # Optional write-through copy of the table entries written to the switch
+        self.shadow = ShadowTables() if shadow else None
         self.channel = grpc.insecure_channel(address)
+        self.request_logger = None
         if proto_dump_file is not None:
-            interceptor = GrpcRequestLogger(proto_dump_file)
-            self.channel = grpc.intercept_channel(self.channel, interceptor)
+            if proto_dump_async:
+                self.request_logger = AsyncGrpcRequestLogger(proto_dump_file)
+            else:
+                self.request_logger = GrpcRequestLogger(proto_dump_file)
+            self.channel = grpc.intercept_channel(self.channel, self.request_logger)
+        # journal is the path of a binary request journal or a JournalWriter
+        self.request_journal = None
+        if journal is not None:
+            self.request_journal = GrpcRequestJournal(journal)
+            self.channel = grpc.intercept_channel(self.channel, self.request_journal)
         self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
         self.requests_stream = IterableQueue()
         self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests_stream))
+        # Reader of the stream channel, see StartStreamDispatcher
+        self.stream_dispatcher = None
         self.proto_dump_file = proto_dump_file
         connections.append(self)
 
@@ -54,6 +84,20 @@ class SwitchConnection(object):
     def shutdown(self):
         self.requests_stream.close()
         self.stream_msg_resp.cancel()
+        if self.stream_dispatcher is not None:
+            self.stream_dispatcher.stop(wait=False)
+        if self.request_logger is not None:
+            self.request_logger.close()
+        if self.request_journal is not None:
+            self.request_journal.close()
+
+    def close(self):
+        """Shuts the connection down and releases its channel. For short-lived
+        connections, which ShutdownAllSwitchConnections then skips."""
+        self.shutdown()
+        self.channel.close()
+        if self in connections:
+            connections.remove(self)
 
     def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
         request = p4runtime_pb2.StreamMessageRequest()
@@ -65,9 +109,47 @@ class SwitchConnection(object):
             print("P4Runtime MasterArbitrationUpdate: ", request)
         else:
             self.requests_stream.put(request)
+            if self.stream_dispatcher is not None:
+                return self.stream_dispatcher.waitArbitration(timeout=10)
             for item in self.stream_msg_resp:
                 return item # just one
 
+    def StartStreamDispatcher(self, handlers=None, max_workers=4, max_pending=1024,
+                              overflow=OVERFLOW_DROP):
+        """Starts a reader thread that dispatches all the messages of the stream
+        channel to handlers ({update type: callable}, more can be registered
+        later on the returned StreamDispatcher)"""
+        dispatcher = StreamDispatcher(self, max_workers=max_workers,
+                                      max_pending=max_pending, overflow=overflow)
+        for update_type, handler in (handlers or {}).items():
+            dispatcher.register(update_type, handler)
+        self.stream_dispatcher = dispatcher
+        dispatcher.start()
+        return dispatcher
+
+    def WriteDigestEntry(self, digest_entry, update_type=p4runtime_pb2.Update.INSERT,
+                         dry_run=False):
+        "Subscribes to a digest (or updates / removes the subscription)"
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        request.election_id.low = 1
+        update = request.updates.add()
+        update.type = update_type
+        update.entity.digest_entry.CopyFrom(digest_entry)
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            self.client_stub.Write(request)
+
+    def DigestListAck(self, digest_id, list_id):
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.digest_ack.digest_id = digest_id
+        request.digest_ack.list_id = list_id
+        self.requests_stream.put(request)
+
+    def PacketOutSender(self, p4info_helper=None, metadata=None):
+        return PacketOutSender(self, p4info_helper=p4info_helper, metadata=metadata)
+
     def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
         device_config = self.buildDeviceConfig(**kwargs)
         request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
@@ -99,6 +181,37 @@ class SwitchConnection(object):
             print("P4Runtime Write:", request)
         else:
             self.client_stub.Write(request)
+            if self.shadow is not None:
+                self.shadow.applyUpdates(request.updates)
+
+    def WriteTableEntries(self, table_entries, max_batch=WRITE_BATCH_MAX_UPDATES,
+                          max_bytes=WRITE_BATCH_MAX_BYTES, dry_run=False):
+        """Writes several table entries using as few WriteRequests as possible.
+        Entries are inserted, or modified for default actions, exactly like
+        WriteTableEntry does. Returns the list of (index, p4.Error) for the
+        entries rejected by the switch."""
+        batch = self.WriteBatch(max_batch=max_batch, max_bytes=max_bytes)
+        for table_entry in table_entries:
+            batch.write(table_entry)
+        return batch.commit(dry_run=dry_run)
+
+    def WriteBatch(self, max_batch=WRITE_BATCH_MAX_UPDATES,
+                   max_bytes=WRITE_BATCH_MAX_BYTES):
+        return WriteBatch(self, max_batch=max_batch, max_bytes=max_bytes)
+
+    def PipelinedWriter(self, window=WRITE_PIPELINE_WINDOW):
+        return PipelinedWriter(self, window=window)
+
+    def ResyncShadow(self, table_ids=None):
+        """Reloads the shadow tables (all of them, or only table_ids) from the
+        entries read from the switch"""
+        if self.shadow is None:
+            self.shadow = ShadowTables()
+        entries = []
+        for table_id in (table_ids if table_ids is not None else [None]):
+            for response in self.ReadTableEntries(table_id=table_id):
+                entries.extend(entity.table_entry for entity in response.entities)
+        self.shadow.load(entries, table_ids)
 
     def ReadTableEntries(self, table_id=None, dry_run=False):
         request = p4runtime_pb2.ReadRequest()
@@ -132,6 +245,19 @@ class SwitchConnection(object):
             for response in self.client_stub.Read(request):
                 yield response
 
+    def ReadEntities(self, entities, dry_run=False):
+        """Reads several entity filters (see P4InfoHelper.buildReadEntities)
+        in a single ReadRequest and yields the returned entities one by one,
+        as the response stream arrives"""
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        request.entities.extend(entities)
+        if dry_run:
+            print("P4Runtime Read:", request)
+        else:
+            for response in self.client_stub.Read(request):
+                for entity in response.entities:
+                    yield entity
 
     def WritePREEntry(self, pre_entry, dry_run=False):
         request = p4runtime_pb2.WriteRequest()
@@ -145,6 +271,232 @@ class SwitchConnection(object):
         else:
             self.client_stub.Write(request)
 
+class WriteBatch(object):
+    """Accumulates INSERT / MODIFY / DELETE updates and sends them to the switch
+    in batched WriteRequests, split at max_batch updates or max_bytes bytes."""
+
+    def __init__(self, sw, max_batch=WRITE_BATCH_MAX_UPDATES,
+                 max_bytes=WRITE_BATCH_MAX_BYTES):
+        self.sw = sw
+        self.max_batch = max_batch
+        self.max_bytes = max_bytes
+        self.updates = []
+
+    def __len__(self):
+        return len(self.updates)
+
+    def add(self, update_type, entity):
+        update = p4runtime_pb2.Update()
+        update.type = update_type
+        update.entity.CopyFrom(entity)
+        self.updates.append(update)
+        return update
+
+    def insert(self, table_entry):
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.INSERT
+        update.entity.table_entry.CopyFrom(table_entry)
+        self.updates.append(update)
+        return update
+
+    def modify(self, table_entry):
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.MODIFY
+        update.entity.table_entry.CopyFrom(table_entry)
+        self.updates.append(update)
+        return update
+
+    def delete(self, table_entry):
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.DELETE
+        update.entity.table_entry.CopyFrom(table_entry)
+        self.updates.append(update)
+        return update
+
+    def write(self, table_entry):
+        # Same semantics as SwitchConnection.WriteTableEntry
+        if table_entry.is_default_action:
+            return self.modify(table_entry)
+        return self.insert(table_entry)
+
+    def upsert(self, table_entry):
+        """Inserts the entry, or modifies it if an entry with the same match is
+        in the switch's shadow tables. Entries already installed with the same
+        action are skipped. Requires a SwitchConnection with shadow tables."""
+        shadow = self.sw.shadow
+        existing = shadow.get(table_entry)
+        if existing is None:
+            return self.write(table_entry)
+        if shadow.matches(table_entry):
+            return None
+        return self.modify(table_entry)
+
+    def insertPREEntry(self, pre_entry):
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.INSERT
+        update.entity.packet_replication_engine_entry.CopyFrom(pre_entry)
+        self.updates.append(update)
+        return update
+
+    def requests(self):
+        """Yields (offset, WriteRequest) tuples, offset being the index of the
+        first update of the request in the batch."""
+        request = None
+        offset = 0
+        size = 0
+        for i, update in enumerate(self.updates):
+            update_size = update.ByteSize()
+            if request is not None and (len(request.updates) >= self.max_batch or
+                                        size + update_size > self.max_bytes):
+                yield offset, request
+                request = None
+            if request is None:
+                request = p4runtime_pb2.WriteRequest()
+                request.device_id = self.sw.device_id
+                request.election_id.low = 1
+                offset = i
+                size = request.ByteSize()
+            request.updates.add().CopyFrom(update)
+            # tag + length prefix of the repeated field
+            size += update_size + 8
+        if request is not None:
+            yield offset, request
+
+    def commit(self, dry_run=False):
+        """Sends all pending updates. Returns a list of (index, p4.Error) tuples
+        for the updates rejected by the switch, index being the position of the
+        update in the batch. gRPC errors without per-update details are
+        re-raised."""
+        errors = []
+        for offset, request in self.requests():
+            if dry_run:
+                print("P4Runtime Write:", request)
+                continue
+            try:
+                self.sw.client_stub.Write(request)
+            except grpc.RpcError as e:
+                p4_errors = parseGrpcErrorBinaryDetails(e)
+                if p4_errors is None:
+                    raise
+                errors.extend((offset + idx, p4_error) for idx, p4_error in p4_errors)
+                if self.sw.shadow is not None:
+                    failed = set(idx for idx, _ in p4_errors)
+                    self.sw.shadow.applyUpdates(
+                        u for idx, u in enumerate(request.updates) if idx not in failed)
+                continue
+            if self.sw.shadow is not None:
+                self.sw.shadow.applyUpdates(request.updates)
+        self.updates = []
+        return errors
+
+class PipelinedWriter(object):
+    """Sends one WriteRequest per update, like WriteTableEntry, but keeps up to
+    `window` of them in flight with Write.future instead of waiting for each
+    response. Errors are collected as the responses arrive and reported per
+    update by flush().
+
+    Ordering: an update of a table entry is only sent once the previous
+    update of the same entry (same canonical match key) has completed, so an
+    INSERT followed by a MODIFY or DELETE of that entry is never reordered.
+    Use barrier() when other updates depend on each other."""
+
+    def __init__(self, sw, window=WRITE_PIPELINE_WINDOW):
+        self.sw = sw
+        self.window = window
+        self.cond = threading.Condition()
+        self.in_flight = {}  # update index -> canonical match key or None
+        self.in_flight_keys = {}  # canonical match key -> update index
+        self.errors = []
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.barrier()
+
+    def add(self, update_type, entity):
+        """Sends an update, blocking while the window is full. Returns the
+        index of the update, used to report its error."""
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.sw.device_id
+        request.election_id.low = 1
+        update = request.updates.add()
+        update.type = update_type
+        update.entity.CopyFrom(entity)
+        key = None
+        if entity.WhichOneof('entity') == 'table_entry':
+            key = canonicalMatchKey(entity.table_entry)
+        with self.cond:
+            while len(self.in_flight) >= self.window or (
+                    key is not None and key in self.in_flight_keys):
+                self.cond.wait()
+            index = self.sent
+            self.sent += 1
+            self.in_flight[index] = key
+            if key is not None:
+                self.in_flight_keys[key] = index
+        future = self.sw.client_stub.Write.future(request)
+        future.add_done_callback(lambda f: self._done(index, request, f))
+        return index
+
+    def _tableEntryUpdate(self, update_type, table_entry):
+        entity = p4runtime_pb2.Entity()
+        entity.table_entry.CopyFrom(table_entry)
+        return self.add(update_type, entity)
+
+    def insert(self, table_entry):
+        return self._tableEntryUpdate(p4runtime_pb2.Update.INSERT, table_entry)
+
+    def modify(self, table_entry):
+        return self._tableEntryUpdate(p4runtime_pb2.Update.MODIFY, table_entry)
+
+    def delete(self, table_entry):
+        return self._tableEntryUpdate(p4runtime_pb2.Update.DELETE, table_entry)
+
+    def write(self, table_entry):
+        # Same semantics as SwitchConnection.WriteTableEntry
+        if table_entry.is_default_action:
+            return self.modify(table_entry)
+        return self.insert(table_entry)
+
+    def _done(self, index, request, future):
+        error = future.exception()
+        if error is None:
+            if self.sw.shadow is not None:
+                self.sw.shadow.applyUpdates(request.updates)
+        else:
+            p4_errors = None
+            if isinstance(error, grpc.RpcError):
+                p4_errors = parseGrpcErrorBinaryDetails(error)
+            with self.cond:
+                if p4_errors:
+                    self.errors.extend((index, p4_error) for _, p4_error in p4_errors)
+                else:
+                    self.errors.append((index, error))
+        with self.cond:
+            key = self.in_flight.pop(index)
+            if key is not None and self.in_flight_keys.get(key) == index:
+                del self.in_flight_keys[key]
+            self.cond.notify_all()
+
+    def barrier(self):
+        "Waits until all the updates sent so far have completed"
+        with self.cond:
+            while self.in_flight:
+                self.cond.wait()
+
+    def flush(self):
+        """Waits for all the updates in flight and returns the list of
+        (index, error) of the failed ones since the last flush, sorted by
+        index. error is a p4.Error, or the gRPC error when the switch did not
+        send per-update details."""
+        self.barrier()
+        with self.cond:
+            errors = sorted(self.errors, key=lambda e: e[0])
+            self.errors = []
+        return errors
+
 class GrpcRequestLogger(grpc.UnaryUnaryClientInterceptor,
                         grpc.UnaryStreamClientInterceptor):
     """Implementation of a gRPC interceptor that logs request to a file"""
@@ -155,16 +507,22 @@ class GrpcRequestLogger(grpc.UnaryUnaryClientInterceptor,
             # Clear content if it exists.
             f.write("")
 
+    def format_message(self, timestamp, method_name, body):
+        ts = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        msg = str(body)
+        out = "\n[%s] %s\n---\n" % (ts, method_name)
+        if len(msg) < MSG_LOG_MAX_LEN:
+            out += msg
+        else:
+            out += "Message too long (%d bytes)! Skipping log...\n" % len(msg)
+        return out + '---\n'
+
     def log_message(self, method_name, body):
         with open(self.log_file, 'a') as f:
-            ts = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            msg = str(body)
-            f.write("\n[%s] %s\n---\n" % (ts, method_name))
-            if len(msg) < MSG_LOG_MAX_LEN:
-                f.write(str(body))
-            else:
-                f.write("Message too long (%d bytes)! Skipping log...\n" % len(msg))
-            f.write('---\n')
+            f.write(self.format_message(datetime.utcnow(), method_name, body))
+
+    def close(self):
+        pass
 
     def intercept_unary_unary(self, continuation, client_call_details, request):
         self.log_message(client_call_details.method, request)
@@ -174,6 +532,69 @@ class GrpcRequestLogger(grpc.UnaryUnaryClientInterceptor,
         self.log_message(client_call_details.method, request)
         return continuation(client_call_details, request)
 
+class AsyncGrpcRequestLogger(GrpcRequestLogger):
+    """Request logger that keeps formatting and file I/O out of the gRPC calls.
+    The interceptor only enqueues the request; a background thread keeps the
+    log file open, formats queued requests in batches and flushes the file
+    every flush_interval seconds. When the queue is full, requests are dropped
+    and counted in `dropped`. Logged messages must not be modified after they
+    are sent."""
+
+    _sentinel = object()
+
+    def __init__(self, log_file, max_queue=10000, batch_size=256, flush_interval=0.5):
+        super(AsyncGrpcRequestLogger, self).__init__(log_file)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()  # dropped is counted by the gRPC callers
+        self.queue = Queue(maxsize=max_queue)
+        self.file = open(self.log_file, 'w')
+        self.thread = threading.Thread(target=self._writer, daemon=True,
+                                       name='grpc-request-logger')
+        self.thread.start()
+
+    def log_message(self, method_name, body):
+        try:
+            self.queue.put_nowait((time(), method_name, body))
+        except Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def _writer(self):
+        last_flush = time()
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except Empty:
+                batch = []
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if self._sentinel in batch:
+                batch.remove(self._sentinel)
+                running = False
+            if batch:
+                self.file.write(''.join(
+                    self.format_message(datetime.utcfromtimestamp(ts), method_name, body)
+                    for ts, method_name, body in batch))
+            if not running or time() - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = time()
+        with self.dropped_lock:
+            dropped = self.dropped
+        if dropped:
+            self.file.write("\n%d messages dropped (log queue full)\n" % dropped)
+        self.file.close()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self._sentinel)
+            self.thread.join()
+
 class IterableQueue(Queue):
     _sentinel = object()
 
@@ -0,0 +1,377 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import csv
+import os
+import threading
+
+import numpy as np
+
+'''
+Fixed-memory, in-process time-series store for counter and register samples.
+Each (switch, counter) series is a preallocated NumPy ring buffer of full
+arrays (one row per sample, one column per index) with a timestamp column.
+Samples evicted from the ring are downsampled into a second, coarser ring, so
+that older data is kept at a lower resolution without growing the memory.
+'''
+
+
+class RingBuffer(object):
+    """Preallocated ring of `capacity` samples. Each sample has a timestamp
+    and, for every field, an array of `width` values."""
+
+    def __init__(self, capacity, width, fields, dtype=np.int64):
+        self.capacity = capacity
+        self.width = width
+        self.fields = tuple(fields)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.columns = dict((field, np.zeros((capacity, width), dtype=dtype))
+                            for field in self.fields)
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(c.nbytes for c in self.columns.values())
+
+    def full(self):
+        return self.count == self.capacity
+
+    def oldest(self):
+        "Returns (timestamp, {field: values}) of the oldest sample"
+        slot = (self.head - self.count) % self.capacity
+        return self.timestamps[slot], dict((f, c[slot].copy()) for f, c in self.columns.items())
+
+    def append(self, timestamp, values):
+        "values maps each field to an array of width values"
+        slot = self.head
+        self.timestamps[slot] = timestamp
+        for field in self.fields:
+            self.columns[field][slot] = values[field]
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _order(self):
+        start = (self.head - self.count) % self.capacity
+        return (np.arange(self.count) + start) % self.capacity
+
+    def window(self, start=None, end=None):
+        """Returns (timestamps, {field: 2D values}) of the samples with
+        start <= timestamp <= end, oldest first"""
+        order = self._order()
+        timestamps = self.timestamps[order]
+        mask = np.ones(len(order), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        order = order[mask]
+        return (self.timestamps[order],
+                dict((f, c[order]) for f, c in self.columns.items()))
+
+
+class TimeSeries(object):
+    """Samples of one counter or register array of one switch. The most recent
+    `capacity` samples are kept at full resolution; older samples are merged,
+    `downsample` at a time, into a ring of `coarse_capacity` samples.
+    aggregate is 'last' for cumulative counters (keeping the last value of each
+    group preserves rates exactly) or 'mean' for gauges such as registers.
+    Evicted samples still waiting to be merged are not returned by queries."""
+
+    def __init__(self, width, fields=('packets', 'bytes'), capacity=60,
+                 coarse_capacity=60, downsample=10, aggregate='last', dtype=None):
+        if aggregate not in ('last', 'mean'):
+            raise Exception("Unsupported aggregate %r" % aggregate)
+        if dtype is None:
+            dtype = np.int64 if aggregate == 'last' else np.float64
+        self.fields = tuple(fields)
+        self.aggregate = aggregate
+        self.downsample = downsample
+        self.raw = RingBuffer(capacity, width, fields, dtype)
+        self.coarse = None
+        if coarse_capacity and downsample > 1:
+            self.coarse = RingBuffer(coarse_capacity, width, fields, dtype)
+        self._pending = []
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes + (self.coarse.nbytes if self.coarse is not None else 0)
+
+    def __len__(self):
+        return len(self.raw) + (len(self.coarse) if self.coarse is not None else 0)
+
+    def append(self, timestamp, values):
+        with self.lock:
+            if self.raw.full() and self.coarse is not None:
+                self._evict(*self.raw.oldest())
+            self.raw.append(timestamp, values)
+
+    def _evict(self, timestamp, values):
+        self._pending.append((timestamp, values))
+        if len(self._pending) < self.downsample:
+            return
+        if self.aggregate == 'last':
+            timestamp, values = self._pending[-1]
+        else:
+            timestamp = np.mean([t for t, _ in self._pending])
+            values = dict((f, np.mean([v[f] for _, v in self._pending], axis=0))
+                          for f in self.fields)
+        self.coarse.append(timestamp, values)
+        self._pending = []
+
+    def window(self, seconds=None, end=None):
+        """Returns (timestamps, {field: 2D values}) of the last `seconds`
+        before end (default: the last sample), coarse samples included"""
+        with self.lock:
+            if end is None and len(self.raw):
+                end = self.raw.timestamps[(self.raw.head - 1) % self.raw.capacity]
+            start = end - seconds if seconds is not None and end is not None else None
+            timestamps, values = self.raw.window(start, end)
+            if self.coarse is not None and len(self.coarse):
+                if len(timestamps):
+                    # Coarse samples strictly older than the raw ones
+                    coarse_end = np.nextafter(timestamps[0], -np.inf)
+                    if end is not None:
+                        coarse_end = min(coarse_end, end)
+                else:
+                    coarse_end = end
+                coarse_ts, coarse_values = self.coarse.window(start, coarse_end)
+                timestamps = np.concatenate([coarse_ts, timestamps])
+                values = dict((f, np.concatenate([coarse_values[f], values[f]]))
+                              for f in self.fields)
+            return timestamps, values
+
+    def _series(self, field, seconds, index):
+        timestamps, values = self.window(seconds)
+        values = values[field]
+        if index is not None:
+            values = values[:, index]
+        return timestamps, values
+
+    def _deltas(self, field, seconds, index):
+        timestamps, values = self._series(field, seconds, index)
+        if len(timestamps) < 2:
+            return timestamps, values[1:]
+        deltas = np.diff(values, axis=0)
+        # A value lower than the previous one is a counter reset
+        deltas = np.where(deltas >= 0, deltas, values[1:])
+        return timestamps, deltas
+
+    def rates(self, field='packets', seconds=None, index=None):
+        "Returns (timestamps, per-interval rates) of a cumulative field"
+        timestamps, deltas = self._deltas(field, seconds, index)
+        intervals = np.diff(timestamps)
+        if deltas.ndim > 1:
+            intervals = intervals[:, np.newaxis]
+        return timestamps[1:], deltas / intervals
+
+    def rate(self, field='packets', seconds=None, index=None):
+        """Average rate of a cumulative field over the window, per index (or
+        of one index). None with fewer than two samples."""
+        timestamps, deltas = self._deltas(field, seconds, index)
+        if len(timestamps) < 2:
+            return None
+        return deltas.sum(axis=0) / (timestamps[-1] - timestamps[0])
+
+    def percentile(self, q, field='packets', seconds=None, index=None, rates=True):
+        """q-th percentile over the window of the per-interval rates (or of the
+        raw values with rates=False, e.g. for registers)"""
+        if rates:
+            _, series = self.rates(field, seconds, index)
+        else:
+            _, series = self._series(field, seconds, index)
+        if not len(series):
+            return None
+        return np.percentile(series, q, axis=0)
+
+    def ewma(self, alpha, field='packets', seconds=None, index=None, rates=True):
+        """Exponentially weighted moving average over the window, oldest
+        sample first, of the per-interval rates (or of the raw values)"""
+        if rates:
+            _, series = self.rates(field, seconds, index)
+        else:
+            _, series = self._series(field, seconds, index)
+        if not len(series):
+            return None
+        average = series[0].astype(np.float64)
+        for value in series[1:]:
+            average = alpha * value + (1 - alpha) * average
+        return average
+
+    def to_csv(self, path, seconds=None, indexes=None):
+        """Writes the window in long format: one row per (sample, index), with
+        the timestamp, the index and one column per field"""
+        timestamps, values = self.window(seconds)
+        if indexes is None:
+            indexes = range(self.raw.width)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('timestamp', 'index') + self.fields)
+            for row, timestamp in enumerate(timestamps):
+                for index in indexes:
+                    writer.writerow([repr(float(timestamp)), index] +
+                                    [values[field][row, index] for field in self.fields])
+
+    def to_npz(self, path, seconds=None):
+        """Writes the window as a compressed columnar .npz file, with a
+        'timestamp' column and a 2D (sample, index) column per field"""
+        timestamps, values = self.window(seconds)
+        columns = dict(values)
+        columns['timestamp'] = timestamps
+        np.savez_compressed(path, **columns)
+
+
+class TimeSeriesStore(object):
+    """TimeSeries by (switch name, counter name), all with the same ring
+    sizes. When max_bytes is set, a series that would exceed that memory
+    budget is not created: its samples are dropped, with a warning, and its
+    key is added to `dropped`."""
+
+    def __init__(self, capacity=60, coarse_capacity=60, downsample=10, max_bytes=None):
+        self.capacity = capacity
+        self.coarse_capacity = coarse_capacity
+        self.downsample = downsample
+        self.max_bytes = max_bytes
+        self.series = {}
+        self.dropped = set()  # (switch, name) of the series over the budget
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, n_series, width, max_bytes, fields=('packets', 'bytes'), capacity=60,
+            coarse_capacity=60, downsample=10):
+        """Returns a store in which n_series series of width values fit within
+        max_bytes, both rings being shrunk in proportion if needed. None when
+        not even two raw samples per series fit."""
+        if not coarse_capacity or downsample <= 1:
+            coarse_capacity = 0
+        row_bytes = cls.seriesBytes(width, fields, 1, 0, downsample)
+        rows = max_bytes // (max(n_series, 1) * row_bytes)
+        if rows >= capacity + coarse_capacity:
+            return cls(capacity, coarse_capacity, downsample, max_bytes)
+        if rows < 2:
+            return None
+        raw_rows = max(2, rows * capacity // (capacity + coarse_capacity))
+        return cls(raw_rows, rows - raw_rows, downsample, max_bytes)
+
+    @staticmethod
+    def seriesBytes(width, fields=('packets', 'bytes'), capacity=60, coarse_capacity=60,
+                    downsample=10):
+        "Memory of one series of width values (timestamps included)"
+        rows = capacity + (coarse_capacity if coarse_capacity and downsample > 1 else 0)
+        return rows * (8 + width * len(fields) * 8)
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self.series.values())
+
+    def get(self, switch, name):
+        return self.series.get((switch, name))
+
+    def create(self, switch, name, width, fields=('packets', 'bytes'), aggregate='last'):
+        "Returns the series, None if it does not fit in the memory budget"
+        with self.lock:
+            series = self.series.get((switch, name))
+            if series is not None or (switch, name) in self.dropped:
+                return series
+            needed = self.seriesBytes(width, fields, self.capacity, self.coarse_capacity,
+                                      self.downsample)
+            if self.max_bytes is not None and self.nbytes + needed > self.max_bytes:
+                print("Warning: dropping the samples of %s %s, the series needs %d bytes "
+                      "over the budget of %d bytes" % (switch, name, needed, self.max_bytes))
+                self.dropped.add((switch, name))
+                return None
+            series = TimeSeries(width, fields, self.capacity, self.coarse_capacity,
+                                self.downsample, aggregate)
+            self.series[(switch, name)] = series
+            return series
+
+    def record(self, switch, name, timestamp, values, aggregate='last'):
+        "values maps field names to arrays, e.g. {'value': register values}"
+        series = self.get(switch, name)
+        if series is None:
+            width = len(next(iter(values.values())))
+            series = self.create(switch, name, width, tuple(values), aggregate)
+            if series is None:
+                return
+        series.append(timestamp, values)
+
+    def record_counter_samples(self, samples):
+        "Stores a poll of CounterSamples; usable as a CounterCollector listener"
+        for sample in samples:
+            self.record(sample.switch, sample.counter, sample.timestamp,
+                        {'packets': sample.packets, 'bytes': sample.bytes})
+
+    def export(self, directory, format='npz', seconds=None):
+        """Writes one <switch>-<name>.npz (or .csv) file per series in
+        directory. Returns the paths of the written files."""
+        if format not in ('npz', 'csv'):
+            raise Exception("Unsupported export format %r" % format)
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for (switch, name), series in sorted(self.series.items()):
+            path = os.path.join(directory, '%s-%s.%s' % (switch, name, format))
+            if format == 'npz':
+                series.to_npz(path, seconds)
+            else:
+                series.to_csv(path, seconds)
+            paths.append(path)
+        return paths
+
+
+if __name__ == '__main__':
+    # Downsampling: 'last' keeps the last sample of each group of downsample
+    series = TimeSeries(2, capacity=4, coarse_capacity=3, downsample=2)
+    for t in range(10):
+        series.append(float(t), {'packets': np.array([t, 10 * t]), 'bytes': np.array([0, t])})
+    timestamps, values = series.window()
+    # 6..9 raw, 0..5 evicted into 3 coarse samples: 1, 3, 5
+    assert(list(timestamps) == [1.0, 3.0, 5.0, 6.0, 7.0, 8.0, 9.0])
+    assert(list(values['packets'][:, 1]) == [10, 30, 50, 60, 70, 80, 90])
+    assert(series.rate('packets', index=1) == 10.0)
+    assert(list(series.window(2)[0]) == [7.0, 8.0, 9.0])
+
+    # 'mean' averages each group
+    gauge = TimeSeries(1, fields=('value',), capacity=2, coarse_capacity=2, downsample=2,
+                       aggregate='mean')
+    for t in range(6):
+        gauge.append(float(t), {'value': np.array([t])})
+    timestamps, values = gauge.window()
+    assert(list(timestamps) == [0.5, 2.5, 4.0, 5.0])
+    assert(list(values['value'][:, 0]) == [0.5, 2.5, 4.0, 5.0])
+
+    # Counter reset: the whole value counts as the delta
+    reset = TimeSeries(1, fields=('packets',), coarse_capacity=0)
+    for t, v in enumerate([10, 20, 5]):
+        reset.append(float(t), {'packets': np.array([v])})
+    assert(list(reset.rates('packets', index=0)[1]) == [10.0, 5.0])
+
+    # Rings shrunk so that all the series fit
+    store = TimeSeriesStore.fit(20, 8192, 64 * 1024 * 1024)
+    assert((store.capacity, store.coarse_capacity) == (12, 13))
+    assert(20 * store.seriesBytes(8192, capacity=12, coarse_capacity=13) <= store.max_bytes)
+    assert(TimeSeriesStore.fit(4, 8192, 64 * 1024 * 1024).capacity == 60)
+    assert(TimeSeriesStore.fit(1000, 8192, 64 * 1024 * 1024) is None)
+
+    # Series over the memory budget are dropped, not raised
+    width = 8192
+    store = TimeSeriesStore(max_bytes=2 * TimeSeriesStore.seriesBytes(width))
+    for switch in ('r1', 'r2', 'r3'):
+        store.record(switch, 'c', 0.0, {'packets': np.zeros(width), 'bytes': np.zeros(width)})
+    assert(sorted(s for s, _ in store.series) == ['r1', 'r2'])
+    assert(store.dropped == set([('r3', 'c')]))
+    assert(store.nbytes <= store.max_bytes)
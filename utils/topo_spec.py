@@ -0,0 +1,231 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Declarative router topologies. A spec file (JSON) describes the shape of
+# the network (a ring or a full mesh of N routers, or a k-ary fat-tree) and
+# how many hosts hang off each router; TopoSpec derives from it every name,
+# port, MAC and IPv4 address, the shortest path routes of each router, and
+# the ROUTERS descriptions used by the controller. mininet/r-topo.py builds
+# the Mininet topology from the same TopoSpec.
+#
+# Addressing: router i (r1, r2, ...) owns the i-th /24 of the spec network
+# (10.0.1.0/24 for r1 with the default 10.0.0.0/8). Its hosts get the first
+# addresses of that subnet, its port p the address .(255 - p). Neighbor
+# ports are numbered from 1 in link order, the LAN port comes last.
+#
+import ipaddress
+import json
+from collections import deque
+
+KIND_RING = 'ring'
+KIND_MESH = 'mesh'
+KIND_FAT_TREE = 'fat-tree'
+KINDS = (KIND_RING, KIND_MESH, KIND_FAT_TREE)
+
+SPEC_DEFAULTS = {
+    'routers': 3,
+    'k': 4,
+    'hosts_per_router': 1,
+    'network': '10.0.0.0/8',
+    'grpc_port': 50051,
+    'thrift_port': 9091,
+    'cpu_port': 510,
+    'allowed_protocols': [0, 1, 6],
+}
+
+
+def loadSpec(path):
+    "Reads a spec file, filling in the defaults"
+    with open(path) as f:
+        spec = json.load(f)
+    return dict(SPEC_DEFAULTS, **spec)
+
+
+def ringLinks(n):
+    if n < 2:
+        return []
+    if n == 2:
+        return [(0, 1)]
+    return [(i, (i + 1) % n) for i in range(n)]
+
+
+def meshLinks(n):
+    return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+
+def fatTreeLinks(k):
+    """Returns (number of routers, links, edge routers) of a k-ary fat-tree:
+    (k/2)^2 core routers, then for each of the k pods k/2 aggregation and
+    k/2 edge routers"""
+    if k < 2 or k % 2:
+        raise Exception("Fat-tree arity must be even, not %r" % k)
+    half = k // 2
+    n_core = half * half
+    links = []
+    edges = []
+    for pod in range(k):
+        aggs = [n_core + pod * k + a for a in range(half)]
+        pod_edges = [n_core + pod * k + half + e for e in range(half)]
+        for a, agg in enumerate(aggs):
+            for c in range(half):
+                links.append((a * half + c, agg))
+        for edge in pod_edges:
+            for agg in aggs:
+                links.append((agg, edge))
+        edges.extend(pod_edges)
+    return n_core + k * k, links, edges
+
+
+def _mac(prefix, index, port):
+    return "%s:%02x:%02x:00:%02x" % (prefix, index >> 8, index & 0xff, port)
+
+
+class Interface(object):
+    __slots__ = ('port', 'mac', 'ip')
+
+    def __init__(self, port, mac, ip):
+        self.port = port
+        self.mac = mac
+        self.ip = ip
+
+
+class HostSpec(object):
+    def __init__(self, name, ip, mac, prefix_len, gateway):
+        self.name = name
+        self.ip = ip
+        self.mac = mac
+        self.prefix_len = prefix_len
+        self.gateway = gateway  # Interface of the router LAN port
+
+
+class RouterSpec(object):
+    def __init__(self, index, subnet, grpc_port, thrift_port):
+        self.index = index
+        self.name = 'r%d' % index
+        self.device_id = index
+        self.subnet = subnet
+        self.grpc_port = grpc_port
+        self.thrift_port = thrift_port
+        self.interfaces = {}  # port -> Interface
+        self.neighbors = {}   # port -> (RouterSpec, port of the neighbor)
+        self.lan_port = None
+        self.lan_switch = None
+        self.hosts = []
+
+    def addInterface(self, port):
+        if port >= 255 - len(self.hosts):
+            raise Exception("%s: no address left for port %d in %s" % (self.name, port, self.subnet))
+        interface = Interface(port, _mac("00:aa", self.index, port),
+                              str(self.subnet.network_address + 255 - port))
+        self.interfaces[port] = interface
+        return interface
+
+
+class TopoSpec(object):
+    "All the routers, links and hosts of a spec"
+
+    def __init__(self, spec):
+        kind = spec['kind']
+        if kind not in KINDS:
+            raise Exception("Unknown topology kind %r, expected one of %s" % (kind, ', '.join(KINDS)))
+        self.spec = spec
+        self.cpu_port = spec['cpu_port']
+        if kind == KIND_FAT_TREE:
+            n_routers, links, with_hosts = fatTreeLinks(spec['k'])
+        else:
+            n_routers = spec['routers']
+            links = ringLinks(n_routers) if kind == KIND_RING else meshLinks(n_routers)
+            with_hosts = range(n_routers)
+
+        network = ipaddress.ip_network(spec['network'])
+        subnets = network.subnets(new_prefix=24)
+        if n_routers >= network.num_addresses // 256:
+            raise Exception("%s is too small for %d routers" % (network, n_routers))
+        next(subnets)  # r1 gets the second /24, e.g. 10.0.1.0/24
+        self.routers = [RouterSpec(i + 1, next(subnets), spec['grpc_port'] + i,
+                                   spec['thrift_port'] + i)
+                        for i in range(n_routers)]
+
+        # Hosts first, so that the port addresses cannot collide with them
+        self.hosts = []
+        for i in with_hosts:
+            router = self.routers[i]
+            for j in range(spec['hosts_per_router']):
+                router.hosts.append(HostSpec(
+                    'h%d_%d' % (router.index, j + 1),
+                    str(router.subnet.network_address + 1 + j),
+                    _mac("00:04", router.index, j + 1),
+                    router.subnet.prefixlen, None))
+            self.hosts.extend(router.hosts)
+
+        self.links = []  # (router, port, router, port)
+        for a, b in links:
+            a, b = self.routers[a], self.routers[b]
+            port_a, port_b = len(a.neighbors) + 1, len(b.neighbors) + 1
+            a.addInterface(port_a)
+            b.addInterface(port_b)
+            a.neighbors[port_a] = (b, port_b)
+            b.neighbors[port_b] = (a, port_a)
+            self.links.append((a, port_a, b, port_b))
+
+        for router in self.routers:
+            if router.hosts:
+                router.lan_port = len(router.neighbors) + 1
+                router.lan_switch = 's%d' % router.index
+                gateway = router.addInterface(router.lan_port)
+                for host in router.hosts:
+                    host.gateway = gateway
+
+    def nextHops(self, router):
+        """Returns {destination router: (port, neighbor Interface)} for the
+        first hop of a shortest path from router (BFS, lowest port first)"""
+        first_hops = {router: None}
+        queue = deque([router])
+        while queue:
+            current = queue.popleft()
+            for port in sorted(current.neighbors):
+                neighbor, neighbor_port = current.neighbors[port]
+                if neighbor in first_hops:
+                    continue
+                if current is router:
+                    first_hops[neighbor] = (port, neighbor.interfaces[neighbor_port])
+                else:
+                    first_hops[neighbor] = first_hops[current]
+                queue.append(neighbor)
+        del first_hops[router]
+        return first_hops
+
+    def routes(self, router):
+        "Returns the routes of router as (dstAddr, mask, nextHop, port, dstMac)"
+        routes = [(host.ip, 32, host.ip, router.lan_port, host.mac) for host in router.hosts]
+        for destination, (port, interface) in sorted(self.nextHops(router).items(),
+                                                     key=lambda item: item[0].index):
+            routes.append((str(destination.subnet.network_address), destination.subnet.prefixlen,
+                           interface.ip, port, interface.mac))
+        return routes
+
+    def controllerRouters(self):
+        "Returns the router descriptions in the format of the controller ROUTERS"
+        return [{
+            'name': router.name,
+            'address': '127.0.0.1:%d' % router.grpc_port,
+            'device_id': router.device_id,
+            'port_mac': dict((port, i.mac) for port, i in sorted(router.interfaces.items())),
+            'routes': self.routes(router),
+            'firewall': [],
+            'allowed_protocols': list(self.spec['allowed_protocols']),
+            'icmp_interfaces': [i.ip for port, i in sorted(router.interfaces.items())],
+        } for router in self.routers]